@@ -3,6 +3,14 @@ NETLIST.py - Netlist traversing functions
 """
 
 import copy
+import cPickle
+import hashlib
+import logging
+import os
+import re
+import tempfile
+
+log = logging.getLogger( "netlist" )
 
 def load_asc_netlist( filename ):
     """
@@ -34,16 +42,16 @@ def load_asc_netlist( filename ):
         ["CONNECTION"] = { Signal: [ Ref.Pin, ... ], ... }
         ["REF.PIN"] = { Ref.Pin: Signal, ... }
         ["PINS"] = { Ref: [Pins, ... ] }
+        ["PIN.NET"] = { Ref: { Pin: Signal, ... }, ... }
         ["RAIL"] = { Signal: Voltage, ... }
     """
-    netlist_dict = { "PART": {}, "CONNECTION": {}, "REF.PIN": {}, "RAIL": {}, "PINS": {} }
+    netlist_dict = { "PART": {}, "CONNECTION": {}, "REF.PIN": {}, "RAIL": {}, "PINS": {}, "PIN.NET": {} }
     sub_dict = ""
     signal_name = ""
     new_signal = False
     done = False
 
-    print "Loading netlist"
-    print filename
+    log.info( "Loading netlist %s", filename )
 
     try:
         f = open( filename, "r" )
@@ -55,12 +63,12 @@ def load_asc_netlist( filename ):
                 if ss[0] == "*":
                     if ss == "*PART*":
                         sub_dict = "PART"
-                        print "Loading parts"
+                        log.debug( "Loading parts" )
                     elif ss == "*CONNECTION*":
                         sub_dict = "CONNECTION"
-                        print "Loading connections"
+                        log.debug( "Loading connections" )
                     elif ss == "*MISC*":
-                        print "Done"
+                        log.debug( "Done" )
                         done = True
                     elif sub_dict == "CONNECTION" and ss[0:8] == "*SIGNAL*":
                         ss_token = ss.split( " ")
@@ -128,16 +136,20 @@ def load_asc_netlist( filename ):
                             ( ref, pin ) = ss_token[1].split('.')
                             if ref not in netlist_dict["PINS"]:
                                 netlist_dict["PINS"][ref] = []
+                                netlist_dict["PIN.NET"][ref] = {}
                             netlist_dict[sub_dict][signal_name].append( ss_token[1] )
                             netlist_dict["REF.PIN"][ss_token[1]] = signal_name
                             netlist_dict["PINS"][ref].append(pin)
+                            netlist_dict["PIN.NET"][ref][pin] = signal_name
                         if new_signal:
                             ( ref, pin ) = ss_token[0].split('.')
                             if ref not in netlist_dict["PINS"]:
                                 netlist_dict["PINS"][ref] = []
+                                netlist_dict["PIN.NET"][ref] = {}
                             netlist_dict[sub_dict][signal_name].append( ss_token[0] )
                             netlist_dict["REF.PIN"][ss_token[0]] = signal_name
                             netlist_dict["PINS"][ref].append(pin)
+                            netlist_dict["PIN.NET"][ref][pin] = signal_name
                             new_signal = False
                         ## print netlist_dict[sub_dict][signal_name]
                         ## print netlist_dict["REF.PIN"]
@@ -146,13 +158,142 @@ def load_asc_netlist( filename ):
 
         f.close()
     except Exception, e:
-        print e
+        log.error( "%s: %s", filename, e )
         pass
 
     ##print netlist_dict
 
     return ( netlist_dict )
 
+
+def file_stamp( filename ):
+    """
+    Returns ( modification time, size ) of filename, or None if it cannot be read
+    """
+    try:
+        st = os.stat( filename )
+        return ( st.st_mtime, st.st_size )
+    except OSError:
+        return None
+
+
+# Changed whenever load_asc_netlist changes the netlist_dict it returns, older pickles are parsed again
+NETLIST_CACHE_VERSION = 1
+
+class netlist_cache():
+    """
+    Parsed netlists keyed on filename, a netlist is only parsed again when its file stamp
+    changes. Shared by every system loaded with it, see system_connections.netlist_cache.
+
+    If directory is given, parsed netlists are also pickled there, one file per netlist
+    named after the SHA-1 of its absolute path, so later runs can skip parsing.
+    """
+    def __init__( self, directory=None ):
+        self.directory = directory
+        self.netlists = {}      # { Filename: ( Stamp, netlist_dict ) }
+        self.parsed = 0
+
+    def pickle_filename( self, filename ):
+        return os.path.join( self.directory, "%s.pickle" % hashlib.sha1( os.path.abspath( filename ) ).hexdigest() )
+
+    def load_pickle( self, filename, stamp ):
+        """
+        Returns the pickled netlist_dict of filename if it was pickled from the same stamp, else None
+        """
+        try:
+            f = open( self.pickle_filename( filename ), "rb" )
+            try:
+                ( version, pickled_stamp, netlist_dict ) = cPickle.load( f )
+            finally:
+                f.close()
+        except Exception:
+            return None
+        if version != NETLIST_CACHE_VERSION or pickled_stamp != stamp:
+            return None
+        log.info( "Netlist %s from cache", filename )
+        return netlist_dict
+
+    def save_pickle( self, filename, stamp, netlist_dict ):
+        """
+        Pickles netlist_dict, written to a temporary file and renamed so readers never see part of it
+        """
+        try:
+            if not os.path.isdir( self.directory ):
+                os.makedirs( self.directory )
+            ( fd, temp_filename ) = tempfile.mkstemp( dir=self.directory )
+            f = os.fdopen( fd, "wb" )
+            cPickle.dump( ( NETLIST_CACHE_VERSION, stamp, netlist_dict ), f, cPickle.HIGHEST_PROTOCOL )
+            f.close()
+            os.rename( temp_filename, self.pickle_filename( filename ) )
+        except Exception, e:
+            log.warning( "Netlist cache %s: %s", self.directory, e )
+
+    def load( self, filename ):
+        """
+        Returns the netlist_dict of filename, as load_asc_netlist
+        """
+        stamp = file_stamp( filename )
+        cached = self.netlists.get( filename )
+        # Files that cannot be read are tried again each time, so the error is reported each time
+        if cached is None or cached[0] != stamp or stamp is None:
+            netlist_dict = None
+            if self.directory is not None and stamp is not None:
+                netlist_dict = self.load_pickle( filename, stamp )
+            if netlist_dict is None:
+                netlist_dict = load_asc_netlist( filename )
+                self.parsed += 1
+                if self.directory is not None and stamp is not None:
+                    self.save_pickle( filename, stamp, netlist_dict )
+            self.netlists[filename] = ( stamp, netlist_dict )
+        netlist_dict = copy.copy( self.netlists[filename][1] )
+        # RAIL lines in the system file add to ["RAIL"], each system gets its own copy
+        netlist_dict["RAIL"] = copy.copy( netlist_dict["RAIL"] )
+        return netlist_dict
+
+    def discard( self, filenames ):
+        """
+        Drops cached netlists that are not in filenames
+        """
+        for filename in self.netlists.keys():
+            if filename not in filenames:
+                del self.netlists[filename]
+
+# Resistance value tokens such as 10K, 4K7, 33R, R10, 1M, 4.7K or 100OHM
+RESISTANCE_TOKEN = re.compile( r"^(\d*)(?:\.(\d+))?(R|K|M|OHMS?|KOHMS?|MOHMS?)(\d*)$" )
+RESISTANCE_MULTIPLIER = { "R": 1.0, "O": 1.0, "K": 1e3, "M": 1e6 }
+
+def parse_resistance( part_type ):
+    """
+    parse_resistance( part_type )
+
+    Extract resistor value in ohms from a PART type string, eg:
+        RES_10K     -> 10000.0
+        RES_4K7_DNP -> 4700.0
+        R_33R_0402  -> 33.0
+
+    The type is split on "_", "-" and spaces and the first token that looks like a
+    resistance is used. Tokens without a unit letter (eg 0402) are not resistances.
+    Returns None if no value is found.
+    """
+    for token in re.split( r"[_\- ]+", part_type.upper() ):
+        match = RESISTANCE_TOKEN.match( token )
+        if match is None:
+            continue
+
+        ( units, decimals, unit, trailing ) = match.groups()
+        # Trailing digits are the decimals when the unit letter is the decimal point (4K7, R10)
+        if trailing:
+            if decimals or unit[0] == "O":
+                continue
+            decimals = trailing
+        if not units and not decimals:
+            continue
+
+        value = float( "%s.%s" % ( units or "0", decimals or "0" ) )
+        return value * RESISTANCE_MULTIPLIER[unit[0]]
+
+    return None
+
 class netlist():
 
     def load_syscon_csv( filename ):
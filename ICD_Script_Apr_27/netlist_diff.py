@@ -0,0 +1,361 @@
+"""
+NETLIST_DIFF.py - ECO differences between two revisions of an .asc netlist
+
+Nets are matched on a hash of their sorted pin set, so renamed nets are found with a
+single dictionary lookup. Nets that do not match exactly are resolved through the pins
+they share, each pin being looked up once:
+    NET RENAMED     Same pins, different name
+    NET CHANGED     Same name, pins added or removed
+    NET SPLIT       Pins of one old net now on several new nets
+    NET MERGED      Pins of several old nets now on one new net
+    NET ADDED       No pins came from an old net
+    NET REMOVED     No pins went to a new net
+    PIN MOVED       Pin on both revisions whose net is neither the same nor renamed
+    PART ADDED, PART REMOVED, PART CHANGED (type)
+"""
+
+import sys
+import getopt
+import logging
+
+import netlist
+import report_writer
+
+log = logging.getLogger( "netlist_diff" )
+
+
+def pin_set_key( ref_pins ):
+    """
+    Returns the key a net is matched on, its sorted Ref.Pin list as a tuple
+    """
+    return tuple( sorted( ref_pins ) )
+
+
+def diff_netlists( old_dict, new_dict ):
+    """
+    Compares two netlist dictionaries (see netlist.load_asc_netlist)
+
+    Returns a list of changes:
+        [ { "CHANGE": Change, "OLD": [ Old Signal or Ref, ... ], "NEW": [ New Signal or Ref, ... ],
+            "DETAIL": Text }, ... ]
+    """
+    changes = []
+    old_nets = old_dict["CONNECTION"]
+    new_nets = new_dict["CONNECTION"]
+
+    # Exact pin set matches: unchanged or renamed
+    new_by_key = {}
+    for signal in new_nets:
+        new_by_key.setdefault( pin_set_key( new_nets[signal] ), [] ).append( signal )
+
+    renamed = {}
+    old_unmatched = []
+    new_matched = set()
+    for signal in sorted( old_nets ):
+        candidates = new_by_key.get( pin_set_key( old_nets[signal] ), [] )
+        if signal in candidates:
+            new_matched.add( signal )
+        else:
+            candidates = [ new_signal for new_signal in candidates if new_signal not in new_matched and new_signal not in old_nets ]
+            if len( candidates ) > 0 and len( old_nets[signal] ) > 0:
+                renamed[signal] = candidates[0]
+                new_matched.add( candidates[0] )
+                changes.append( { "CHANGE": "NET RENAMED", "OLD": [ signal ], "NEW": [ candidates[0] ], "DETAIL": "" } )
+            else:
+                old_unmatched.append( signal )
+    new_unmatched = [ signal for signal in sorted( new_nets ) if signal not in new_matched ]
+
+    # Everything else is resolved through the nets the pins went to and came from
+    old_targets = {}
+    for signal in old_unmatched:
+        targets = set()
+        for ref_pin in old_nets[signal]:
+            if ref_pin in new_dict["REF.PIN"]:
+                targets.add( new_dict["REF.PIN"][ref_pin] )
+        old_targets[signal] = targets
+    new_sources = {}
+    for signal in new_unmatched:
+        sources = set()
+        for ref_pin in new_nets[signal]:
+            if ref_pin in old_dict["REF.PIN"]:
+                sources.add( old_dict["REF.PIN"][ref_pin] )
+        new_sources[signal] = sources
+
+    changed = set()
+    for signal in old_unmatched:
+        targets = old_targets[signal]
+        if signal in new_nets and signal not in new_matched:
+            changed.add( signal )
+            changes.append( { "CHANGE": "NET CHANGED", "OLD": [ signal ], "NEW": [ signal ],
+                              "DETAIL": pin_changes( old_nets[signal], new_nets[signal] ) } )
+            if len( targets ) > 1:
+                changes.append( { "CHANGE": "NET SPLIT", "OLD": [ signal ], "NEW": sorted( targets ), "DETAIL": "" } )
+        elif len( targets ) == 0:
+            changes.append( { "CHANGE": "NET REMOVED", "OLD": [ signal ], "NEW": [], "DETAIL": "" } )
+        elif len( targets ) > 1:
+            changes.append( { "CHANGE": "NET SPLIT", "OLD": [ signal ], "NEW": sorted( targets ), "DETAIL": "" } )
+        else:
+            target = list( targets )[0]
+            if len( new_sources.get( target, [] ) ) == 1 and target not in old_nets:
+                # Renamed with pins added or removed
+                renamed[signal] = target
+                changes.append( { "CHANGE": "NET RENAMED", "OLD": [ signal ], "NEW": [ target ],
+                                  "DETAIL": pin_changes( old_nets[signal], new_nets[target] ) } )
+
+    renamed_to = set( renamed.values() )
+    for signal in new_unmatched:
+        sources = new_sources[signal]
+        if signal in renamed_to:
+            continue
+        if len( sources ) == 0 and signal not in changed:
+            changes.append( { "CHANGE": "NET ADDED", "OLD": [], "NEW": [ signal ], "DETAIL": "" } )
+        elif len( sources ) > 1:
+            changes.append( { "CHANGE": "NET MERGED", "OLD": sorted( sources ), "NEW": [ signal ], "DETAIL": "" } )
+
+    # Pins that changed net other than by a rename
+    for ref_pin in sorted( old_dict["REF.PIN"] ):
+        if ref_pin in new_dict["REF.PIN"]:
+            old_signal = old_dict["REF.PIN"][ref_pin]
+            new_signal = new_dict["REF.PIN"][ref_pin]
+            if new_signal != old_signal and new_signal != renamed.get( old_signal ):
+                changes.append( { "CHANGE": "PIN MOVED", "OLD": [ old_signal ], "NEW": [ new_signal ], "DETAIL": ref_pin } )
+
+    for ref in sorted( set( old_dict["PART"] ) | set( new_dict["PART"] ) ):
+        if ref not in new_dict["PART"]:
+            changes.append( { "CHANGE": "PART REMOVED", "OLD": [ ref ], "NEW": [], "DETAIL": old_dict["PART"][ref] } )
+        elif ref not in old_dict["PART"]:
+            changes.append( { "CHANGE": "PART ADDED", "OLD": [], "NEW": [ ref ], "DETAIL": new_dict["PART"][ref] } )
+        elif old_dict["PART"][ref] != new_dict["PART"][ref]:
+            changes.append( { "CHANGE": "PART CHANGED", "OLD": [ ref ], "NEW": [ ref ],
+                              "DETAIL": "%s -> %s" % ( old_dict["PART"][ref], new_dict["PART"][ref] ) } )
+
+    return changes
+
+
+def pin_changes( old_ref_pins, new_ref_pins ):
+    """
+    Returns "+Ref.Pin -Ref.Pin ..." for the pins added to and removed from a net
+    """
+    old_set = set( old_ref_pins )
+    new_set = set( new_ref_pins )
+    return " ".join( [ "+%s" % ref_pin for ref_pin in sorted( new_set - old_set ) ] +
+                     [ "-%s" % ref_pin for ref_pin in sorted( old_set - new_set ) ] )
+
+
+def affected_signals( changes, old_dict, new_dict ):
+    """
+    Returns the set of signal names, old and new, touched by a change list. Nets on the
+    pins of added, removed or changed parts are included.
+    """
+    signals = set()
+    for change in changes:
+        if change["CHANGE"].startswith( "PART" ):
+            for ( net_dict, refs ) in [ ( old_dict, change["OLD"] ), ( new_dict, change["NEW"] ) ]:
+                for ref in refs:
+                    for pin in net_dict["PINS"].get( ref, [] ):
+                        signals.add( net_dict["REF.PIN"]["%s.%s" % ( ref, pin )] )
+        else:
+            signals.update( change["OLD"] )
+            signals.update( change["NEW"] )
+    return signals
+
+
+def affected_checks( syscon, id, signals, changed_refs ):
+    """
+    Returns the CHECKTRACE rows of a system (system_connections instance, loaded with the
+    old revision of board id) that a change to signals or changed_refs on board id can affect:
+        [ ( From, To, Reason ), ... ]
+
+    A row is affected if an endpoint is on one of the signals, if its trace passes through
+    a changed net or part on the board, or if it did not trace and an endpoint is on the board.
+
+    A trace stays in the part of the system its endpoints are joined to (see
+    system_connections.label_components), and a change can only join or split the parts that
+    hold its nets. Rows whose endpoints are not in a part holding a changed net or a pin of a
+    changed part are not affected and are not traced.
+    """
+    board_netlist = syscon.syscon_dict["NETLIST"][id]
+    affected = []
+    if len( signals ) == 0 and len( changed_refs ) == 0:
+        return affected
+
+    if syscon.net_component is None:
+        syscon.label_components()
+    changed_nets = set( signals )
+    for ref in changed_refs:
+        for pin in board_netlist["PINS"].get( ref, [] ):
+            ref_pin = "%s.%s" % ( ref, pin )
+            if ref_pin in board_netlist["REF.PIN"]:
+                changed_nets.add( board_netlist["REF.PIN"][ref_pin] )
+    changed_parts = set()
+    for signal in changed_nets:
+        part = syscon.net_component.get( "%s.%s" % ( id, signal ) )
+        if part is not None:
+            changed_parts.add( part )
+
+    for ( from_signal, to_signal, check_dict ) in syscon.syscon_dict["CHECKTRACE"]:
+        if from_signal[0:6] == "$$##__":
+            continue
+
+        reason = ""
+        ends = []
+        parts = set()
+        for endpoint in [ from_signal, to_signal ]:
+            ( param_type, id_signal ) = syscon.param_to_signal( endpoint )
+            ends.append( endpoint.split( '.' )[0] )
+            parts.add( syscon.net_component.get( id_signal ) )
+            ( end_id, end_signal ) = report_writer.split_id_signal( id_signal )
+            if end_id == id and end_signal in signals:
+                reason = "endpoint %s on %s" % ( endpoint, id_signal )
+                break
+
+        if len( reason ) == 0 and len( parts & changed_parts ) > 0:
+            ( trace_flag, info_dict ) = syscon.check_trace( from_signal, to_signal, {} )
+            for id_ref_pin in info_dict["PATH"]:
+                ( hop_id, ref, pin ) = report_writer.split_hop( id_ref_pin )
+                if hop_id != id:
+                    continue
+                if ref in changed_refs:
+                    reason = "path through %s" % id_ref_pin
+                    break
+                net = board_netlist["REF.PIN"].get( "%s.%s" % ( ref, pin ) )
+                if net in signals:
+                    reason = "path through %s on %s.%s" % ( id_ref_pin, id, net )
+                    break
+            if len( reason ) == 0 and not trace_flag and id in ends:
+                reason = "no trace with endpoint on %s" % id
+
+        if len( reason ) > 0:
+            affected.append( ( from_signal, to_signal, reason ) )
+
+    return affected
+
+
+def write_changes( writer, changes ):
+    """
+    Writes a change list:
+        COMMENT,CHANGE,OLD,NEW,DETAIL
+    """
+    writer.write_heading( "NETLIST CHANGES" )
+    for change in changes:
+        writer.write_row( [ ( report_writer.RAW, "" ), ( report_writer.RAW, change["CHANGE"] ),
+                            ( report_writer.TEXT, " ".join( change["OLD"] ) ), ( report_writer.TEXT, " ".join( change["NEW"] ) ),
+                            ( report_writer.TEXT, change["DETAIL"] ), ( report_writer.RAW, "" ) ] )
+
+
+def write_affected( writer, affected ):
+    """
+    Writes the affected CHECKTRACE rows:
+        COMMENT,DESIRE FROM,DESIRE TO,REASON
+    """
+    writer.write_heading( "AFFECTED CHECKS" )
+    for ( from_signal, to_signal, reason ) in affected:
+        writer.write_row( [ ( report_writer.RAW, "" ), ( report_writer.TEXT, from_signal ), ( report_writer.TEXT, to_signal ),
+                            ( report_writer.TEXT, reason ), ( report_writer.RAW, "" ) ] )
+
+
+def usage():
+    print """
+
+netlist_diff.py [-opt]
+
+    Option                      Description
+    -h          --help          Display this help
+
+    -a FILENAME --old=FILENAME  Old revision of the .asc netlist
+    -b FILENAME --new=FILENAME  New revision of the .asc netlist
+    -o FILENAME --out=FILENAME  Filename for output
+                                Outputs FILENAME_diff.csv
+    -f FILENAME --file=FILENAME System connections file using the old revision
+    -i ID       --id=ID         Board ID of the netlist in the system connections file
+                                With -f and -i, outputs FILENAME_affected.csv
+                --csv-style=STYLE
+                                excel (default) or plain, see system_connections.py
+"""
+
+
+def main( argv ):
+    old_filename = ""
+    new_filename = ""
+    out_stem = ""
+    syscon_filename = ""
+    id = ""
+    csv_style = "excel"
+
+    try:
+        opts, args = getopt.getopt( argv, "ha:b:o:f:i:", ["help", "old=", "new=", "out=", "file=", "id=", "csv-style="] )
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ("-a", "--old"):
+            old_filename = arg
+        if opt in ("-b", "--new"):
+            new_filename = arg
+        if opt in ("-o", "--out"):
+            out_stem = arg
+        if opt in ("-f", "--file"):
+            syscon_filename = arg
+        if opt in ("-i", "--id"):
+            id = arg
+        if opt in ("--csv-style",):
+            csv_style = arg
+        elif opt in ("-h", "--help"):
+            usage()
+            sys.exit()
+
+    if len( old_filename ) == 0 or len( new_filename ) == 0 or len( out_stem ) == 0:
+        usage()
+        sys.exit(2)
+
+    logging.basicConfig( level=logging.WARNING, format="%(levelname)s: %(message)s" )
+
+    old_dict = netlist.load_asc_netlist( old_filename )
+    new_dict = netlist.load_asc_netlist( new_filename )
+    changes = diff_netlists( old_dict, new_dict )
+
+    out_filename = "%s_diff.csv" % out_stem
+    try:
+        f = open( out_filename, "w" )
+        writer = report_writer.csv_report_writer( f, csv_style )
+        write_changes( writer, changes )
+        writer.close()
+        f.close()
+    except Exception, e:
+        log.error( "%s: %s", out_filename, e )
+
+    if len( syscon_filename ) > 0 and len( id ) > 0:
+        import system_connections
+
+        syscon = system_connections.system_connections()
+        syscon.load_syscon_csv( syscon_filename )
+        if id not in syscon.syscon_dict["NETLIST"]:
+            log.error( "%s: no netlist for ID %s", syscon_filename, id )
+            sys.exit(1)
+        syscon.resolve_endpoints()
+
+        signals = affected_signals( changes, old_dict, new_dict )
+        changed_refs = set()
+        for change in changes:
+            if change["CHANGE"].startswith( "PART" ):
+                changed_refs.update( change["OLD"] + change["NEW"] )
+        affected = affected_checks( syscon, id, signals, changed_refs )
+
+        out_filename = "%s_affected.csv" % out_stem
+        try:
+            f = open( out_filename, "w" )
+            writer = report_writer.csv_report_writer( f, csv_style )
+            write_affected( writer, affected )
+            writer.close()
+            f.close()
+        except Exception, e:
+            log.error( "%s: %s", out_filename, e )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
+
+
+# vi:set shiftwidth=4 tabstop=4:
+# vim:set expandtab list lcs=tab\:>>:
@@ -0,0 +1,301 @@
+"""
+NETLIST_STORE.py - SQLite netlist store for designs too large to keep in memory
+
+Netlists are imported once into an indexed SQLite file and read back through read-only
+dictionary views, so the trace and pull code uses them exactly as the dictionaries
+returned by netlist.load_asc_netlist:
+    ["PART"]        parts       Ref -> Type
+    ["CONNECTION"]  nets        Signal -> [ Ref.Pin, ... ]      (net to pins)
+    ["REF.PIN"]     ref_pins    Ref.Pin -> Signal               (pin to net)
+    ["PINS"]        refs        Ref -> [ Pin, ... ]
+    ["PIN.NET"]     refs        Ref -> { Pin: Signal, ... }
+    ["RAIL"]        rails       Loaded into a dictionary, rails are few and RAIL lines add to them
+
+Values are looked up by key when used and the most recently used are kept in one LRU for
+the whole store (LRU_SIZE entries), so memory stays bounded whatever the size of the design.
+Keys are iterated in the order of the dictionaries load_asc_netlist builds, so reports are
+written in the same order as without the store.
+
+A netlist is imported again when its file's ( modification time, size ) changes. Worker
+processes forked while a store is open reopen the database on first use.
+"""
+
+import collections
+import logging
+import os
+import sqlite3
+import thread
+import threading
+
+import netlist
+
+log = logging.getLogger( "netlist_store" )
+
+# Changed whenever the tables change, stores of another version are imported again
+STORE_VERSION = 1
+
+# Values kept in memory, over all netlists and tables of a store
+LRU_SIZE = 200000
+
+STORE_TABLES = [
+    """CREATE TABLE IF NOT EXISTS store_info ( version INTEGER )""",
+    """CREATE TABLE IF NOT EXISTS netlists ( netlist_id INTEGER PRIMARY KEY, filename TEXT UNIQUE,
+                                             mtime REAL, size INTEGER )""",
+    """CREATE TABLE IF NOT EXISTS parts ( netlist_id INTEGER, seq INTEGER, ref TEXT, type TEXT )""",
+    """CREATE TABLE IF NOT EXISTS nets ( netlist_id INTEGER, seq INTEGER, signal TEXT, ref_pins TEXT )""",
+    """CREATE TABLE IF NOT EXISTS ref_pins ( netlist_id INTEGER, seq INTEGER, ref_pin TEXT, signal TEXT )""",
+    """CREATE TABLE IF NOT EXISTS refs ( netlist_id INTEGER, seq INTEGER, ref TEXT, pins TEXT, signals TEXT )""",
+    """CREATE TABLE IF NOT EXISTS rails ( netlist_id INTEGER, seq INTEGER, signal TEXT, volt REAL )""",
+    ]
+
+STORE_INDEXES = [
+    """CREATE UNIQUE INDEX IF NOT EXISTS parts_ref ON parts ( netlist_id, ref )""",
+    """CREATE UNIQUE INDEX IF NOT EXISTS nets_signal ON nets ( netlist_id, signal )""",
+    """CREATE UNIQUE INDEX IF NOT EXISTS ref_pins_ref_pin ON ref_pins ( netlist_id, ref_pin )""",
+    """CREATE UNIQUE INDEX IF NOT EXISTS refs_ref ON refs ( netlist_id, ref )""",
+    """CREATE INDEX IF NOT EXISTS parts_seq ON parts ( netlist_id, seq )""",
+    """CREATE INDEX IF NOT EXISTS nets_seq ON nets ( netlist_id, seq )""",
+    """CREATE INDEX IF NOT EXISTS ref_pins_seq ON ref_pins ( netlist_id, seq )""",
+    """CREATE INDEX IF NOT EXISTS refs_seq ON refs ( netlist_id, seq )""",
+    ]
+
+# Tables holding the rows of a netlist, cleared when it is imported again
+NETLIST_TABLES = [ "parts", "nets", "ref_pins", "refs", "rails" ]
+
+# Ref.Pins, Pins and Signals never contain spaces (netlist lines are split on spaces)
+def split_list( value ):
+    if len( value ) == 0:
+        return []
+    return value.split( " " )
+
+
+def pin_net_dict( row ):
+    return dict( zip( split_list( row[0] ), split_list( row[1] ) ) )
+
+
+# Dictionary key -> ( Table, Key column, Value columns, Decode value row )
+STORE_VIEWS = {
+    "PART": ( "parts", "ref", "type", lambda row: row[0] ),
+    "CONNECTION": ( "nets", "signal", "ref_pins", lambda row: split_list( row[0] ) ),
+    "REF.PIN": ( "ref_pins", "ref_pin", "signal", lambda row: row[0] ),
+    "PINS": ( "refs", "ref", "pins", lambda row: split_list( row[0] ) ),
+    "PIN.NET": ( "refs", "ref", "pins, signals", pin_net_dict ),
+    }
+
+_MISSING = object()
+
+
+class store_view():
+    """
+    Read-only dictionary view of one netlist's table in a netlist_store
+    """
+    def __init__( self, store, netlist_id, name ):
+        self.store = store
+        self.netlist_id = netlist_id
+        self.name = name
+        ( self.table, self.key_column, self.value_columns, self.decode ) = STORE_VIEWS[name]
+
+    def lookup( self, key ):
+        lru_key = ( self.netlist_id, self.name, key )
+        with self.store.lock:
+            value = self.store.lru.pop( lru_key, None )
+            if value is None:
+                row = self.store.connection().execute( "SELECT %s FROM %s WHERE netlist_id = ? AND %s = ?" %
+                                                       ( self.value_columns, self.table, self.key_column ),
+                                                       ( self.netlist_id, key ) ).fetchone()
+                if row is None:
+                    value = _MISSING
+                else:
+                    value = self.decode( row )
+                if len( self.store.lru ) >= self.store.lru_size:
+                    self.store.lru.popitem( last=False )
+            self.store.lru[lru_key] = value
+        return value
+
+    def __getitem__( self, key ):
+        value = self.lookup( key )
+        if value is _MISSING:
+            raise KeyError( key )
+        return value
+
+    def get( self, key, default=None ):
+        value = self.lookup( key )
+        if value is _MISSING:
+            return default
+        return value
+
+    def __contains__( self, key ):
+        return self.lookup( key ) is not _MISSING
+
+    def has_key( self, key ):
+        return key in self
+
+    def __len__( self ):
+        return self.store.connection().execute( "SELECT COUNT(*) FROM %s WHERE netlist_id = ?" % self.table,
+                                                ( self.netlist_id, ) ).fetchone()[0]
+
+    def iteritems( self ):
+        """
+        Streams ( Key, Value ) in load_asc_netlist order, values are not added to the LRU
+        """
+        cursor = self.store.connection().execute( "SELECT %s, %s FROM %s WHERE netlist_id = ? ORDER BY seq" %
+                                                  ( self.key_column, self.value_columns, self.table ),
+                                                  ( self.netlist_id, ) )
+        for row in cursor:
+            yield ( row[0], self.decode( row[1:] ) )
+
+    def iterkeys( self ):
+        cursor = self.store.connection().execute( "SELECT %s FROM %s WHERE netlist_id = ? ORDER BY seq" %
+                                                  ( self.key_column, self.table ), ( self.netlist_id, ) )
+        for row in cursor:
+            yield row[0]
+
+    def itervalues( self ):
+        for ( key, value ) in self.iteritems():
+            yield value
+
+    def __iter__( self ):
+        return self.iterkeys()
+
+    def keys( self ):
+        return list( self.iterkeys() )
+
+    def values( self ):
+        return list( self.itervalues() )
+
+    def items( self ):
+        return list( self.iteritems() )
+
+
+class netlist_store():
+    """
+    Netlists imported into SQLite file filename, used in place of a netlist.netlist_cache
+    (see system_connections.netlist_cache)
+    """
+    def __init__( self, filename, lru_size=LRU_SIZE ):
+        self.filename = filename
+        self.lru_size = lru_size
+        self.lru = collections.OrderedDict()
+        self.netlists = {}      # { Filename: ( Stamp, netlist_dict of store_views ) }
+        self.parsed = 0
+        # Lookups may come from threads of this process, eg. the task thread of a
+        # multiprocessing.Pool iterating over a view, the LRU is shared between them
+        self.lock = threading.Lock()
+        self.connections = {}   # { ( Process ID, Thread ID ): sqlite3 connection }
+        self.open()
+
+    def open( self ):
+        db = self.connection()
+        version = None
+        try:
+            row = db.execute( "SELECT version FROM store_info" ).fetchone()
+            if row is not None:
+                version = row[0]
+        except sqlite3.Error:
+            pass
+        if version is not None and version != STORE_VERSION:
+            log.info( "Netlist store %s is version %s, importing again", self.filename, version )
+            for table in [ "store_info", "netlists" ] + NETLIST_TABLES:
+                db.execute( "DROP TABLE IF EXISTS %s" % table )
+        for statement in STORE_TABLES + STORE_INDEXES:
+            db.execute( statement )
+        if version != STORE_VERSION:
+            db.execute( "DELETE FROM store_info" )
+            db.execute( "INSERT INTO store_info ( version ) VALUES ( ? )", ( STORE_VERSION, ) )
+        db.commit()
+
+    def connection( self ):
+        """
+        Returns the database connection of the calling thread, sqlite3 connections can not be
+        shared between threads or with forked worker processes
+        """
+        owner = ( os.getpid(), thread.get_ident() )
+        db = self.connections.get( owner )
+        if db is None:
+            db = sqlite3.connect( self.filename )
+            db.text_factory = str
+            self.connections[owner] = db
+        return db
+
+    def close( self ):
+        pid = os.getpid()
+        for owner in self.connections.keys():
+            if owner[0] == pid:
+                self.connections[owner].close()
+        self.connections = {}
+
+    def import_netlist( self, filename, stamp ):
+        """
+        Parses filename and replaces its rows in the store, returns its netlist_id.
+        Only this netlist is held in memory while it is imported.
+        """
+        netlist_dict = netlist.load_asc_netlist( filename )
+        self.parsed += 1
+        db = self.connection()
+        row = db.execute( "SELECT netlist_id FROM netlists WHERE filename = ?", ( filename, ) ).fetchone()
+        if row is None:
+            netlist_id = db.execute( "INSERT INTO netlists ( filename, mtime, size ) VALUES ( ?, ?, ? )",
+                                     ( filename, stamp[0], stamp[1] ) ).lastrowid
+        else:
+            netlist_id = row[0]
+            db.execute( "UPDATE netlists SET mtime = ?, size = ? WHERE netlist_id = ?", ( stamp[0], stamp[1], netlist_id ) )
+            for table in NETLIST_TABLES:
+                db.execute( "DELETE FROM %s WHERE netlist_id = ?" % table, ( netlist_id, ) )
+
+        # Rows are numbered in dictionary order so views iterate as the dictionaries would
+        db.executemany( "INSERT INTO parts VALUES ( ?, ?, ?, ? )",
+                        ( ( netlist_id, seq, ref, ref_type ) for ( seq, ( ref, ref_type ) ) in enumerate( netlist_dict["PART"].iteritems() ) ) )
+        db.executemany( "INSERT INTO nets VALUES ( ?, ?, ?, ? )",
+                        ( ( netlist_id, seq, signal, " ".join( ref_pins ) )
+                          for ( seq, ( signal, ref_pins ) ) in enumerate( netlist_dict["CONNECTION"].iteritems() ) ) )
+        db.executemany( "INSERT INTO ref_pins VALUES ( ?, ?, ?, ? )",
+                        ( ( netlist_id, seq, ref_pin, signal ) for ( seq, ( ref_pin, signal ) ) in enumerate( netlist_dict["REF.PIN"].iteritems() ) ) )
+        # PIN.NET[Ref] is filled in PINS[Ref] order, so it is rebuilt from the pins and their nets
+        db.executemany( "INSERT INTO refs VALUES ( ?, ?, ?, ?, ? )",
+                        ( ( netlist_id, seq, ref, " ".join( pins ), " ".join( [ netlist_dict["PIN.NET"][ref][pin] for pin in pins ] ) )
+                          for ( seq, ( ref, pins ) ) in enumerate( netlist_dict["PINS"].iteritems() ) ) )
+        db.executemany( "INSERT INTO rails VALUES ( ?, ?, ?, ? )",
+                        ( ( netlist_id, seq, signal, volt ) for ( seq, ( signal, volt ) ) in enumerate( netlist_dict["RAIL"].iteritems() ) ) )
+        db.commit()
+        log.info( "Imported %s into %s", filename, self.filename )
+        return netlist_id
+
+    def load( self, filename ):
+        """
+        Returns the netlist_dict of filename, as load_asc_netlist, with store_views in place
+        of all but ["RAIL"]. The netlist is imported first if the store does not have it or
+        its file changed.
+        """
+        stamp = netlist.file_stamp( filename )
+        if stamp is None:
+            # Reported by load_asc_netlist, as without a store
+            return netlist.load_asc_netlist( filename )
+
+        cached = self.netlists.get( filename )
+        if cached is None or cached[0] != stamp:
+            row = self.connection().execute( "SELECT netlist_id, mtime, size FROM netlists WHERE filename = ?", ( filename, ) ).fetchone()
+            if row is not None and ( row[1], row[2] ) == stamp:
+                netlist_id = row[0]
+            else:
+                netlist_id = self.import_netlist( filename, stamp )
+                # Views of the old rows may be in the LRU
+                self.lru.clear()
+            rails = dict( self.connection().execute( "SELECT signal, volt FROM rails WHERE netlist_id = ? ORDER BY seq", ( netlist_id, ) ) )
+            netlist_dict = { "RAIL": rails }
+            for name in STORE_VIEWS:
+                netlist_dict[name] = store_view( self, netlist_id, name )
+            self.netlists[filename] = ( stamp, netlist_dict )
+
+        netlist_dict = dict( self.netlists[filename][1] )
+        # RAIL lines in the system file add to ["RAIL"], each system gets its own copy
+        netlist_dict["RAIL"] = dict( netlist_dict["RAIL"] )
+        return netlist_dict
+
+    def discard( self, filenames ):
+        for filename in self.netlists.keys():
+            if filename not in filenames:
+                del self.netlists[filename]
+
+
+# vi:set shiftwidth=4 tabstop=4:
+# vim:set expandtab list lcs=tab\:>>:
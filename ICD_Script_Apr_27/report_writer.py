@@ -0,0 +1,899 @@
+"""
+REPORT_WRITER.py - Check report records and report writers
+
+A check record describes one checked row:
+    ["REPORT"] = "CHECKTRACE", "CHECKVOLT" or "ALLVOLT"
+    ["FROM"] = ID.Signal or ID.Ref.Pin
+    ["TO"] = ID.Signal or ID.Ref.Pin
+    ["DESIRED_VOLT"] = Voltage, or None if no voltage was requested
+    ["TRACE"] = True / False, or None if no trace was done
+    ["IGNORE"] = True / False
+    ["VOLT_FLAG"] = True / False, or None if no voltage was requested
+    ["COMMON_VOLT_FLAG"] = True / False, or None if no pulls were found
+    ["COMMON_VOLT"] = Voltage, or None if there is no common voltage
+    ["PATH"] = [ ID.Ref.Pin, ... ]
+    ["PULL"] = [ Pull description, ... ]
+    ["VOLT"] = [ Voltage, ... ]
+    ["TERM"] = [ Termination, ... ], or None if terminations were not detected
+    ["FROM_SIGNAL"] = ID.Signal that FROM resolves to
+    ["TO_SIGNAL"] = ID.Signal that TO resolves to
+
+A row is a list of ( Cell type, Value ) tuples:
+    TEXT    String, written as ="Value" so Excel does not reformat it
+    VOLT    Voltage, written as ="%.2f"
+    RAW     Written as is (TRUE, #N/A, PATH, ...)
+"""
+
+import csv
+import cStringIO
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+TEXT = "TEXT"
+VOLT = "VOLT"
+RAW = "RAW"
+
+# Characters that cannot appear in an unquoted CSV cell
+UNSAFE_CELL = re.compile( r'[,"\r\n]' )
+
+class excel_text_dialect( csv.Dialect ):
+    """
+    Cells are written exactly as rendered, ="..." cells carry their own quotes
+    """
+    delimiter = ","
+    quotechar = None
+    escapechar = None
+    doublequote = False
+    skipinitialspace = False
+    lineterminator = "\n"
+    quoting = csv.QUOTE_NONE
+
+class quoted_dialect( csv.excel ):
+    """
+    Standard CSV quoting, used for rows that contain commas, quotes or line breaks
+    """
+    lineterminator = "\n"
+
+
+def flag_cell( flag ):
+    if flag is None:
+        return ( RAW, "#N/A" )
+    elif flag:
+        return ( RAW, "TRUE" )
+    else:
+        return ( RAW, "FALSE" )
+
+
+def check_row( record ):
+    """
+    Returns the row for a check record:
+        COMMENT,DESIRE FROM,DESIRE TO,DESIRE VOLTAGE,TRACE FLAG,IGNORE FLAG,VOLT FLAG,COMMON VOLT FLAG,COMMON VOLTAGE,PATH,PULL,VOLT[,TERM]
+    """
+    row = [ ( RAW, "" ), ( TEXT, record["FROM"] ), ( TEXT, record["TO"] ) ]
+    if record["DESIRED_VOLT"] is None:
+        row.append( ( RAW, "" ) )
+    else:
+        row.append( ( VOLT, record["DESIRED_VOLT"] ) )
+
+    row.append( flag_cell( record["TRACE"] ) )
+    row.append( flag_cell( record["IGNORE"] ) )
+    row.append( flag_cell( record["VOLT_FLAG"] ) )
+    row.append( flag_cell( record["COMMON_VOLT_FLAG"] ) )
+    if record["COMMON_VOLT"] is None:
+        row.append( ( RAW, "#N/A" ) )
+    else:
+        row.append( ( VOLT, record["COMMON_VOLT"] ) )
+
+    row.append( ( RAW, "PATH" ) )
+    for id_ref_pin in record["PATH"]:
+        row.append( ( TEXT, id_ref_pin ) )
+    row.append( ( RAW, "PULL" ) )
+    for pull in record["PULL"]:
+        row.append( ( TEXT, pull ) )
+    row.append( ( RAW, "VOLT" ) )
+    for volt in record["VOLT"]:
+        row.append( ( VOLT, volt ) )
+
+    if record["TERM"] is not None:
+        row.append( ( RAW, "TERM" ) )
+        for termination in record["TERM"]:
+            row.append( ( TEXT, termination ) )
+
+    # Rows end with a trailing comma
+    row.append( ( RAW, "" ) )
+
+    return row
+
+
+def render_cells( row, style="excel" ):
+    """
+    Returns ( [ Cell string, ... ], Quote ) for a row
+
+    style "excel" writes TEXT and VOLT cells as ="Value". Quote is only set if a cell
+    contains a comma, quote or line break, in which case the row must be written with
+    standard CSV quoting. style "plain" writes values as they are and always quotes.
+    """
+    cells = []
+    quote = style != "excel"
+    for ( cell_type, value ) in row:
+        if cell_type == VOLT:
+            value = "%.2f" % value
+            if style == "excel":
+                value = '="%s"' % value
+        else:
+            if UNSAFE_CELL.search( value ):
+                quote = True
+            if cell_type == TEXT and style == "excel":
+                value = '="%s"' % value.replace( '"', '""' )
+        cells.append( value )
+
+    return ( cells, quote )
+
+
+class csv_report_writer():
+    """
+    Buffered CSV report writer
+
+    Rows are rendered with the csv module into an in-memory buffer which is written to
+    the file every batch_rows rows. Sections opened with open_sections are spilled to
+    temporary files and copied to the report, in the order they were opened, by
+    close_sections.
+
+    The file is not closed by the writer.
+    """
+    def __init__( self, f, style="excel", batch_rows=1000 ):
+        self.style = style
+        self.batch_rows = batch_rows
+        self.out = self.open_destination( f )
+        self.sections = []
+        self.section_out = {}
+
+    def open_destination( self, f ):
+        buf = cStringIO.StringIO()
+        return { "FILE": f, "BUFFER": buf, "ROWS": 0,
+                 "TEXT": csv.writer( buf, excel_text_dialect ), "QUOTED": csv.writer( buf, quoted_dialect ) }
+
+    def destination( self, section ):
+        if section in self.section_out:
+            return self.section_out[section]
+        return self.out
+
+    def flush_destination( self, out ):
+        out["FILE"].write( out["BUFFER"].getvalue() )
+        out["BUFFER"].seek( 0 )
+        out["BUFFER"].truncate()
+        out["ROWS"] = 0
+
+    def write_text( self, text, section=None ):
+        self.destination( section )["BUFFER"].write( text )
+
+    def write_comment( self, comment, section=None ):
+        self.write_text( "\n%s\n" % comment, section )
+
+    def write_heading( self, heading, section=None ):
+        self.write_text( "\n\n,%s\n\n" % heading, section )
+
+    def write_row( self, row, section=None ):
+        out = self.destination( section )
+        ( cells, quote ) = render_cells( row, self.style )
+        if quote:
+            out["QUOTED"].writerow( cells )
+        else:
+            out["TEXT"].writerow( cells )
+        out["ROWS"] += 1
+        if out["ROWS"] >= self.batch_rows:
+            self.flush_destination( out )
+
+    def write_rows( self, rows, section=None ):
+        """
+        Writes a block of rows, the buffer is only checked against batch_rows at the end
+        """
+        out = self.destination( section )
+        for row in rows:
+            ( cells, quote ) = render_cells( row, self.style )
+            if quote:
+                out["QUOTED"].writerow( cells )
+            else:
+                out["TEXT"].writerow( cells )
+        out["ROWS"] += len( rows )
+        if out["ROWS"] >= self.batch_rows:
+            self.flush_destination( out )
+
+    def write_record( self, record, section=None ):
+        self.write_row( check_row( record ), section )
+
+    def open_sections( self, sections ):
+        for section in sections:
+            self.section_out[section] = self.open_destination( tempfile.TemporaryFile( mode="w+" ) )
+            self.sections.append( section )
+
+    def close_sections( self ):
+        self.flush_destination( self.out )
+        try:
+            for section in self.sections:
+                out = self.section_out[section]
+                self.flush_destination( out )
+                out["FILE"].seek( 0 )
+                shutil.copyfileobj( out["FILE"], self.out["FILE"] )
+        finally:
+            for section in self.sections:
+                self.section_out[section]["FILE"].close()
+            self.sections = []
+            self.section_out = {}
+
+    def flush( self ):
+        self.flush_destination( self.out )
+
+    def close( self ):
+        if len( self.sections ) > 0:
+            self.close_sections()
+        self.flush()
+
+
+class multi_report_writer():
+    """
+    Sends everything written to it to each of a list of report writers
+    """
+    def __init__( self, writers ):
+        self.writers = writers
+
+    def write_comment( self, comment, section=None ):
+        for writer in self.writers:
+            writer.write_comment( comment, section )
+
+    def write_heading( self, heading, section=None ):
+        for writer in self.writers:
+            writer.write_heading( heading, section )
+
+    def write_row( self, row, section=None ):
+        for writer in self.writers:
+            writer.write_row( row, section )
+
+    def write_rows( self, rows, section=None ):
+        for writer in self.writers:
+            writer.write_rows( rows, section )
+
+    def write_record( self, record, section=None ):
+        for writer in self.writers:
+            writer.write_record( record, section )
+
+    def open_sections( self, sections ):
+        for writer in self.writers:
+            writer.open_sections( sections )
+
+    def close_sections( self ):
+        for writer in self.writers:
+            writer.close_sections()
+
+    def flush( self ):
+        for writer in self.writers:
+            writer.flush()
+
+    def close( self ):
+        for writer in self.writers:
+            writer.close()
+
+
+class count_report_writer():
+    """
+    Counts check records per report as they are written:
+        counts = { Report: { "CHECKS": n, "IGNORED": n, "TRACE FAIL": n, "VOLT FAIL": n, "CONFLICT": n }, ... }
+    TRACE FAIL counts traces that failed, VOLT FAIL desired voltages that were not found and
+    CONFLICT checks whose pull voltages disagree. Ignored checks are only counted as IGNORED.
+    """
+    def __init__( self ):
+        self.counts = {}
+
+    def write_comment( self, comment, section=None ):
+        pass
+
+    def write_heading( self, heading, section=None ):
+        pass
+
+    def write_row( self, row, section=None ):
+        pass
+
+    def write_rows( self, rows, section=None ):
+        pass
+
+    def write_record( self, record, section=None ):
+        if record["REPORT"] not in self.counts:
+            self.counts[record["REPORT"]] = { "CHECKS": 0, "IGNORED": 0, "TRACE FAIL": 0, "VOLT FAIL": 0, "CONFLICT": 0 }
+        counts = self.counts[record["REPORT"]]
+        counts["CHECKS"] += 1
+        if record["IGNORE"]:
+            counts["IGNORED"] += 1
+            return
+        if record["TRACE"] is False:
+            counts["TRACE FAIL"] += 1
+        if record["VOLT_FLAG"] is False:
+            counts["VOLT FAIL"] += 1
+        if record["COMMON_VOLT_FLAG"] is False:
+            counts["CONFLICT"] += 1
+
+    def open_sections( self, sections ):
+        pass
+
+    def close_sections( self ):
+        pass
+
+    def flush( self ):
+        pass
+
+    def close( self ):
+        pass
+
+
+RESULTS_DB_TABLES = [
+    """CREATE TABLE checks ( check_id INTEGER PRIMARY KEY, report TEXT, section TEXT,
+                             from_id_signal TEXT, from_board TEXT, from_net TEXT,
+                             to_id_signal TEXT, to_board TEXT, to_net TEXT,
+                             desired_volt REAL, trace INTEGER, ignore INTEGER, volt_flag INTEGER,
+                             common_volt_flag INTEGER, common_volt REAL )""",
+    """CREATE TABLE path_hops ( check_id INTEGER, hop INTEGER, board TEXT, ref TEXT, pin TEXT, id_ref_pin TEXT )""",
+    """CREATE TABLE pulls ( check_id INTEGER, pull INTEGER, board TEXT, description TEXT, volt REAL )""",
+    """CREATE TABLE voltages ( check_id INTEGER, volt_index INTEGER, volt REAL )""",
+    """CREATE TABLE comments ( before_check_id INTEGER, comment TEXT )""",
+    ]
+
+RESULTS_DB_INDEXES = [
+    "CREATE INDEX checks_report ON checks ( report, section, from_board )",
+    "CREATE INDEX checks_from ON checks ( from_board, from_net )",
+    "CREATE INDEX checks_to ON checks ( to_board, to_net )",
+    "CREATE INDEX path_hops_check ON path_hops ( check_id )",
+    "CREATE INDEX path_hops_pin ON path_hops ( board, ref, pin )",
+    "CREATE INDEX pulls_check ON pulls ( check_id )",
+    "CREATE INDEX pulls_board ON pulls ( board )",
+    "CREATE INDEX voltages_check ON voltages ( check_id )",
+    ]
+
+# First bytes of every SQLite database file
+SQLITE_HEADER = "SQLite format 3\0"
+
+def open_results_db( filename ):
+    """
+    Create an empty results database, replacing any existing file, and return the connection.
+    Indexes are created by close_results_db once all rows are in.
+    """
+    if os.path.exists( filename ):
+        os.remove( filename )
+    db = sqlite3.connect( filename )
+    db.execute( "PRAGMA synchronous = OFF" )
+    db.execute( "PRAGMA journal_mode = MEMORY" )
+    for table in RESULTS_DB_TABLES:
+        db.execute( table )
+    db.commit()
+    return db
+
+def close_results_db( db ):
+    for index in RESULTS_DB_INDEXES:
+        db.execute( index )
+    db.commit()
+    db.close()
+
+
+def split_id_signal( id_signal ):
+    """
+    Returns ( ID, Signal ) for an ID.Signal, or ( None, None ) if it is blank
+    """
+    token = id_signal.split( ".", 1 )
+    if len( token ) < 2:
+        return ( None, None )
+    return ( token[0], token[1] )
+
+
+def split_hop( id_ref_pin ):
+    """
+    Returns ( ID, Ref, Pin ) for a PATH entry, missing parts are None
+    """
+    token = id_ref_pin.split( "." )
+    token += [ None ] * ( 3 - len( token ) )
+    return ( token[0], token[1], token[2] )
+
+
+def pull_board( description, board ):
+    """
+    Returns the board ID a PULL description refers to, board is used for "direct to" pulls
+    """
+    if description.startswith( "direct to " ):
+        return board
+    return description.split( "." )[0]
+
+
+class sqlite_report_writer():
+    """
+    Inserts check records into a results database (see open_results_db)
+        checks      One row per check, with board and net of both ends
+        path_hops   PATH of each check, one row per ID.Ref.Pin
+        pulls       PULL of each check with its voltage
+        voltages    VOLT of each check
+        comments    Comment blocks, placed before the check that follows them
+
+    Rows are inserted with executemany and committed every batch_rows checks.
+    Headings and non-check rows are not stored.
+    """
+    def __init__( self, db, batch_rows=5000 ):
+        self.db = db
+        self.batch_rows = batch_rows
+        self.section = None
+        self.pending = { "checks": [], "path_hops": [], "pulls": [], "voltages": [], "comments": [] }
+        ( max_id, ) = db.execute( "SELECT MAX( check_id ) FROM checks" ).fetchone()
+        self.next_check_id = ( max_id or 0 ) + 1
+
+    def write_comment( self, comment, section=None ):
+        self.pending["comments"].append( ( self.next_check_id, comment ) )
+
+    def write_heading( self, heading, section=None ):
+        pass
+
+    def write_row( self, row, section=None ):
+        pass
+
+    def write_rows( self, rows, section=None ):
+        pass
+
+    def write_record( self, record, section=None ):
+        check_id = self.next_check_id
+        self.next_check_id += 1
+
+        ( from_board, from_net ) = split_id_signal( record["FROM_SIGNAL"] )
+        ( to_board, to_net ) = split_id_signal( record["TO_SIGNAL"] )
+        self.pending["checks"].append( ( check_id, record["REPORT"], section, record["FROM"], from_board, from_net,
+                                         record["TO"], to_board, to_net, record["DESIRED_VOLT"], record["TRACE"],
+                                         record["IGNORE"], record["VOLT_FLAG"], record["COMMON_VOLT_FLAG"], record["COMMON_VOLT"] ) )
+
+        for ( hop, id_ref_pin ) in enumerate( record["PATH"] ):
+            self.pending["path_hops"].append( ( check_id, hop ) + split_hop( id_ref_pin ) + ( id_ref_pin, ) )
+
+        for ( pull, ( description, volt ) ) in enumerate( zip( record["PULL"], record["VOLT"] ) ):
+            self.pending["pulls"].append( ( check_id, pull, pull_board( description, from_board ), description, volt ) )
+
+        for ( volt_index, volt ) in enumerate( record["VOLT"] ):
+            self.pending["voltages"].append( ( check_id, volt_index, volt ) )
+
+        if len( self.pending["checks"] ) >= self.batch_rows:
+            self.flush()
+
+    def open_sections( self, sections ):
+        pass
+
+    def close_sections( self ):
+        self.flush()
+
+    def flush( self ):
+        for table in self.pending:
+            rows = self.pending[table]
+            if len( rows ) > 0:
+                placeholders = ", ".join( [ "?" ] * len( rows[0] ) )
+                self.db.executemany( "INSERT INTO %s VALUES ( %s )" % ( table, placeholders ), rows )
+                self.pending[table] = []
+        self.db.commit()
+
+    def close( self ):
+        self.flush()
+
+
+def check_object( record, section=None ):
+    """
+    Returns the JSON object of a check record, see json_report_writer
+    """
+    ( from_board, from_net ) = split_id_signal( record["FROM_SIGNAL"] )
+    path = []
+    for id_ref_pin in record["PATH"]:
+        ( board, ref, pin ) = split_hop( id_ref_pin )
+        path.append( { "board": board, "ref": ref, "pin": pin } )
+    pulls = []
+    for ( description, volt ) in zip( record["PULL"], record["VOLT"] ):
+        pulls.append( { "board": pull_board( description, from_board ), "source": description, "volt": volt } )
+
+    return { "type": "check", "report": record["REPORT"], "section": section,
+             "from": record["FROM"], "to": record["TO"],
+             "from_signal": record["FROM_SIGNAL"], "to_signal": record["TO_SIGNAL"],
+             "desired_volt": record["DESIRED_VOLT"], "trace": record["TRACE"], "ignore": record["IGNORE"],
+             "volt_flag": record["VOLT_FLAG"], "common_volt_flag": record["COMMON_VOLT_FLAG"],
+             "common_volt": record["COMMON_VOLT"], "path": path, "pulls": pulls,
+             "volts": record["VOLT"], "term": record["TERM"] }
+
+
+class json_report_writer():
+    """
+    Streams newline-delimited JSON, one object per line, flushed as soon as it is written:
+        { "type": "comment", "text": Comment }
+        { "type": "heading", "section": Section, "text": Heading }
+        { "type": "check", "report": Report, "section": Section, "from": ..., "to": ...,
+          "from_signal": ID.Signal, "to_signal": ID.Signal, "desired_volt": ..., "trace": ...,
+          "ignore": ..., "volt_flag": ..., "common_volt_flag": ..., "common_volt": ...,
+          "path": [ { "board": ID, "ref": Ref, "pin": Pin }, ... ],
+          "pulls": [ { "board": ID, "source": Pull description, "volt": Volt }, ... ],
+          "volts": [ Volt, ... ], "term": [ Termination, ... ] or null }
+
+    Sections are not reordered, records are written in the order they are computed.
+    Non-check rows are not written. The file is not closed by the writer.
+    """
+    def __init__( self, f ):
+        self.f = f
+
+    def write_object( self, obj ):
+        self.f.write( json.dumps( obj, sort_keys=True ) )
+        self.f.write( "\n" )
+        self.f.flush()
+
+    def write_comment( self, comment, section=None ):
+        self.write_object( { "type": "comment", "text": comment } )
+
+    def write_heading( self, heading, section=None ):
+        self.write_object( { "type": "heading", "section": section, "text": heading } )
+
+    def write_row( self, row, section=None ):
+        pass
+
+    def write_rows( self, rows, section=None ):
+        pass
+
+    def write_record( self, record, section=None ):
+        self.write_object( check_object( record, section ) )
+
+    def open_sections( self, sections ):
+        pass
+
+    def close_sections( self ):
+        pass
+
+    def flush( self ):
+        self.f.flush()
+
+    def close( self ):
+        self.f.flush()
+
+
+# Result fields compared by compare_report_writer, in the order changes are reported
+COMPARE_FIELDS = [ ( "TRACE", "TRACE" ), ( "IGNORE", "IGNORE" ), ( "VOLT_FLAG", "VOLT FLAG" ),
+                   ( "COMMON_VOLT_FLAG", "COMMON VOLT FLAG" ), ( "COMMON_VOLT", "COMMON VOLTAGE" ), ( "PATH", "PATH" ),
+                   ( "VOLT", "VOLT" ) ]
+
+def check_summary( record ):
+    """
+    Returns the compared fields of a check record. Voltages are kept as "%.2f" strings,
+    as written to the CSV report, and PATH and VOLT as tuples.
+    """
+    summary = { "TRACE": record["TRACE"], "IGNORE": record["IGNORE"], "VOLT_FLAG": record["VOLT_FLAG"],
+                "COMMON_VOLT_FLAG": record["COMMON_VOLT_FLAG"], "COMMON_VOLT": None, "PATH": tuple( record["PATH"] ),
+                "VOLT": tuple( [ "%.2f" % volt for volt in record["VOLT"] ] ) }
+    if record["COMMON_VOLT"] is not None:
+        summary["COMMON_VOLT"] = "%.2f" % record["COMMON_VOLT"]
+    return summary
+
+
+def parse_cell( cell ):
+    """
+    Returns the value of a CSV report cell in either style, ="Value" or Value
+    """
+    if cell.startswith( '="' ) and cell.endswith( '"' ):
+        return cell[2:-1].replace( '""', '"' )
+    return cell
+
+
+def parse_flag( cell ):
+    if cell == "TRUE":
+        return True
+    elif cell == "FALSE":
+        return False
+    return None
+
+
+def parse_check_row( cells ):
+    """
+    Returns ( FROM, TO, Summary ) for a CSV check row (see check_row and check_summary),
+    or None if the row is not a check
+    """
+    if len( cells ) < 10 or cells[9] != "PATH":
+        return None
+
+    path = []
+    volts = []
+    field = "PATH"
+    for cell in cells[10:]:
+        if cell == "PULL" or cell == "VOLT" or cell == "TERM":
+            field = cell
+        elif field == "PATH":
+            path.append( parse_cell( cell ) )
+        elif field == "VOLT" and len( cell ) > 0:
+            volts.append( parse_cell( cell ) )
+    common_volt = parse_cell( cells[8] )
+    if common_volt == "#N/A":
+        common_volt = None
+
+    summary = { "TRACE": parse_flag( cells[4] ), "IGNORE": parse_flag( cells[5] ), "VOLT_FLAG": parse_flag( cells[6] ),
+                "COMMON_VOLT_FLAG": parse_flag( cells[7] ), "COMMON_VOLT": common_volt, "PATH": tuple( path ),
+                "VOLT": tuple( volts ) }
+    return ( parse_cell( cells[1] ), parse_cell( cells[2] ), summary )
+
+
+def load_check_csv( f ):
+    """
+    Reads the checks of a CSV report written by csv_report_writer, in either style
+
+    Returns { ( FROM, TO, Occurrence ): Summary, ... }, Occurrence counts repeats of the
+    same FROM and TO from 0. Each summary also holds its position in the file as ["ROW"].
+    """
+    checks = {}
+    seen = {}
+    for cells in csv.reader( f ):
+        check = parse_check_row( cells )
+        if check is not None:
+            ( from_id_signal, to_id_signal, summary ) = check
+            key = ( from_id_signal, to_id_signal )
+            occurrence = seen.get( key, 0 )
+            seen[key] = occurrence + 1
+            summary["ROW"] = len( checks )
+            checks[key + ( occurrence, )] = summary
+    return checks
+
+
+def load_check_db( db, reports ):
+    """
+    Reads the checks of the given reports ( "CHECKTRACE", "CHECKVOLT", "ALLVOLT" ) from a
+    results database (see sqlite_report_writer), keyed as load_check_csv does
+    """
+    paths = {}
+    for ( check_id, id_ref_pin ) in db.execute( "SELECT check_id, id_ref_pin FROM path_hops ORDER BY check_id, hop" ):
+        paths.setdefault( check_id, [] ).append( id_ref_pin )
+    volts = {}
+    for ( check_id, volt ) in db.execute( "SELECT check_id, volt FROM voltages ORDER BY check_id, volt_index" ):
+        volts.setdefault( check_id, [] ).append( "%.2f" % volt )
+
+    checks = {}
+    seen = {}
+    placeholders = ", ".join( [ "?" ] * len( reports ) )
+    query = """SELECT check_id, from_id_signal, to_id_signal, trace, ignore, volt_flag, common_volt_flag, common_volt
+               FROM checks WHERE report IN ( %s ) ORDER BY check_id""" % placeholders
+    for row in db.execute( query, tuple( reports ) ):
+        ( check_id, from_id_signal, to_id_signal ) = row[0:3]
+        flags = [ None if flag is None else flag != 0 for flag in row[3:7] ]
+        summary = { "TRACE": flags[0], "IGNORE": flags[1], "VOLT_FLAG": flags[2], "COMMON_VOLT_FLAG": flags[3],
+                    "COMMON_VOLT": None, "PATH": tuple( paths.get( check_id, [] ) ),
+                    "VOLT": tuple( volts.get( check_id, [] ) ), "ROW": len( checks ) }
+        if row[7] is not None:
+            summary["COMMON_VOLT"] = "%.2f" % row[7]
+        key = ( from_id_signal, to_id_signal )
+        occurrence = seen.get( key, 0 )
+        seen[key] = occurrence + 1
+        checks[key + ( occurrence, )] = summary
+    return checks
+
+
+def is_sqlite_file( filename ):
+    """
+    Returns True if filename starts with the SQLite database header
+    """
+    f = open( filename, "rb" )
+    try:
+        return f.read( len( SQLITE_HEADER ) ) == SQLITE_HEADER
+    finally:
+        f.close()
+
+
+def load_old_checks( filename, reports ):
+    """
+    Reads a previous run's checks from a CSV report, or from a results database if
+    filename is an SQLite file (only the given reports are read from a database)
+    """
+    if is_sqlite_file( filename ):
+        db = sqlite3.connect( filename )
+        try:
+            return load_check_db( db, reports )
+        finally:
+            db.close()
+    f = open( filename, "rb" )
+    try:
+        return load_check_csv( f )
+    finally:
+        f.close()
+
+
+def summary_cell( field, value ):
+    if field == "PATH" or field == "VOLT":
+        return ( TEXT, " ".join( value ) )
+    elif field == "COMMON_VOLT":
+        if value is None:
+            return ( RAW, "#N/A" )
+        return ( TEXT, value )
+    return flag_cell( value )
+
+
+class compare_report_writer():
+    """
+    Compares check records, as they are written, against a previous run's checks (see
+    load_old_checks) and writes one row per difference to another report writer:
+        COMMENT,CHANGE,FROM,TO,OLD,NEW
+
+    Checks are matched on FROM, TO and occurrence with a dictionary lookup, so each record
+    is compared once as it streams past. CHANGE is ADDED, REMOVED, NEW CONFLICT (pull
+    voltages now disagree), RESOLVED CONFLICT, or the name of a field that changed.
+    Checks only in the previous run are written as REMOVED, followed by a count of each
+    change, when the writer is closed.
+    """
+    def __init__( self, old_checks, writer ):
+        self.old_checks = old_checks
+        self.writer = writer
+        self.seen = {}
+        self.changes = {}
+
+    def write_change( self, change, record_from, record_to, old_cell, new_cell ):
+        self.changes[change] = self.changes.get( change, 0 ) + 1
+        self.writer.write_row( [ ( RAW, "" ), ( RAW, change ), ( TEXT, record_from ), ( TEXT, record_to ),
+                                 old_cell, new_cell, ( RAW, "" ) ] )
+
+    def write_comment( self, comment, section=None ):
+        pass
+
+    def write_heading( self, heading, section=None ):
+        pass
+
+    def write_row( self, row, section=None ):
+        pass
+
+    def write_rows( self, rows, section=None ):
+        pass
+
+    def write_record( self, record, section=None ):
+        key = ( record["FROM"], record["TO"] )
+        occurrence = self.seen.get( key, 0 )
+        self.seen[key] = occurrence + 1
+
+        new = check_summary( record )
+        old = self.old_checks.pop( key + ( occurrence, ), None )
+        if old is None:
+            self.write_change( "ADDED", record["FROM"], record["TO"], ( RAW, "" ), ( RAW, "" ) )
+            if new["COMMON_VOLT_FLAG"] is False:
+                self.write_change( "NEW CONFLICT", record["FROM"], record["TO"], ( RAW, "" ), flag_cell( False ) )
+            return
+
+        for ( field, name ) in COMPARE_FIELDS:
+            if old[field] != new[field]:
+                self.write_change( name, record["FROM"], record["TO"], summary_cell( field, old[field] ), summary_cell( field, new[field] ) )
+        if new["COMMON_VOLT_FLAG"] is False and old["COMMON_VOLT_FLAG"] is not False:
+            self.write_change( "NEW CONFLICT", record["FROM"], record["TO"], flag_cell( old["COMMON_VOLT_FLAG"] ), flag_cell( False ) )
+        elif old["COMMON_VOLT_FLAG"] is False and new["COMMON_VOLT_FLAG"] is not False:
+            self.write_change( "RESOLVED CONFLICT", record["FROM"], record["TO"], flag_cell( False ), flag_cell( new["COMMON_VOLT_FLAG"] ) )
+
+    def open_sections( self, sections ):
+        pass
+
+    def close_sections( self ):
+        pass
+
+    def flush( self ):
+        self.writer.flush()
+
+    def close( self ):
+        removed = sorted( self.old_checks.items(), key=lambda item: item[1]["ROW"] )
+        for ( ( from_id_signal, to_id_signal, occurrence ), summary ) in removed:
+            self.write_change( "REMOVED", from_id_signal, to_id_signal, ( RAW, "" ), ( RAW, "" ) )
+        self.old_checks = {}
+
+        self.writer.write_heading( "COMPARISON SUMMARY" )
+        for change in sorted( self.changes ):
+            self.writer.write_row( [ ( RAW, "" ), ( RAW, change ), ( RAW, "%d" % self.changes[change] ) ] )
+        self.writer.close()
+
+
+# ( Section, Sheet name ) in workbook order, sections not listed go to the first sheet
+XLSX_SHEETS = [ ( None, "Checks" ), ( "CONFLICT", "Volt Conflicts" ), ( "NA", "NA Signals" ),
+                ( "NON-CONFLICT", "Non-Conflicts" ), ( "MAP", "Maps" ) ]
+
+# Rows per worksheet, a section that fills a sheet continues on "Name (2)", ...
+XLSX_MAX_ROWS = 1048576
+
+def open_xlsx_workbook( filename ):
+    """
+    Create a write-only workbook. Rows are streamed to temporary files as they are written
+    (constant_memory), so the workbook is never held in memory. The file is written when
+    the workbook is closed.
+    """
+    if xlsxwriter is None:
+        raise ImportError( "xlsxwriter is required for .xlsx output" )
+    return xlsxwriter.Workbook( filename, { "constant_memory": True, "strings_to_numbers": False,
+                                            "strings_to_formulas": False, "strings_to_urls": False } )
+
+
+class xlsx_report_writer():
+    """
+    Streams report rows into a workbook (see open_xlsx_workbook), one worksheet per section
+    as given by sheets. Cells are typed:
+        TEXT        String
+        VOLT        Number, shown with 2 decimals
+        RAW         TRUE / FALSE as booleans, anything else as a string
+    Empty cells are left blank.
+
+    Comments are written in the first column and headings in the second, each after a
+    blank row, as in the CSV report. Sections are written in the order rows arrive, each
+    sheet only ever grows so open_sections / close_sections do nothing.
+
+    The workbook is not closed by the writer.
+    """
+    def __init__( self, workbook, sheets=XLSX_SHEETS, max_rows=XLSX_MAX_ROWS ):
+        self.workbook = workbook
+        self.max_rows = max_rows
+        self.sheet_names = {}
+        self.sheet_out = {}
+        self.default_section = sheets[0][0]
+        self.volt_format = workbook.add_format( { "num_format": "0.00" } )
+        self.heading_format = workbook.add_format( { "bold": True } )
+        for ( section, name ) in sheets:
+            self.sheet_names[section] = name
+            self.sheet_out[section] = { "SHEET": workbook.add_worksheet( name ), "ROW": 0, "PART": 1 }
+
+    def destination( self, section, rows=1 ):
+        """
+        Returns the sheet for a section, starting a new sheet if rows more rows would not fit
+        """
+        if section not in self.sheet_out:
+            section = self.default_section
+        out = self.sheet_out[section]
+        if out["ROW"] + rows > self.max_rows:
+            out["PART"] += 1
+            out["SHEET"] = self.workbook.add_worksheet( "%s (%d)" % ( self.sheet_names[section], out["PART"] ) )
+            out["ROW"] = 0
+        return out
+
+    def write_cells( self, sheet, row_num, row ):
+        for ( col_num, ( cell_type, value ) ) in enumerate( row ):
+            if cell_type == VOLT:
+                sheet.write_number( row_num, col_num, value, self.volt_format )
+            elif len( value ) == 0:
+                continue
+            elif cell_type == RAW and ( value == "TRUE" or value == "FALSE" ):
+                sheet.write_boolean( row_num, col_num, value == "TRUE" )
+            else:
+                sheet.write_string( row_num, col_num, value )
+
+    def write_comment( self, comment, section=None ):
+        lines = comment.rstrip( "\n" ).split( "\n" )
+        out = self.destination( section, len( lines ) + 1 )
+        out["ROW"] += 1
+        for line in lines:
+            out["SHEET"].write_string( out["ROW"], 0, line )
+            out["ROW"] += 1
+
+    def write_heading( self, heading, section=None ):
+        out = self.destination( section, 2 )
+        out["SHEET"].write_string( out["ROW"] + 1, 1, heading, self.heading_format )
+        out["ROW"] += 2
+
+    def write_row( self, row, section=None ):
+        out = self.destination( section )
+        self.write_cells( out["SHEET"], out["ROW"], row )
+        out["ROW"] += 1
+
+    def write_rows( self, rows, section=None ):
+        for row in rows:
+            self.write_row( row, section )
+
+    def write_record( self, record, section=None ):
+        self.write_row( check_row( record ), section )
+
+    def open_sections( self, sections ):
+        pass
+
+    def close_sections( self ):
+        pass
+
+    def flush( self ):
+        pass
+
+    def close( self ):
+        pass
+
+
+# vi:set shiftwidth=4 tabstop=4:
+# vim:set expandtab list lcs=tab\:>>:
@@ -0,0 +1,100 @@
+"""
+RUN_PROFILE.py - Phase timings, traversal counters and slowest checks of a run
+
+A run_profile is handed to system_connections (syscon.profile) to collect:
+    Phases      Wall time and number of calls of each named phase, in first-seen order
+    Counters    Named counts, eg. calls and nodes visited by trace_netlist_signal,
+                path copies and cache hits
+    Rows        The slowest checks, kept in a bounded heap as they are timed
+"""
+
+import contextlib
+import heapq
+import json
+import time
+
+# Number of slowest check rows kept by default
+SLOWEST_ROWS = 10
+
+class run_profile():
+    def __init__( self, slowest=SLOWEST_ROWS ):
+        self.slowest = slowest
+        self.phase_order = []
+        self.phases = {}
+        self.counters = {}
+        self.rows = []
+        self.start = time.time()
+
+    @contextlib.contextmanager
+    def phase( self, name ):
+        """
+        Times the enclosed block as phase name, repeated phases are added together
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_phase( name, time.time() - start )
+
+    def add_phase( self, name, seconds ):
+        if name not in self.phases:
+            self.phase_order.append( name )
+            self.phases[name] = { "calls": 0, "seconds": 0.0 }
+        self.phases[name]["calls"] += 1
+        self.phases[name]["seconds"] += seconds
+
+    def count( self, name, n=1 ):
+        self.counters[name] = self.counters.get( name, 0 ) + n
+
+    def time_row( self, report, from_id_signal, to_id_signal, seconds ):
+        """
+        Offers a timed check row, only the slowest are kept
+        """
+        row = ( seconds, report, from_id_signal, to_id_signal )
+        if len( self.rows ) < self.slowest:
+            heapq.heappush( self.rows, row )
+        elif self.slowest > 0 and row > self.rows[0]:
+            heapq.heapreplace( self.rows, row )
+
+    def slowest_rows( self ):
+        """
+        Returns [ ( Seconds, Report, From, To ), ... ], slowest first
+        """
+        return sorted( self.rows, reverse=True )
+
+    def to_dict( self ):
+        return { "total_seconds": time.time() - self.start,
+                 "phases": [ { "name": name, "calls": self.phases[name]["calls"], "seconds": self.phases[name]["seconds"] }
+                             for name in self.phase_order ],
+                 "counters": self.counters,
+                 "slowest_rows": [ { "seconds": seconds, "report": report, "from": from_id_signal, "to": to_id_signal }
+                                   for ( seconds, report, from_id_signal, to_id_signal ) in self.slowest_rows() ] }
+
+    def write_json( self, f ):
+        json.dump( self.to_dict(), f, indent=1, sort_keys=True )
+        f.write( "\n" )
+
+    def write_summary( self, f ):
+        """
+        Writes the profile as plain text tables
+        """
+        total = time.time() - self.start
+        f.write( "\n%-32s %8s %10s %6s\n" % ( "PHASE", "CALLS", "SECONDS", "%" ) )
+        for name in self.phase_order:
+            phase = self.phases[name]
+            f.write( "%-32s %8d %10.3f %6.1f\n" % ( name, phase["calls"], phase["seconds"], 100.0 * phase["seconds"] / max( total, 1e-9 ) ) )
+        f.write( "%-32s %8s %10.3f\n" % ( "TOTAL", "", total ) )
+
+        if len( self.counters ) > 0:
+            f.write( "\n%-32s %12s\n" % ( "COUNTER", "COUNT" ) )
+            for name in sorted( self.counters ):
+                f.write( "%-32s %12d\n" % ( name, self.counters[name] ) )
+
+        if len( self.rows ) > 0:
+            f.write( "\n%-10s %-10s %s\n" % ( "SECONDS", "REPORT", "FROM -> TO" ) )
+            for ( seconds, report, from_id_signal, to_id_signal ) in self.slowest_rows():
+                f.write( "%-10.4f %-10s %s -> %s\n" % ( seconds, report, from_id_signal, to_id_signal ) )
+
+
+# vi:set shiftwidth=4 tabstop=4:
+# vim:set expandtab list lcs=tab\:>>:
@@ -0,0 +1,299 @@
+"""
+SYSCON_BATCH.py - Checks many system configurations that share netlists
+
+Every configuration (system connections file) is loaded first, in this process, through one
+netlist.netlist_cache, so each distinct netlist file is parsed once however many
+configurations use it. The configurations are then analysed and their reports written,
+one configuration per worker process. Workers are forked after loading, so they share the
+parsed netlists with this process instead of receiving pickled copies.
+
+Each configuration's reports are written to OUT/STEM/ as system_connections.py -o STEM
+would write them (STEM is the configuration's filename without extension), and a summary
+of every configuration is written to OUT/batch_summary.csv:
+    FILE,OUT,CHECKTRACE,TRACE FAIL,CHECKTRACE VOLT FAIL,CHECKVOLT,CHECKVOLT VOLT FAIL,
+    CHECKVOLT CONFLICT,ALLVOLT,ALLVOLT CONFLICT,IGNORED,ERRORS,SECONDS
+"""
+
+import sys
+import getopt
+import glob
+import logging
+import multiprocessing
+import os
+import time
+
+import netlist
+import report_writer
+import run_profile
+import system_connections
+
+log = logging.getLogger( "syscon_batch" )
+
+# ( Report, Count, Heading ) columns of the summary, counts from report_writer.count_report_writer
+SUMMARY_COUNTS = [ ( "CHECKTRACE", "CHECKS", "CHECKTRACE" ), ( "CHECKTRACE", "TRACE FAIL", "TRACE FAIL" ),
+                   ( "CHECKTRACE", "VOLT FAIL", "CHECKTRACE VOLT FAIL" ), ( "CHECKVOLT", "CHECKS", "CHECKVOLT" ),
+                   ( "CHECKVOLT", "VOLT FAIL", "CHECKVOLT VOLT FAIL" ), ( "CHECKVOLT", "CONFLICT", "CHECKVOLT CONFLICT" ),
+                   ( "ALLVOLT", "CHECKS", "ALLVOLT" ), ( "ALLVOLT", "CONFLICT", "ALLVOLT CONFLICT" ) ]
+
+# Loaded configurations and settings used by worker processes. Set before the pool is
+# forked so workers inherit them instead of receiving pickled copies
+_batch_systems = None
+_batch_settings = None
+
+def _batch_worker( index ):
+    return run_system( index )
+
+
+class error_counter( logging.Handler ):
+    """
+    Counts ERROR messages, so reports that failed to write are seen in the summary
+    """
+    def __init__( self ):
+        logging.Handler.__init__( self, logging.ERROR )
+        self.errors = 0
+
+    def emit( self, record ):
+        self.errors += 1
+
+
+def expand_filenames( patterns ):
+    """
+    Returns the files matching each pattern, in order and without repeats. A pattern that
+    matches nothing is returned as is, so it is reported when it fails to load.
+    """
+    filenames = []
+    for pattern in patterns:
+        matches = sorted( glob.glob( pattern ) )
+        if len( matches ) == 0:
+            matches = [ pattern ]
+        for filename in matches:
+            if filename not in filenames:
+                filenames.append( filename )
+    return filenames
+
+
+def output_stems( filenames ):
+    """
+    Returns the output stem of each configuration, its filename without directory or
+    extension, numbered ( STEM_2, ... ) where two configurations have the same name
+    """
+    stems = []
+    for filename in filenames:
+        stem = os.path.splitext( os.path.basename( filename ) )[0]
+        candidate = stem
+        number = 1
+        while candidate in stems:
+            number += 1
+            candidate = "%s_%d" % ( stem, number )
+        stems.append( candidate )
+    return stems
+
+
+def load_systems( filenames, netlists ):
+    """
+    Returns [ ( Filename, system_connections, Load error messages ), ... ], netlists from the
+    netlist.netlist_cache netlists
+    """
+    systems = []
+    for filename in filenames:
+        syscon = system_connections.system_connections()
+        syscon.netlist_cache = netlists
+        errors = error_counter()
+        logging.getLogger().addHandler( errors )
+        try:
+            syscon.load_syscon_csv( filename )
+        finally:
+            logging.getLogger().removeHandler( errors )
+        systems.append( ( filename, syscon, errors.errors ) )
+    return systems
+
+
+def run_system( index ):
+    """
+    Analyses one loaded configuration and writes its reports to its output directory
+
+    Returns { "INDEX": n, "FILE": Filename, "OUT": Directory, "COUNTS": count_report_writer.counts,
+              "ERRORS": Number of error messages while loading and checking, "SECONDS": Time }
+    """
+    ( filename, out_directory, stem, syscon, load_errors ) = _batch_systems[index]
+    ( nodal, report_args ) = _batch_settings
+    start = time.time()
+    counter = report_writer.count_report_writer()
+    errors = error_counter()
+    logging.getLogger().addHandler( errors )
+    cwd = os.getcwd()
+    try:
+        profile = run_profile.run_profile()
+        # termination_check is the third report argument
+        system_connections.analyse_system( syscon, profile, nodal, report_args[2] )
+        if not os.path.isdir( out_directory ):
+            os.makedirs( out_directory )
+        # Volt_check.csv and the constraint files are written to the current directory
+        os.chdir( out_directory )
+        system_connections.write_reports( syscon, stem, profile, *report_args, writers=[ counter ] )
+    except Exception, e:
+        log.error( "%s: %s", filename, e )
+    finally:
+        os.chdir( cwd )
+        logging.getLogger().removeHandler( errors )
+
+    return { "INDEX": index, "FILE": filename, "OUT": out_directory, "COUNTS": counter.counts,
+             "ERRORS": load_errors + errors.errors, "SECONDS": time.time() - start }
+
+
+def run_batch( filenames, out_dir, jobs=1, nodal=False, report_args=() ):
+    """
+    Loads every configuration, then checks them with jobs worker processes
+
+    Returns the run_system results in filenames order
+    """
+    global _batch_systems, _batch_settings
+
+    netlists = netlist.netlist_cache()
+    start = time.time()
+    systems = load_systems( filenames, netlists )
+    log.info( "Loaded %d configurations in %.3fs, %d netlists parsed", len( systems ), time.time() - start, netlists.parsed )
+
+    stems = output_stems( filenames )
+    _batch_systems = [ ( filename, os.path.join( out_dir, stem ), stem, syscon, load_errors )
+                       for ( ( filename, syscon, load_errors ), stem ) in zip( systems, stems ) ]
+    _batch_settings = ( nodal, report_args )
+
+    pool = None
+    try:
+        if system_connections.worker_jobs( jobs ) > 1 and len( systems ) > 1:
+            pool = multiprocessing.Pool( min( jobs, len( systems ) ) )
+            results = list( pool.imap_unordered( _batch_worker, range( len( systems ) ) ) )
+            pool.close()
+            pool.join()
+            pool = None
+        else:
+            results = [ run_system( index ) for index in range( len( systems ) ) ]
+    finally:
+        if pool is not None:
+            pool.terminate()
+        _batch_systems = None
+        _batch_settings = None
+
+    return sorted( results, key=lambda result: result["INDEX"] )
+
+
+def write_summary( writer, results ):
+    """
+    Writes one summary row per configuration, then the totals
+    """
+    writer.write_row( [ ( report_writer.RAW, heading ) for heading in
+                        [ "FILE", "OUT" ] + [ heading for ( report, count, heading ) in SUMMARY_COUNTS ] + [ "IGNORED", "ERRORS", "SECONDS" ] ] )
+    totals = [ 0 ] * ( len( SUMMARY_COUNTS ) + 2 )
+    for result in results:
+        values = [ result["COUNTS"].get( report, {} ).get( count, 0 ) for ( report, count, heading ) in SUMMARY_COUNTS ]
+        values.append( sum( [ counts["IGNORED"] for counts in result["COUNTS"].values() ] ) )
+        values.append( result["ERRORS"] )
+        totals = [ total + value for ( total, value ) in zip( totals, values ) ]
+        writer.write_row( [ ( report_writer.TEXT, result["FILE"] ), ( report_writer.TEXT, result["OUT"] ) ] +
+                          [ ( report_writer.RAW, "%d" % value ) for value in values ] +
+                          [ ( report_writer.RAW, "%.3f" % result["SECONDS"] ) ] )
+    writer.write_row( [ ( report_writer.RAW, "TOTAL" ), ( report_writer.RAW, "%d" % len( results ) ) ] +
+                      [ ( report_writer.RAW, "%d" % total ) for total in totals ] )
+
+
+def usage():
+    print """
+
+syscon_batch.py [-opt] FILENAME ...
+
+    Checks every system connections FILENAME (wildcards such as variants/*.csv are expanded).
+    Reports of each are written to OUT/STEM/, a summary of all to OUT/batch_summary.csv
+
+    Option                      Description
+    -h          --help          Display this help
+
+    -o DIRECTORY --out=DIRECTORY
+                                Output directory (default batch)
+    -j VALUE    --jobs=VALUE    Number of configurations checked at the same time
+    -v VALUE    --volt=VALUE    1 for the complete netlist voltage check, see system_connections.py
+    -n          --nodal         Solve resistor networks for pull voltages (requires numpy and scipy)
+    -t          --term          Detect terminations
+    -r          --refvolt       Check all REFVOLT and DEVICEVOLT pins
+                --csv-style=STYLE
+                                excel (default) or plain, see system_connections.py
+                --check-refsig  Report REFSIG pins that are not in the netlist
+                --log-level=LEVEL
+                                Console message level: DEBUG, INFO, WARNING (default), ERROR
+"""
+
+
+def main( argv ):
+    out_dir = "batch"
+    jobs = 1
+    system_volt_check = False
+    nodal = False
+    termination_check = False
+    ref_volt_check = False
+    csv_style = "excel"
+    refsig_check = False
+    log_level = "WARNING"
+
+    try:
+        opts, args = getopt.getopt( argv, "ho:j:v:ntr",
+                    ["help", "out=", "jobs=", "volt=", "nodal", "term", "refvolt", "csv-style=", "check-refsig", "log-level="] )
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ("-o", "--out"):
+            out_dir = arg
+        if opt in ("-j", "--jobs"):
+            try:
+                jobs = int( arg )
+            except:
+                jobs = 1
+        if opt in ("-v", "--volt"):
+            system_volt_check = arg == "1"
+        if opt in ("-n", "--nodal"):
+            nodal = True
+        if opt in ("-t", "--term"):
+            termination_check = True
+        if opt in ("-r", "--refvolt"):
+            ref_volt_check = True
+        if opt in ("--csv-style",):
+            csv_style = arg
+        if opt in ("--check-refsig",):
+            refsig_check = True
+        if opt in ("--log-level",):
+            log_level = arg
+        elif opt in ("-h", "--help"):
+            usage()
+            sys.exit()
+
+    filenames = expand_filenames( args )
+    if len( filenames ) == 0:
+        usage()
+        sys.exit(2)
+
+    system_connections.setup_logging( log_level )
+
+    # Worker processes write the reports of one configuration each, so they do not start pools of their own
+    report_args = ( system_volt_check, 1, termination_check, ref_volt_check, csv_style, "", "", "", refsig_check, "", "" )
+    results = run_batch( filenames, out_dir, jobs, nodal, report_args )
+
+    if not os.path.isdir( out_dir ):
+        os.makedirs( out_dir )
+    out_filename = os.path.join( out_dir, "batch_summary.csv" )
+    try:
+        f = open( out_filename, "w" )
+        writer = report_writer.csv_report_writer( f, csv_style )
+        write_summary( writer, results )
+        writer.close()
+        f.close()
+    except Exception, e:
+        log.error( "%s: %s", out_filename, e )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
+
+
+# vi:set shiftwidth=4 tabstop=4:
+# vim:set expandtab list lcs=tab\:>>:
@@ -0,0 +1,559 @@
+"""
+SYSCON_BENCH.py - Synthetic systems and benchmarks for system_connections
+
+generate_system writes a system of boards at a configurable scale, each a PADS .asc
+netlist with:
+    U1              FPGA, IO pins in banks, the top tenth of the pins on rails
+    J1 .. Jn        Connectors, every tenth pin on GND
+    U10 ..          BUF245 buffers between FPGA and connector pins (DEVICELINK)
+    R1 ..           Pull-ups / pull-downs on connector signals and resistor ladders
+    P3V3, P1V8 and GND rails
+
+plus a system connections CSV. Odd connectors of each board mate with the even
+connectors of the next board through a chain of harnesses, and every mated signal
+gets a CHECKTRACE between the two FPGAs. Ladder nets get CHECKVOLT rows, and each
+FPGA and connector gets a MAP, DEVICEPIN and REFSIG rows.
+
+run_benchmark times each phase of a run on a system and records peak memory (where the
+resource module is available, not on Windows). Results
+are appended to a JSON file, and compared with the last run of the same system so
+regressions show up between versions. With components, it also times whether pairs of
+nets are joined, answered from connected component labels and by the recursive trace.
+"""
+
+import sys
+import os
+import getopt
+import json
+import logging
+import random
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import netlist
+import report_writer
+import system_connections
+
+log = logging.getLogger( "syscon_bench" )
+
+# Default scale, a mid-sized system
+DEFAULT_SCALE = { "boards": 4, "fpga_pins": 1700, "connectors": 8, "connector_pins": 200, "hops": 2,
+                  "buffers": 8, "ladders": 20, "seed": 1 }
+
+# BUF245 A side pins 2-9 drive B side pins 18-11, pin 10 GND, pin 20 VCC
+BUFFER_LINKS = [ ( a_pin, 20 - a_pin ) for a_pin in range( 2, 10 ) ]
+
+BANK_PINS = 50
+
+# Phases slower than the previous run of the same system by more than this ratio, and by
+# more than the minimum time so timer noise on short phases is not reported, are regressions
+REGRESSION_RATIO = 1.2
+REGRESSION_MIN_SECONDS = 0.1
+
+# Random pairs of nets on different boards asked by the components benchmark, in addition
+# to the CHECKTRACE rows
+COMPONENT_PAIRS = 200
+
+
+def board_id( board ):
+    return "B%d" % board
+
+
+def generate_board( filename, scale, rng ):
+    """
+    Writes one board netlist. Returns a dictionary describing it for generate_system:
+        { "CONNECTOR": { Ref: [ ( Pin, Connector Signal, FPGA Signal, Pull ), ... ] },
+          "FPGA_PINS": [ ( Pin, Signal ), ... ], "LADDERS": [ ( Signal, Volt ), ... ],
+          "RAIL_PINS": { Rail: [ FPGA Pin, ... ] } }
+    """
+    parts = []
+    nets = {}
+    info = { "CONNECTOR": {}, "FPGA_PINS": [], "LADDERS": [], "RAIL_PINS": {} }
+
+    def connect( signal, ref_pin ):
+        nets.setdefault( signal, [] ).append( ref_pin )
+
+    fpga_type = "FPGA_%d" % scale["fpga_pins"]
+    conn_type = "CONN%d" % scale["connector_pins"]
+    parts.append( ( "U1", fpga_type ) )
+
+    # Top tenth of the FPGA pins are power and ground
+    io_pins = scale["fpga_pins"] - scale["fpga_pins"] / 10
+    rails = [ "P3V3", "P1V8", "GND" ]
+    for pin in range( io_pins + 1, scale["fpga_pins"] + 1 ):
+        rail = rails[pin % len( rails )]
+        connect( rail, "U1.%d" % pin )
+        info["RAIL_PINS"].setdefault( rail, [] ).append( pin )
+
+    next_fpga_pin = 1
+    next_resistor = 1
+    buffers = []
+    for b in range( scale["buffers"] ):
+        ref = "U%d" % ( 10 + b )
+        parts.append( ( ref, "BUF245" ) )
+        connect( "GND", "%s.10" % ref )
+        connect( "P3V3", "%s.20" % ref )
+        for link in BUFFER_LINKS:
+            buffers.append( ( ref, link ) )
+
+    for c in range( 1, scale["connectors"] + 1 ):
+        ref = "J%d" % c
+        parts.append( ( ref, conn_type ) )
+        info["CONNECTOR"][ref] = []
+        for pin in range( 1, scale["connector_pins"] + 1 ):
+            if pin % 10 == 0:
+                connect( "GND", "%s.%d" % ( ref, pin ) )
+                continue
+            if next_fpga_pin > io_pins:
+                continue
+            fpga_pin = next_fpga_pin
+            next_fpga_pin += 1
+            conn_signal = "%s_%d" % ( ref, pin )
+            connect( conn_signal, "%s.%d" % ( ref, pin ) )
+            if len( buffers ) > 0 and rng.random() < 0.3:
+                # FPGA -> buffer A side, buffer B side -> connector
+                ( buf_ref, ( a_pin, b_pin ) ) = buffers.pop()
+                fpga_signal = "%s_%d_A" % ( ref, pin )
+                connect( fpga_signal, "U1.%d" % fpga_pin )
+                connect( fpga_signal, "%s.%d" % ( buf_ref, a_pin ) )
+                connect( conn_signal, "%s.%d" % ( buf_ref, b_pin ) )
+            else:
+                fpga_signal = conn_signal
+                connect( fpga_signal, "U1.%d" % fpga_pin )
+            info["FPGA_PINS"].append( ( fpga_pin, fpga_signal ) )
+
+            pull = None
+            if rng.random() < 0.2:
+                pull = "P3V3"
+            elif rng.random() < 0.05:
+                pull = "GND"
+            if pull is not None:
+                r_ref = "R%d" % next_resistor
+                next_resistor += 1
+                parts.append( ( r_ref, "RES_10K" ) )
+                connect( conn_signal, "%s.1" % r_ref )
+                connect( pull, "%s.2" % r_ref )
+            info["CONNECTOR"][ref].append( ( pin, conn_signal, fpga_signal, pull ) )
+
+    for ladder in range( scale["ladders"] ):
+        # P3V3 - RES_10K - DIVn - RES_10K - GND, sensed by the FPGA
+        signal = "DIV%d" % ladder
+        for ( value, rail ) in [ ( "RES_10K", "P3V3" ), ( "RES_10K", "GND" ) ]:
+            r_ref = "R%d" % next_resistor
+            next_resistor += 1
+            parts.append( ( r_ref, value ) )
+            connect( rail, "%s.1" % r_ref )
+            connect( signal, "%s.2" % r_ref )
+        if next_fpga_pin <= io_pins:
+            connect( signal, "U1.%d" % next_fpga_pin )
+            info["FPGA_PINS"].append( ( next_fpga_pin, signal ) )
+            next_fpga_pin += 1
+        info["LADDERS"].append( ( signal, 1.65 ) )
+
+    f = open( filename, "w" )
+    f.write( "*PADS-PCB*\n*PART*\n" )
+    for ( ref, part_type ) in parts:
+        f.write( "%s %s\n" % ( ref, part_type ) )
+    f.write( "\n*CONNECTION*\n" )
+    for signal in sorted( nets ):
+        ref_pins = nets[signal]
+        f.write( "*SIGNAL* %s\n" % signal )
+        if len( ref_pins ) == 1:
+            # A net with one pin still needs a connection line
+            ref_pins = ref_pins + ref_pins
+        for i in range( 1, len( ref_pins ) ):
+            f.write( "%s %s\n" % ( ref_pins[i-1], ref_pins[i] ) )
+    f.write( "\n*MISC*\n*END*\n" )
+    f.close()
+
+    return info
+
+
+def generate_system( directory, scale ):
+    """
+    Writes a synthetic system to directory (see module docstring). Returns the system
+    connections CSV filename.
+    """
+    rng = random.Random( scale["seed"] )
+    if not os.path.isdir( directory ):
+        os.makedirs( directory )
+
+    boards = []
+    for board in range( scale["boards"] ):
+        filename = "%s.asc" % board_id( board )
+        log.info( "Generating %s", filename )
+        boards.append( ( filename, generate_board( os.path.join( directory, filename ), scale, rng ) ) )
+
+    fpga_type = "FPGA_%d" % scale["fpga_pins"]
+    conn_type = "CONN%d" % scale["connector_pins"]
+    syscon_filename = os.path.join( directory, "system.csv" )
+    f = open( syscon_filename, "w" )
+    f.write( "COMMENT,Synthetic system %s\n" % ", ".join( [ "%s=%s" % ( key, scale[key] ) for key in sorted( scale ) ] ) )
+    for ( board, ( filename, info ) ) in enumerate( boards ):
+        # Netlists are given relative to the directory the benchmark runs in
+        f.write( "NETLIST,%s,%s\n" % ( board_id( board ), filename ) )
+    for ( a_pin, b_pin ) in BUFFER_LINKS:
+        f.write( "DEVICELINK,BUF245,%d,%d,1\n" % ( a_pin, b_pin ) )
+    f.write( "DEVICEVOLT,BUF245,3.3,20\n" )
+    f.write( "DEVICEVOLT,BUF245,0.0,10\n" )
+    f.write( "DEVICEPARAM,%s,DEVICETYPE,XILINX_FPGA\n" % fpga_type )
+    f.write( "DEVICEPIN,%s,RC,2,%d,TLH\n" % ( conn_type, scale["connector_pins"] / 2 ) )
+    io_pins = scale["fpga_pins"] - scale["fpga_pins"] / 10
+    for bank in range( 0, io_pins, BANK_PINS ):
+        pins = range( bank + 1, min( bank + BANK_PINS, io_pins ) + 1 )
+        f.write( "DEVICEPIN,%s,CATEGORY,BANK%d,%s\n" % ( fpga_type, bank / BANK_PINS, ",".join( [ "%d" % pin for pin in pins ] ) ) )
+
+    for ( board, ( filename, info ) ) in enumerate( boards ):
+        id = board_id( board )
+        for ( rail, volt ) in [ ( "P3V3", 3.3 ), ( "P1V8", 1.8 ) ]:
+            pins = info["RAIL_PINS"].get( rail, [] )[:20]
+            if len( pins ) > 0:
+                f.write( "REFVOLT,%s,U1,%.1f,%s\n" % ( id, volt, ",".join( [ "%d" % pin for pin in pins ] ) ) )
+        for ( pin, signal ) in info["FPGA_PINS"]:
+            f.write( "REFSIG,%s,U1,%d,io_%d,%s,LVCMOS33\n" % ( id, pin, pin, signal ) )
+
+    # Odd connectors of each board mate with the even connectors of the next through a harness chain
+    checks = []
+    if scale["boards"] > 1:
+        for ( board, ( filename, info ) ) in enumerate( boards ):
+            next_board = ( board + 1 ) % scale["boards"]
+            next_info = boards[next_board][1]
+            for c in range( 1, scale["connectors"], 2 ):
+                from_ref = "J%d" % c
+                to_ref = "J%d" % ( c + 1 )
+                harnesses = [ "H%d_%d_%d" % ( board, c, hop ) for hop in range( max( scale["hops"], 1 ) ) ]
+                f.write( "COMMENT,Harness %s.%s to %s.%s\n" % ( board_id( board ), from_ref, board_id( next_board ), to_ref ) )
+                for harness in harnesses:
+                    for pin in range( 1, scale["connector_pins"] + 1 ):
+                        f.write( "HARNESSLINK,%s,P1,%d,P2,%d\n" % ( harness, pin, pin ) )
+                f.write( "CONNECTION,%s,%s,%s,P1\n" % ( board_id( board ), from_ref, harnesses[0] ) )
+                for hop in range( 1, len( harnesses ) ):
+                    f.write( "CONNECTION,%s,P2,%s,P1\n" % ( harnesses[hop-1], harnesses[hop] ) )
+                f.write( "CONNECTION,%s,P2,%s,%s\n" % ( harnesses[-1], board_id( next_board ), to_ref ) )
+
+                to_pins = dict( [ ( pin, fpga_signal ) for ( pin, conn_signal, fpga_signal, pull ) in next_info["CONNECTOR"].get( to_ref, [] ) ] )
+                checks.append( "%s to %s" % ( from_ref, to_ref ) )
+                for ( pin, conn_signal, fpga_signal, pull ) in info["CONNECTOR"][from_ref]:
+                    if pin in to_pins:
+                        volt = ""
+                        if pull == "P3V3":
+                            volt = ",3.3"
+                        checks.append( ( board_id( board ), fpga_signal, board_id( next_board ), to_pins[pin], volt ) )
+
+    f.write( "COMMENT,Traces\n" )
+    for check in checks:
+        if isinstance( check, tuple ):
+            f.write( "CHECKTRACE,%s,%s,%s,%s,SIG%s\n" % check )
+        else:
+            f.write( "COMMENT,%s\n" % check )
+
+    f.write( "COMMENT,Ladders\n" )
+    for ( board, ( filename, info ) ) in enumerate( boards ):
+        for ( signal, volt ) in info["LADDERS"]:
+            f.write( "CHECKVOLT,%s,%s,LADDER,%.2f\n" % ( board_id( board ), signal, volt ) )
+
+    for ( board, ( filename, info ) ) in enumerate( boards ):
+        f.write( "COMMENT,Board %s\n" % board_id( board ) )
+        f.write( "MAP,%s,U1,FPGA\n" % board_id( board ) )
+        for ref in sorted( info["CONNECTOR"] ):
+            f.write( "MAP,%s,%s,Connector %s\n" % ( board_id( board ), ref, ref ) )
+    f.close()
+
+    return syscon_filename
+
+
+def peak_rss_kb():
+    """
+    Peak resident memory of this process and of finished worker processes so far, in KB,
+    ( None, None ) without the resource module
+    """
+    if resource is None:
+        return ( None, None )
+    scale = 1
+    if sys.platform == "darwin":
+        # ru_maxrss is in bytes on OS X
+        scale = 1024
+    return ( resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss / scale,
+             resource.getrusage( resource.RUSAGE_CHILDREN ).ru_maxrss / scale )
+
+
+def component_pairs( syscon, count, seed=1 ):
+    """
+    Returns [ ( From ID.Signal, To ID.Signal ), ... ], the CHECKTRACE rows and count random
+    pairs of nets on different boards
+    """
+    pairs = [ ( syscon.param_to_signal( from_signal )[1], syscon.param_to_signal( to_signal )[1] )
+              for ( from_signal, to_signal, check_dict ) in syscon.syscon_dict["CHECKTRACE"] if from_signal[0:6] != "$$##__" ]
+    ids = sorted( syscon.syscon_dict["NETLIST"] )
+    if len( ids ) > 1:
+        rng = random.Random( seed )
+        signals = dict( ( id, sorted( syscon.syscon_dict["NETLIST"][id]["CONNECTION"] ) ) for id in ids )
+        for n in range( count ):
+            ( from_id, to_id ) = rng.sample( ids, 2 )
+            pairs.append( ( "%s.%s" % ( from_id, rng.choice( signals[from_id] ) ), "%s.%s" % ( to_id, rng.choice( signals[to_id] ) ) ) )
+    return pairs
+
+
+def run_benchmark( syscon_filename, jobs=1, volt=True, components=False ):
+    """
+    Times each phase of a run on the system in syscon_filename. Reports are written to a
+    temporary directory and removed. The run changes to the system directory so relative
+    NETLIST filenames resolve.
+
+    With components, the connected components are labelled and the CHECKTRACE rows and
+    COMPONENT_PAIRS random pairs of nets are answered from the labels (components_joined)
+    and by the recursive trace (trace_pairs). A pair that traces but is not joined is an error.
+
+    Returns { "system": { Counts }, "phases": [ { "name", "seconds", "peak_rss_kb", "peak_child_rss_kb",
+                                                  "peak_rss_growth_kb" }, ... ] }
+
+    The operating system only keeps the peak memory of a process, so peak_rss_kb and
+    peak_child_rss_kb are the peaks of the whole run up to the end of the phase, and
+    peak_rss_growth_kb is how much the phase raised the peak of this process (0 for a phase
+    that stayed below an earlier peak). They are None without the resource module.
+    """
+    phases = []
+
+    def phase( name, function, *args ):
+        ( before_kb, dummy ) = peak_rss_kb()
+        start = time.time()
+        result = function( *args )
+        seconds = time.time() - start
+        ( self_kb, child_kb ) = peak_rss_kb()
+        growth_kb = None
+        if self_kb is not None:
+            growth_kb = self_kb - before_kb
+        phases.append( { "name": name, "seconds": round( seconds, 4 ), "peak_rss_kb": self_kb, "peak_child_rss_kb": child_kb,
+                         "peak_rss_growth_kb": growth_kb } )
+        if self_kb is None:
+            log.info( "%-20s %8.3fs", name, seconds )
+        else:
+            log.info( "%-20s %8.3fs %8d KB peak %+8d KB", name, seconds, self_kb, growth_kb )
+        return result
+
+    cwd = os.getcwd()
+    out_dir = tempfile.mkdtemp( prefix="syscon_bench" )
+    try:
+        os.chdir( os.path.dirname( os.path.abspath( syscon_filename ) ) )
+
+        netlist_files = []
+        for s in open( os.path.basename( syscon_filename ) ):
+            token = s.strip().split( "," )
+            if token[0] == "NETLIST" and len( token ) > 2:
+                netlist_files.append( token[2] )
+        phase( "load_asc_netlist", lambda: [ netlist.load_asc_netlist( filename ) for filename in netlist_files ] )
+
+        syscon = system_connections.system_connections()
+        phase( "load_syscon_csv", syscon.load_syscon_csv, os.path.basename( syscon_filename ) )
+        phase( "resolve_endpoints", syscon.resolve_endpoints )
+
+        def write_report( filename, write, *args ):
+            f = open( os.path.join( out_dir, filename ), "w" )
+            writer = report_writer.csv_report_writer( f )
+            write( writer, *args )
+            writer.close()
+            f.close()
+
+        phase( "write_check_trace", write_report, "check.csv", syscon.write_check_trace )
+        phase( "write_check_volt", write_report, "volt.csv", syscon.write_check_volt )
+        if volt:
+            phase( "write_all_volt", write_report, "Volt_check.csv", syscon.write_all_volt, jobs )
+        phase( "write_pin_signals", write_report, "map.csv", syscon.write_pin_signals )
+
+        if components:
+            phase( "label_components", syscon.label_components )
+            pairs = component_pairs( syscon, COMPONENT_PAIRS )
+            joined = phase( "components_joined", lambda: [ syscon.components_joined( from_id_signal, to_id_signal )
+                                                           for ( from_id_signal, to_id_signal ) in pairs ] )
+            # The trace would otherwise be skipped for pairs that are not joined
+            ( net_component, syscon.net_component ) = ( syscon.net_component, None )
+            traced = phase( "trace_pairs", lambda: [ syscon.check_trace( from_id_signal, to_id_signal, {} )[0]
+                                                     for ( from_id_signal, to_id_signal ) in pairs ] )
+            syscon.net_component = net_component
+            for ( ( from_id_signal, to_id_signal ), is_joined, is_traced ) in zip( pairs, joined, traced ):
+                if is_traced and not is_joined:
+                    log.error( "%s -> %s traces but is not joined", from_id_signal, to_id_signal )
+            log.info( "%d of %d pairs joined, %d traced", joined.count( True ), len( pairs ), traced.count( True ) )
+
+        counts = { "boards": len( syscon.syscon_dict["NETLIST"] ), "harnesses": len( syscon.syscon_dict["HARNESS"] ),
+                   "nets": sum( [ len( net_dict["CONNECTION"] ) for net_dict in syscon.syscon_dict["NETLIST"].values() ] ),
+                   "pins": sum( [ len( net_dict["REF.PIN"] ) for net_dict in syscon.syscon_dict["NETLIST"].values() ] ),
+                   "checktrace": len( [ row for row in syscon.syscon_dict["CHECKTRACE"] if row[0][0:6] != "$$##__" ] ),
+                   "checkvolt": len( [ row for row in syscon.syscon_dict["CHECKVOLT"] if row[0][0:6] != "$$##__" ] ) }
+    finally:
+        os.chdir( cwd )
+        for filename in os.listdir( out_dir ):
+            os.remove( os.path.join( out_dir, filename ) )
+        os.rmdir( out_dir )
+
+    return { "system": counts, "phases": phases }
+
+
+def record_result( results_filename, result ):
+    """
+    Appends result to the JSON list in results_filename and returns the previous result
+    for the same system (same "scale" or "syscon"), or None
+    """
+    results = []
+    if os.path.exists( results_filename ):
+        f = open( results_filename, "r" )
+        results = json.load( f )
+        f.close()
+
+    previous = None
+    for old_result in results:
+        if old_result.get( "scale" ) == result.get( "scale" ) and old_result.get( "syscon" ) == result.get( "syscon" ) \
+                and old_result.get( "jobs" ) == result.get( "jobs" ):
+            previous = old_result
+
+    results.append( result )
+    f = open( results_filename, "w" )
+    json.dump( results, f, indent=1, sort_keys=True )
+    f.write( "\n" )
+    f.close()
+    return previous
+
+
+def compare_results( previous, result ):
+    """
+    Returns [ ( Phase, Previous seconds, Seconds, Ratio ), ... ] for phases in both results
+    """
+    previous_seconds = dict( [ ( phase["name"], phase["seconds"] ) for phase in previous["phases"] ] )
+    comparison = []
+    for phase in result["phases"]:
+        if phase["name"] in previous_seconds:
+            ratio = phase["seconds"] / max( previous_seconds[phase["name"]], 1e-6 )
+            comparison.append( ( phase["name"], previous_seconds[phase["name"]], phase["seconds"], ratio ) )
+    return comparison
+
+
+def usage():
+    print """
+
+syscon_bench.py [-opt]
+
+    Option                      Description
+    -h          --help          Display this help
+
+    -d DIR      --dir=DIR       Generate a synthetic system in DIR (DIR/system.csv)
+    -f FILENAME --file=FILENAME Benchmark an existing system connections file instead
+    -g          --generate-only Generate the system without running the benchmark
+    -j VALUE    --jobs=VALUE    Worker processes for write_all_volt
+    -n          --no-volt       Skip the complete netlist voltage check
+    -c          --components    Also compare connected component labels with the recursive
+                                trace on CHECKTRACE rows and random pairs of nets
+    -r FILENAME --results=FILENAME
+                                Append results to JSON file FILENAME and compare with
+                                the previous run of the same system
+    -l LABEL    --label=LABEL   Label stored with the results, eg. a version
+
+    Scale of the generated system:
+                --boards=N              Boards (default 4)
+                --fpga-pins=N           FPGA pins per board (default 1700)
+                --connectors=N          Connectors per board (default 8)
+                --connector-pins=N      Pins per connector (default 200)
+                --hops=N                Harnesses between mated connectors (default 2)
+                --buffers=N             BUF245 buffers per board (default 8)
+                --ladders=N             Resistor ladders per board (default 20)
+                --seed=N                Random seed (default 1)
+"""
+
+
+def main( argv ):
+    directory = ""
+    syscon_filename = ""
+    generate_only = False
+    jobs = 1
+    volt = True
+    components = False
+    results_filename = ""
+    label = ""
+    scale = dict( DEFAULT_SCALE )
+
+    try:
+        opts, args = getopt.getopt( argv, "hd:f:gj:ncr:l:",
+                                    ["help", "dir=", "file=", "generate-only", "jobs=", "no-volt", "components", "results=", "label=",
+                                     "boards=", "fpga-pins=", "connectors=", "connector-pins=", "hops=", "buffers=",
+                                     "ladders=", "seed="] )
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ("-d", "--dir"):
+            directory = arg
+        if opt in ("-f", "--file"):
+            syscon_filename = arg
+        if opt in ("-g", "--generate-only"):
+            generate_only = True
+        if opt in ("-j", "--jobs"):
+            try:
+                jobs = int( arg )
+            except:
+                jobs = 1
+        if opt in ("-n", "--no-volt"):
+            volt = False
+        if opt in ("-c", "--components"):
+            components = True
+        if opt in ("-r", "--results"):
+            results_filename = arg
+        if opt in ("-l", "--label"):
+            label = arg
+        if opt[2:].replace( "-", "_" ) in scale:
+            try:
+                scale[opt[2:].replace( "-", "_" )] = int( arg )
+            except ValueError:
+                log.error( "%s: expected a number, got %s", opt, arg )
+                sys.exit(2)
+        elif opt in ("-h", "--help"):
+            usage()
+            sys.exit()
+
+    logging.basicConfig( level=logging.INFO, format="%(message)s" )
+    # The engine's own progress messages would swamp the timings
+    logging.getLogger( "system_connections" ).setLevel( logging.WARNING )
+    logging.getLogger( "netlist" ).setLevel( logging.WARNING )
+
+    if len( syscon_filename ) == 0:
+        if len( directory ) == 0:
+            usage()
+            sys.exit(2)
+        syscon_filename = generate_system( directory, scale )
+        log.info( "Generated %s", syscon_filename )
+        if generate_only:
+            return
+        result_key = { "scale": scale }
+    else:
+        result_key = { "syscon": os.path.abspath( syscon_filename ) }
+
+    result = run_benchmark( syscon_filename, jobs, volt, components )
+    result.update( result_key )
+    result.update( { "label": label, "jobs": jobs, "python": sys.version.split()[0],
+                     "timestamp": time.strftime( "%Y-%m-%dT%H:%M:%S" ) } )
+    log.info( "System: %s", ", ".join( [ "%s=%d" % ( key, result["system"][key] ) for key in sorted( result["system"] ) ] ) )
+
+    if len( results_filename ) > 0:
+        previous = record_result( results_filename, result )
+        if previous is not None:
+            log.info( "Compared with %s %s:", previous.get( "label", "" ), previous.get( "timestamp", "" ) )
+            for ( name, previous_seconds, seconds, ratio ) in compare_results( previous, result ):
+                if ratio > REGRESSION_RATIO and seconds - previous_seconds > REGRESSION_MIN_SECONDS:
+                    log.warning( "%-20s %8.3fs -> %8.3fs (x%.2f) REGRESSION", name, previous_seconds, seconds, ratio )
+                else:
+                    log.info( "%-20s %8.3fs -> %8.3fs (x%.2f)", name, previous_seconds, seconds, ratio )
+    else:
+        json.dump( result, sys.stdout, indent=1, sort_keys=True )
+        sys.stdout.write( "\n" )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
+
+
+# vi:set shiftwidth=4 tabstop=4:
+# vim:set expandtab list lcs=tab\:>>:
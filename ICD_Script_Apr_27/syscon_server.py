@@ -0,0 +1,247 @@
+"""
+SYSCON_SERVER.py - Query server holding a loaded system in memory
+
+The system file is loaded once and queries are answered from the loaded model. Requests
+and responses are one JSON object per line, read from standard input or from clients of
+a Unix socket:
+    { "query": "trace", "from": ID.Signal or ID.Ref.Pin, "to": ..., "volt": Volt (optional) }
+    { "query": "pull", "signal": ID.Signal or ID.Ref.Pin, "volt": Volt (optional) }
+                        Both return the check object written by --json, see report_writer.check_object
+    { "query": "pins", "ref": ID.Ref }
+                        Returns { "type": Type, "pins": [ [ Pin, Signal ], ... ] }
+    { "query": "net", "signal": ID.Signal or ID.Ref.Pin }
+                        Returns { "signal": ID.Signal, "pins": [ Ref.Pin, ... ], "rail": Volt or null }
+    { "query": "reload" }   Reloads the system even if no file changed
+    { "query": "status" }   Returns the loaded files and load counts
+
+Responses are { "ok": true, "result": ..., "seconds": Query time, "reloaded": [ Filename, ... ] }
+or { "ok": false, "error": Message }.
+
+Before each query the system file, its IMPORTs and its netlists are checked for changes.
+If any changed the system is reloaded; netlists are kept in a netlist.netlist_cache so only
+the netlist files that changed are parsed again.
+"""
+
+import sys
+import getopt
+import json
+import logging
+import os
+import signal
+import SocketServer
+import time
+
+import netlist
+import report_writer
+import system_connections
+
+log = logging.getLogger( "syscon_server" )
+
+
+class syscon_server():
+    def __init__( self, filename ):
+        self.filename = filename
+        self.netlists = netlist.netlist_cache()
+        self.syscon = None
+        # IGNORE SIGNAL list of the loaded system, pull queries add to the list of the model
+        self.ignored_signals = []
+        self.stamps = {}
+        self.loads = 0
+        self.reload()
+
+    def reload( self ):
+        start = time.time()
+        # Files are stamped before they are read (system_connections.stamps), so a file saved
+        # during the load is loaded again by the next query
+        stamp = netlist.file_stamp( self.filename )
+        syscon = system_connections.load_system( self.filename, self.netlists )
+        self.netlists.discard( [ self.filename ] + syscon.source_files() )
+        self.stamps = dict( syscon.stamps )
+        self.stamps[self.filename] = stamp
+        self.syscon = syscon
+        self.ignored_signals = list( syscon.syscon_dict["IGNORE"]["SIGNAL"] )
+        self.loads += 1
+        log.info( "Loaded %s in %.3fs, %d netlists parsed so far", self.filename, time.time() - start, self.netlists.parsed )
+
+    def changed_files( self ):
+        return [ filename for filename in sorted( self.stamps ) if netlist.file_stamp( filename ) != self.stamps[filename] ]
+
+    def check_reload( self ):
+        """
+        Reloads the system if any of its files changed, returns the changed files
+        """
+        changed = self.changed_files()
+        if len( changed ) > 0:
+            log.info( "Changed: %s", ", ".join( changed ) )
+            self.reload()
+        return changed
+
+    def check_dict( self, request ):
+        check_dict = {}
+        if request.get( "volt" ) is not None:
+            check_dict["VOLT"] = float( request["volt"] )
+        return check_dict
+
+    def query_trace( self, request ):
+        record = self.syscon.trace_record( request["from"], request["to"], self.check_dict( request ) )
+        return report_writer.check_object( record )
+
+    def query_pull( self, request ):
+        record = self.syscon.pull_record( request["signal"], self.check_dict( request ) )
+        return report_writer.check_object( record )
+
+    def query_pins( self, request ):
+        pins = self.syscon.ref_pins( request["ref"] )
+        if pins is None:
+            raise ValueError( "%s is not in the netlists" % request["ref"] )
+        ( ref_type, pin_signals ) = pins
+        return { "type": ref_type, "pins": pin_signals }
+
+    def query_net( self, request ):
+        id_signal = self.syscon.endpoint( request["signal"] )["ID_SIGNAL"]
+        pins = self.syscon.net_pins( id_signal )
+        if pins is None:
+            raise ValueError( "%s is not in the netlists" % request["signal"] )
+        ( ref_pins, rail ) = pins
+        return { "signal": id_signal, "pins": ref_pins, "rail": rail }
+
+    def query_reload( self, request ):
+        self.reload()
+        return { "loads": self.loads }
+
+    def query_status( self, request ):
+        return { "file": self.filename, "files": sorted( self.stamps ), "loads": self.loads,
+                 "netlists_parsed": self.netlists.parsed }
+
+    def query( self, request ):
+        """
+        Answers one request object, returns the response object
+        """
+        start = time.time()
+        try:
+            if not isinstance( request, dict ) or request.get( "query" ) not in QUERIES:
+                raise ValueError( "query must be one of %s" % ", ".join( sorted( QUERIES ) ) )
+            reloaded = self.check_reload()
+            # Each query starts from the IGNORE list of the system file, not one grown by earlier queries
+            self.syscon.syscon_dict["IGNORE"]["SIGNAL"] = list( self.ignored_signals )
+            result = QUERIES[request["query"]]( self, request )
+        except KeyError, e:
+            return { "ok": False, "error": "missing request field %s" % e }
+        except Exception, e:
+            log.debug( "Query %s failed", request, exc_info=True )
+            return { "ok": False, "error": str( e ) }
+        return { "ok": True, "result": result, "seconds": time.time() - start, "reloaded": reloaded }
+
+    def query_line( self, line ):
+        """
+        Answers one request line, returns the response line
+        """
+        try:
+            request = json.loads( line )
+        except ValueError, e:
+            response = { "ok": False, "error": "bad request: %s" % e }
+        else:
+            response = self.query( request )
+        return json.dumps( response, sort_keys=True ) + "\n"
+
+    def serve_stream( self, f_in, f_out ):
+        """
+        Answers request lines from f_in until end of file
+        """
+        for line in iter( f_in.readline, "" ):
+            if len( line.strip() ) > 0:
+                f_out.write( self.query_line( line ) )
+                f_out.flush()
+
+
+QUERIES = { "trace": syscon_server.query_trace, "pull": syscon_server.query_pull, "pins": syscon_server.query_pins,
+            "net": syscon_server.query_net, "reload": syscon_server.query_reload, "status": syscon_server.query_status }
+
+
+class socket_handler( SocketServer.StreamRequestHandler ):
+    def handle( self ):
+        self.server.syscon_server.serve_stream( self.rfile, self.wfile )
+
+
+class socket_server( SocketServer.UnixStreamServer ):
+    """
+    Clients are answered one at a time, queries never run concurrently on the model
+    """
+    def __init__( self, socket_filename, server ):
+        self.syscon_server = server
+        SocketServer.UnixStreamServer.__init__( self, socket_filename, socket_handler )
+
+
+def usage():
+    print """
+
+syscon_server.py [-opt]
+
+    Option                      Description
+    -h          --help          Display this help
+
+    -f FILENAME --file=FILENAME System connections file to load
+    -s FILENAME --socket=FILENAME
+                                Answer queries on Unix socket FILENAME
+                                Without -s, queries are read from standard input
+                --log-level=LEVEL
+                                Console message level: DEBUG, INFO, WARNING (default), ERROR
+"""
+
+
+def main( argv ):
+    filename = ""
+    socket_filename = ""
+    log_level = "WARNING"
+
+    try:
+        opts, args = getopt.getopt( argv, "hf:s:", ["help", "file=", "socket=", "log-level="] )
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ("-f", "--file"):
+            filename = arg
+        if opt in ("-s", "--socket"):
+            socket_filename = arg
+        if opt in ("--log-level",):
+            log_level = arg
+        elif opt in ("-h", "--help"):
+            usage()
+            sys.exit()
+
+    if len( filename ) == 0:
+        usage()
+        sys.exit(2)
+
+    # Messages go to standard error, standard output may carry responses
+    system_connections.setup_logging( log_level )
+
+    server = syscon_server( filename )
+
+    if len( socket_filename ) == 0:
+        server.serve_stream( sys.stdin, sys.stdout )
+        return
+
+    if os.path.exists( socket_filename ):
+        os.remove( socket_filename )
+    listener = socket_server( socket_filename, server )
+    log.info( "Listening on %s", socket_filename )
+    # Terminating the server removes the socket as an interrupt does
+    signal.signal( signal.SIGTERM, lambda signum, frame: sys.exit() )
+    try:
+        listener.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.server_close()
+        os.remove( socket_filename )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
+
+
+# vi:set shiftwidth=4 tabstop=4:
+# vim:set expandtab list lcs=tab\:>>:
@@ -5,7 +5,6 @@ TO DO
 
 Add pin fanout through harness capability
 
-Add check that all refvolt signals are at correct voltage (to verify internal connections)
 Add refsig and pin definition file generation
 
 Revamp REFVOLT and DEVICEPULL data order to allow specification of multiple pins
@@ -13,21 +12,132 @@ Add DEVICEVOLT?
 Revamp DEVICELINK to allow
 
 Differentiate between harness types and harness instantiations? (eg. SAS)?
-
-Add termination detection
-
-Add comparison to previous analysis to detect changes
 """
 
 import sys
 import getopt
 import copy
+import itertools
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
 
 import netlist
+import netlist_store
+import report_writer
+import run_profile
+
+log = logging.getLogger( "system_connections" )
+
+# write_all_volt output sections, in the order they appear in the output file
+VOLT_CATEGORIES = [ ( "CONFLICT", "CONFLICT SIGNALS" ), ( "NA", "NO VOLTAGE SIGNALS" ), ( "NON-CONFLICT", "NON-CONFLICTING SIGNALS" ) ]
+# Smallest resistance used by solve_nodal_voltages, so 0R links do not divide by zero
+MIN_RESISTANCE = 1e-3
+# Number of nets handed to a worker process at a time by write_all_volt
+VOLT_SHARD_SIZE = 500
+# Largest difference between a pin's pulls and its REFVOLT / DEVICEVOLT that check_ref_volts accepts
+REF_VOLT_TOLERANCE = 0.01
+
+# multiprocessing forks worker processes everywhere but Windows, where they start afresh
+# without the module globals below that hand them the system model
+FORKED_WORKERS = sys.platform != "win32"
+
+def worker_jobs( jobs ):
+    """
+    Returns the number of worker processes to use for jobs, 1 where workers are not forked
+    """
+    if jobs > 1 and not FORKED_WORKERS:
+        log.warning( "Worker processes need fork, checking in one process" )
+        return 1
+    return jobs
+
+# System model used by write_all_volt worker processes. Set before the pool is forked
+# so workers inherit it instead of receiving a pickled copy
+_volt_worker_syscon = None
+
+def _volt_worker( shard ):
+    return _volt_worker_syscon.check_volt_shard( shard )
+
+# write_signal_relations worker processes are handed the REFSIG rows of their job and, to
+# check REFSIG pins, the name of a system_graph file they attach to. They need no copy of
+# the system model, so they are used where workers are not forked too
+def _relation_worker( args ):
+    ( job, relations, graph_filename ) = args
+    has_pin = None
+    if graph_filename is not None:
+        import system_graph
+        graph = system_graph.attach( graph_filename )
+        id = job[0].split( '.' )[0]
+        def has_pin( ref_pin ):
+            pin = graph.pin_index( "%s.%s" % ( id, ref_pin ) )
+            return pin is not None and graph.pin_net( pin ) != system_graph.NO_INDEX
+    return write_relation_file( job, relations, has_pin )
+
+def write_relation_file( job, relations, has_pin=None ):
+    """
+    Writes the constraint file for one job from signal_relation_jobs, relations being the
+    REFSIG rows of its device, in a single write. If has_pin is given, REFSIG pins for which
+    has_pin( REF.PIN ) is False are returned as missing.
+
+    Returns ( Filename, Rows written, [ Missing pin, ... ], Error or None )
+    """
+    ( id_ref, device_type, out_filename ) = job
+    ref = id_ref.split( '.' )[1]
+    relation_format = SIGNAL_RELATION_FORMAT.get( device_type, DEFAULT_SIGNAL_RELATION_FORMAT )
+    missing = []
+    entries = []
+    for ( pin, int_signal, ext_signal, io_standard ) in relations:
+        if has_pin is not None and not has_pin( "%s.%s" % ( ref, pin ) ):
+            missing.append( pin )
+        entries.append( relation_format % { "pin": pin, "ext": ext_signal, "io": io_standard } )
+        entries.append( "\n\n" )
+
+    try:
+        f = open( out_filename, "w" )
+        try:
+            f.write( "".join( entries ) )
+        finally:
+            f.close()
+    except Exception, e:
+        return ( out_filename, 0, missing, str( e ) )
+    return ( out_filename, len( entries ) / 2, missing, None )
+
+# Constraint file entry for each DEVICETYPE, anything else gets a plain description
+SIGNAL_RELATION_FORMAT = {
+    # NET "dad_addr[0]" IOSTANDARD = LVCMOS25;
+    # NET "dad_addr[0]" LOC = AA34;
+    "XILINX_FPGA": 'NET "%(ext)s" IOSTANDARD = %(io)s;\nNET "%(ext)s" LOC = %(pin)s;',
+    # set_location_assignment PIN_AA1 -to FBB_CPU2FD_D[3]
+    # set_instance_assignment -name IO_STANDARD "3.0-V LVTTL" -to FBB_CPU2FD_D[3]
+    "ALTERA_FPGA": 'set_location_assignment PIN_%(pin)s -to %(ext)s\nset_instance_assignment -name IO_STANDARD "%(io)s" -to %(ext)s',
+    # LOCATE COMP "STEALTH_MODE" SITE "F11" ;
+    # IOBUF PORT "STEALTH_MODE" IO_TYPE=LVCMOS33 ;
+    "LATTICE_CPLD": 'LOCATE COMP "%(ext)s" SITE "%(pin)s" ;\nIOBUF PORT "%(ext)s" IO_TYPE=%(io)s ;',
+    }
+DEFAULT_SIGNAL_RELATION_FORMAT = "Location: %(pin)s, Signal: %(ext)s, IO_Standard: %(io)s"
+
 
 class system_connections():
     def __init__( self ):
         self.syscon_dict = {}
+        # run_profile.run_profile collecting counters and timings, None when not profiling
+        self.profile = None
+        # netlist.netlist_cache (or netlist_store.netlist_store) shared between loads of a system, None to parse every netlist
+        self.netlist_cache = None
+        # check_cache of records kept between loads of a system (--watch), None to check every row
+        self.check_cache = None
+        # Set of board and harness IDs visited by the check being evaluated, None when not recording
+        self.visited = None
+        # system_graph.system_graph of the loaded system, the part of the system each of its nets
+        # and pins is joined to and { ID.Signal: Part } (label_components), None when not labelled
+        self.graph = None
+        self.component_labels = None
+        self.net_component = None
+        # { Filename: netlist.file_stamp } of the system, IMPORT and netlist files, stamped
+        # before each was read so --watch sees changes made while the system is checked
+        self.stamps = {}
 
     def load_syscon_csv( self, filename ):
         """
@@ -71,7 +181,7 @@ class system_connections():
                             to output file
             RAIL            Indicates that a certain signal name is a rail
             IGNORE          Specifies Signal Name or Device to ignore. When used on signal name, it outputs a TRUE for
-                            the IGNORE FLAG (see gen_check_line). When specified on device, it does not go through the device
+                            the IGNORE FLAG (see gen_check_record). When specified on device, it does not go through the device
                             or check it for voltage pulls.
             REFSIG          Associate an internal schematic signal on a device refdes to the external name used elsewhere. Can specify
                             a voltage standard on that signal.
@@ -81,6 +191,7 @@ class system_connections():
         Returns dictionary as follows:
             ["COMMNETS"] = { $$##__COMMENTn: String, ... }
             ["NETLIST_FILE"] = { ID: Filename, ID: Filename, ... }
+            ["NETLIST_SEQ"] = [ ID, ... ] in the order of the NETLIST lines
             ["NETLIST"] = {ID:{...}, ... }
             ["CHECKTRACE"] = [ ( ID.Signal or ID.Ref.Pin, ID.Signal or ID.Ref.Pin, { "GROUP": Group, "VOLT": Volt } ) or ( $$##__COMMENTn, $$##__COMMENTn ), ... ]
             ["HARNESS"] = { ID: { Ref.Pin: Ref.Pin, ... }, ID: { }, ... }
@@ -93,11 +204,16 @@ class system_connections():
             ["DEVICE"] = { Type: { Ref.Pin: Ref.Pin, ... } }
             ["DEVICEPULL"] = { Type: { Ref.Pin: Ref.Pin, ... } }
             ["DEVICEVOLT"] = { Type: { Ref.Pin: Volt, ... } }
-            ["DEVICEPIN"] = { Type: { "Rows": n, "Cols": m, "Map": { Row-Col: Pin, ... }, "Category": { Name: [Pin,...], ... } }
+            ["DEVICEPIN"] = { Type: { "Rows": n, "Cols": m, "Map": { Row-Col: Pin, ... }, "Category": { Name: [Pin,...], ... },
+                                "Grid": [ [ Pin, ... ], ... ] (built by device_pin_grid) }
             ["REFVOLT"] = { ID.Ref.Pin: Volt, ... }
             ["IGNORE"] = { "SIGNAL":[ID.Signal,...], "DEVICE": [Device,...] }
             ["REFSIG"] = { ID.Ref: [ (Pin, Internal Signal, External Signal, IO Standard), ... ], ...  }
             ["DEVICEPARAM"] = { Type: { PARAM: Param Value, ... } }
+            ["NODALVOLT"] = { ID.Signal: Volt, ... } (filled in by solve_nodal_voltages)
+            ["TERMINATION"] = { ID.Signal: [ Termination, ... ], ... } (filled in by detect_terminations)
+            ["ENDPOINT"] = { Endpoint: { "TYPE": Type, "ID_SIGNAL": ID.Signal, "ID_REF_PIN": ID.Ref.Pin, "VALID": Flag }, ... }
+                            (filled in by resolve_endpoints, see resolve_endpoint)
 
 
         NETLIST:
@@ -110,24 +226,25 @@ class system_connections():
         """
 
         for subdict in [ "COMMENTS", "NETLIST_FILE", "NETLIST", "HARNESS", "CONNECTION", "CONNECTION_REFS", "MAP", "DEVICEMAP", "DEVICE", "DEVICEPIN", \
-                        "DEVICEPULL", "DEVICEVOLT", "REFVOLT", "IGNORE", "REFSIG", "DEVICEPARAM" ]:
+                        "DEVICEPULL", "DEVICEVOLT", "REFVOLT", "IGNORE", "REFSIG", "DEVICEPARAM", "NODALVOLT", "TERMINATION", "ENDPOINT" ]:
             if subdict not in self.syscon_dict:
                 self.syscon_dict[subdict] = {}
 
-        for sublist in [ "CHECKTRACE", "CHECKVOLT", "HARNESS_SEQ", "MAP_SEQ", "IMPORT" ]:
+        for sublist in [ "CHECKTRACE", "CHECKVOLT", "NETLIST_SEQ", "HARNESS_SEQ", "MAP_SEQ", "IMPORT" ]:
             if sublist not in self.syscon_dict:
                 self.syscon_dict[sublist] = []
 
         self.syscon_dict["IGNORE"]["SIGNAL"] = []
         self.syscon_dict["IGNORE"]["DEVICE"] = []
 
-        print "Loading system connection data from %s" % filename
+        log.info( "Loading system connection data from %s", filename )
 
         comment_number = 0
         comment_id = ""
         comment_string = ""
         comment_flag = False
         done = False
+        self.stamps[filename] = netlist.file_stamp( filename )
         try:
             f = open( filename, "r" )
             s = f.readline()
@@ -167,7 +284,7 @@ class system_connections():
                         import_filename = ss_token[1]
                         if import_filename not in self.syscon_dict["IMPORT"]:
                             ##print self.syscon_dict
-                            print "Importing %s" % import_filename
+                            log.info( "Importing %s", import_filename )
                             self.load_syscon_csv( import_filename )
                             self.syscon_dict["IMPORT"].append(import_filename)
                             ##print self.syscon_dict
@@ -176,7 +293,16 @@ class system_connections():
                         # NETLIST, ID, FILENAME
                         id = ss_token[1]
                         self.syscon_dict["NETLIST_FILE"][id] = ss_token[2]
-                        ( net ) = netlist.load_asc_netlist( ss_token[2] )
+                        if id not in self.syscon_dict["NETLIST_SEQ"]:
+                            self.syscon_dict["NETLIST_SEQ"].append( id )
+                        self.stamps[ss_token[2]] = netlist.file_stamp( ss_token[2] )
+                        start = time.time()
+                        if self.netlist_cache is not None:
+                            ( net ) = self.netlist_cache.load( ss_token[2] )
+                        else:
+                            ( net ) = netlist.load_asc_netlist( ss_token[2] )
+                        if self.profile is not None:
+                            self.profile.add_phase( "load_asc_netlist", time.time() - start )
                         self.syscon_dict["NETLIST"][id] = net
 
                     elif ss_token[0] == "RAIL" and len( ss_token ) > 3:
@@ -204,7 +330,7 @@ class system_connections():
                         from_id_signal = "%s.%s" % ( ss_token[1], ss_token[2] )
                         to_id_signal = "%s.%s" % ( ss_token[3], ss_token[4] )
                         from_to_id_signal = "%s.%s" % ( from_id_signal, to_id_signal )
-                        print "Decoding CHECKTRACE %s -> %s" % ( from_id_signal, to_id_signal )
+                        log.debug( "Decoding CHECKTRACE %s -> %s", from_id_signal, to_id_signal )
                         # If there were comments prior to this desired link, note them in the sequence list
                         if comment_flag:
                             self.syscon_dict["CHECKTRACE"].append( ( comment_id, comment_id, {} ) )
@@ -244,7 +370,7 @@ class system_connections():
                             except:
                                 pass
 
-                        print "Decoding CHECKVOLT %s %s" % ( id_signal, check_dict )
+                        log.debug( "Decoding CHECKVOLT %s %s", id_signal, check_dict )
                         self.syscon_dict["CHECKVOLT"].append( ( id_signal, check_dict ) )
 
                     elif ss_token[0] == "HARNESSLINK" and len( ss_token ) > 5:
@@ -389,7 +515,7 @@ class system_connections():
                                 # If pin voltages specified, note them
                                 self.syscon_dict["DEVICEVOLT"][ss_token[1]][ss_pin] = device_volt
                         except:
-                            print "DEVICEVOLT: Unable to convert %s into voltage (%s)" % ( ss_token[2], ss )
+                            log.warning( "DEVICEVOLT: Unable to convert %s into voltage (%s)", ss_token[2], ss )
                             pass
 
                     elif ss_token[0] == "DEVICEPIN" and len( ss_token ) > 5:
@@ -492,26 +618,63 @@ class system_connections():
                                     # If device didn't exist, create it
                                     self.syscon_dict["REFVOLT"][id_ref_pin] = ref_volt
                                 else:
-                                    print "REFVOLT: Duplicate voltage specified."
+                                    log.warning( "REFVOLT: Duplicate voltage specified for %s", id_ref_pin )
                         except:
-                            print "REFVOLT: Cannot convert %s into voltage (%s)" % ( ss_token[3], ss )
+                            log.warning( "REFVOLT: Cannot convert %s into voltage (%s)", ss_token[3], ss )
                             pass
 
                     else:
                         if not ss_processed:
-                            print "Unable to process: %s" % ss
+                            log.warning( "Unable to process: %s", ss )
 
                 s = f.readline()
 
             f.close()
 
         except Exception, e:
-            print e
+            log.error( "%s: %s", filename, e )
             pass
 
         return ( self.syscon_dict )
 
 
+    def source_files( self ):
+        """
+        Returns the IMPORT and NETLIST files the system was loaded from
+        """
+        return self.syscon_dict["IMPORT"] + self.syscon_dict["NETLIST_FILE"].values()
+
+
+    def ref_pins( self, id_ref ):
+        """
+        Returns ( Type, [ ( Pin, Signal ), ... ] ) of a part in netlist pin order,
+        Signal is "" for unconnected pins. Returns None if the part is not in the netlists.
+        """
+        id_ref_token = id_ref.split( '.' )
+        if len( id_ref_token ) != 2:
+            return None
+        ( id, ref ) = id_ref_token
+        if id not in self.syscon_dict["NETLIST"] or ref not in self.syscon_dict["NETLIST"][id]["PART"]:
+            return None
+        net = self.syscon_dict["NETLIST"][id]
+        pin_net = net["PIN.NET"].get( ref, {} )
+        return ( net["PART"][ref], [ ( pin, pin_net.get( pin, "" ) ) for pin in net["PINS"].get( ref, [] ) ] )
+
+
+    def net_pins( self, id_signal ):
+        """
+        Returns ( [ Ref.Pin, ... ], Rail voltage or None ) of a net, None if the net is not in the netlists
+        """
+        id_signal_token = id_signal.split( '.' )
+        if len( id_signal_token ) != 2:
+            return None
+        ( id, signal ) = id_signal_token
+        if id not in self.syscon_dict["NETLIST"] or signal not in self.syscon_dict["NETLIST"][id]["CONNECTION"]:
+            return None
+        net = self.syscon_dict["NETLIST"][id]
+        return ( net["CONNECTION"][signal], net["RAIL"].get( signal ) )
+
+
     def id_ref_pin_to_signal( self, id_ref_pin ):
         id_signal = ""
         token = id_ref_pin.split( '.' )
@@ -545,22 +708,102 @@ class system_connections():
         return id_ref_pin
 
 
-    def param_to_signal( self, param ):
-        signal = ""
-        param_type = "UNKNOWN"
+    def resolve_endpoint( self, param, param_type=None ):
+        """
+        Returns the resolved form of an endpoint:
+            { "TYPE": "ID_SIGNAL", "ID_REF_PIN", "ID_REF" or "UNKNOWN",
+              "ID_SIGNAL": Net the endpoint is on, ID.Signal is returned as is ("" if not found),
+              "ID_REF_PIN": ID.Ref.Pin as is, else the first pin of the net or ref ("" if none),
+              "VALID": True if the endpoint is in its netlist }
+
+        ID.Signal and ID.Ref have the same form, param_type "ID_REF" is given for MAP entries.
+        """
         param_token = param.split( '.' )
-        if len( param_token ) == 2:
+        resolved = { "TYPE": "UNKNOWN", "ID_SIGNAL": "", "ID_REF_PIN": "", "VALID": False }
+        if len( param_token ) == 2 and param_type == "ID_REF":
+            ( id, ref ) = param_token
+            resolved["TYPE"] = "ID_REF"
+            if id in self.syscon_dict["NETLIST"] and ref in self.syscon_dict["NETLIST"][id]["PART"]:
+                resolved["VALID"] = True
+                if ref in self.syscon_dict["NETLIST"][id]["PINS"]:
+                    resolved["ID_REF_PIN"] = "%s.%s.%s" % ( id, ref, self.syscon_dict["NETLIST"][id]["PINS"][ref][0] )
+        elif len( param_token ) == 2:
             # One period means form is id.signal
-            signal = param
-            param_type = "ID_SIGNAL"
+            resolved["TYPE"] = "ID_SIGNAL"
+            resolved["ID_SIGNAL"] = param
+            resolved["ID_REF_PIN"] = self.id_signal_to_id_ref_pin( param )
+            resolved["VALID"] = len( resolved["ID_REF_PIN"] ) > 0
         elif len( param_token ) == 3:
             # Two periods means form is id.ref.pin
-            signal = self.id_ref_pin_to_signal( param )
-            print "Translating %s to %s" % ( param, signal )
-            id_ref_pin = param
-            param_type = "ID_REF_PIN"
+            resolved["TYPE"] = "ID_REF_PIN"
+            resolved["ID_SIGNAL"] = self.id_ref_pin_to_signal( param )
+            resolved["ID_REF_PIN"] = param
+            resolved["VALID"] = len( resolved["ID_SIGNAL"] ) > 0
 
-        return ( param_type, signal )
+        log.debug( "Resolved %s to %s", param, resolved )
+        return resolved
+
+
+    def resolve_endpoints( self ):
+        """
+        Resolves every endpoint referenced by CHECKTRACE, CHECKVOLT, MAP and REFSIG into
+        ["ENDPOINT"] so that checks never parse them again. Endpoints that are not in their
+        netlist are reported.
+
+        Returns [ ( Section, Endpoint ), ... ] for the invalid endpoints
+        """
+        endpoints = []
+        for ( from_signal, to_signal, check_dict ) in self.syscon_dict["CHECKTRACE"]:
+            if from_signal[0:6] != "$$##__":
+                endpoints.append( ( "CHECKTRACE", from_signal, None ) )
+                endpoints.append( ( "CHECKTRACE", to_signal, None ) )
+        for ( signal, check_dict ) in self.syscon_dict["CHECKVOLT"]:
+            if signal[0:6] != "$$##__":
+                endpoints.append( ( "CHECKVOLT", signal, None ) )
+        for id_ref in self.syscon_dict["MAP_SEQ"]:
+            if id_ref[0:6] != "$$##__":
+                endpoints.append( ( "MAP", id_ref, "ID_REF" ) )
+        for id_ref in self.syscon_dict["REFSIG"]:
+            for signal_relation in self.syscon_dict["REFSIG"][id_ref]:
+                endpoints.append( ( "REFSIG", "%s.%s" % ( id_ref, signal_relation[0] ), None ) )
+
+        invalid = []
+        done = set()
+        for ( section, endpoint, param_type ) in endpoints:
+            if ( endpoint, param_type ) in done:
+                continue
+            done.add( ( endpoint, param_type ) )
+            resolved = self.resolve_endpoint( endpoint, param_type )
+            # An ID.Signal used by a check takes the table entry over a MAP ID.Ref of the same name
+            if endpoint not in self.syscon_dict["ENDPOINT"] or param_type is None:
+                self.syscon_dict["ENDPOINT"][endpoint] = resolved
+            if not resolved["VALID"]:
+                log.warning( "%s endpoint %s is not in the netlist", section, endpoint )
+                invalid.append( ( section, endpoint ) )
+
+        return invalid
+
+
+    def endpoint( self, param ):
+        """
+        Returns the resolved endpoint for param, from ["ENDPOINT"] if it was resolved before.
+        Endpoints that were not resolved up front (ALLVOLT nets, queries) are added to ["ENDPOINT"]
+        """
+        resolved = self.syscon_dict["ENDPOINT"].get( param )
+        if resolved is None or resolved["TYPE"] == "ID_REF":
+            resolved = self.resolve_endpoint( param )
+            # As in resolve_endpoints, a check's ID.Signal takes the entry over a MAP ID.Ref
+            self.syscon_dict["ENDPOINT"][param] = resolved
+            if self.profile is not None:
+                self.profile.count( "endpoint cache misses" )
+        elif self.profile is not None:
+            self.profile.count( "endpoint cache hits" )
+        return resolved
+
+
+    def param_to_signal( self, param ):
+        resolved = self.endpoint( param )
+        return ( resolved["TYPE"], resolved["ID_SIGNAL"] )
 
 
     def check_trace( self, trace_from, trace_to, info_dict={} ):
@@ -594,7 +837,13 @@ class system_connections():
         ( from_type, from_id_signal ) = self.param_to_signal( trace_from )
         ( to_type, to_id_signal ) = self.param_to_signal( trace_to )
 
-        ( trace_flag, info_dict ) = self.trace_netlist_signal( from_id_signal, to_id_signal, info_dict )
+        if not self.components_joined( from_id_signal, to_id_signal ):
+            # No path can join nets in different parts of the system
+            trace_flag = False
+            if self.profile is not None:
+                self.profile.count( "trace component rejects" )
+        else:
+            ( trace_flag, info_dict ) = self.trace_netlist_signal( from_id_signal, to_id_signal, info_dict )
 
         if trace_flag:
             # If path has no nodes, add a node if id.ref.pin was specified
@@ -609,6 +858,36 @@ class system_connections():
         return ( trace_flag, info_dict )
 
 
+    def label_components( self ):
+        """
+        Compiles the loaded system into a system_graph and labels its nets and pins with the
+        part of the system they are joined to, see system_graph.connected_components
+        """
+        import system_graph
+
+        self.graph = system_graph.system_graph( None, system_graph.compile_graph( self ) )
+        ( count, net_labels, pin_labels ) = system_graph.connected_components( self.graph )
+        self.component_labels = ( net_labels, pin_labels )
+        self.net_component = dict( ( self.graph.net_name( net ), int( net_labels[net] ) ) for net in xrange( self.graph.num_nets ) )
+        log.info( "%d nets and %d pins in %d connected parts", self.graph.num_nets, self.graph.num_pins, count )
+
+
+    def components_joined( self, from_id_signal, to_id_signal ):
+        """
+        Returns False if the two signals are in different parts of the system, True if they
+        are in the same part or it is not known (no labels, or a signal not in the netlists)
+
+        Not used while visited IDs are recorded, a rejected trace visits no boards
+        """
+        if self.net_component is None or self.visited is not None or from_id_signal == to_id_signal:
+            return True
+        from_component = self.net_component.get( from_id_signal )
+        to_component = self.net_component.get( to_id_signal )
+        if from_component is None or to_component is None:
+            return True
+        return from_component == to_component
+
+
     def check_pull( self, pull_from, info_dict={} ):
         """
         check_pull( from_desired, to_desired, path )
@@ -622,9 +901,10 @@ class system_connections():
             ["PULL"] = [ "ID.Type to Signal", ... ]
             ["PULL_ID_SIGNAL"] = [ "Signal", ... ]
             ["VOLT"] = [ Voltage, ... ]
+            ["GND_PULLS"] = True to count resistors to 0 V rails, which are left out by default
         """
 
-        print "check_pull( %s, %s )" % ( pull_from, info_dict )
+        log.debug( "check_pull( %s, %s )", pull_from, info_dict )
 
         if "PATH" not in info_dict:
             info_dict["PATH"] = []
@@ -635,18 +915,16 @@ class system_connections():
         if "VOLT" not in info_dict:
             info_dict["VOLT"] = []
 
-        ( from_type, from_id_signal ) = self.param_to_signal( pull_from )
+        resolved = self.endpoint( pull_from )
 
         # Add a node if id.ref.pin was specified
         if len( info_dict["PATH"] ) == 0:
-            print "Decoding pull_from %s into %s (%s)" % ( pull_from, from_id_signal, from_type )
-            if from_type == "ID_REF_PIN":
-                info_dict["PATH"].append( from_id_signal )
-            elif from_type == "ID_SIGNAL":
-                id_ref_pin = self.id_signal_to_id_ref_pin( pull_from )
-                print "Decoding ID_SIGNAL into %s" % id_ref_pin
-                if len( id_ref_pin ) > 0:
-                    info_dict["PATH"].append( id_ref_pin )
+            log.debug( "Decoding pull_from %s into %s", pull_from, resolved )
+            if resolved["TYPE"] == "ID_REF_PIN":
+                info_dict["PATH"].append( resolved["ID_SIGNAL"] )
+            elif resolved["TYPE"] == "ID_SIGNAL":
+                if len( resolved["ID_REF_PIN"] ) > 0:
+                    info_dict["PATH"].append( resolved["ID_REF_PIN"] )
 
         ( info_dict ) = self.add_pulls( info_dict )
 
@@ -660,9 +938,8 @@ class system_connections():
         Add pull-up / pull-down information for path
         """
 
-        print "\nadd_pulls( %s )" % info_dict
+        log.debug( "add_pulls( %s )", info_dict )
         ##print info_dict
-        print "\n",
 
         path = info_dict["PATH"]
 
@@ -692,12 +969,16 @@ class system_connections():
         Follow straight-through devices if needed
         """
 
-        print "\npull_netlist_signal( %s, %s, %s, %s )" % ( id, signal, info_dict, pull_path )
+        log.debug( "pull_netlist_signal( %s, %s, %s, %s )", id, signal, info_dict, pull_path )
+        if self.profile is not None:
+            self.profile.count( "pull_netlist_signal calls" )
         ##print info_dict
         ##print pull_path
         ignore = False
         id_signal = "%s.%s" % (id, signal)
         rail = signal in self.syscon_dict["NETLIST"][id]["RAIL"]
+        if self.visited is not None:
+            self.visited.add( id )
 
         # if a signal is ignored, all the signals that trace to this ignored signal should also be added to ignored list.
         # This is not done during tracing because the tracing algorithm does not traverse all paths available to it. It only traverses
@@ -709,7 +990,7 @@ class system_connections():
                     self.syscon_dict["IGNORE"]["SIGNAL"].append(temp_id_signal)
         elif signal[0:2] != "NC" and id_signal not in info_dict["PULL_ID_SIGNAL"] or rail:
             if rail:
-                print "%s is rail" % signal
+                log.debug( "%s is rail", signal )
                 if len( pull_path ) > 1:
                     id_ref_pin = pull_path[-2]
                     [ id, ref, pin ] = id_ref_pin.split( '.' )
@@ -724,11 +1005,23 @@ class system_connections():
                 info_dict["PULL_ID_SIGNAL"].append(id_signal)
                 test_id = ""
                 test_signal = ""
+
+                # If the resistor network was solved, the solved voltage replaces the resistor pulls
+                nodal = id_signal in self.syscon_dict["NODALVOLT"]
+                if nodal:
+                    pull_volt = self.syscon_dict["NODALVOLT"][id_signal]
+                    pull_info = "%s solved at %.2f" % ( id_signal, pull_volt )
+                    info_dict["PULL"].append( pull_info )
+                    info_dict["VOLT"].append( pull_volt )
+
                 for ref_pin in self.syscon_dict["NETLIST"][id]["CONNECTION"][signal]:
 
                     if ignore == True:
                         break
 
+                    if self.profile is not None:
+                        self.profile.count( "pull_netlist_signal nodes" )
+
                     [ ref, pin ] = ref_pin.split( '.' )
                     id_ref_pin = "%s.%s" % ( id, ref_pin )
 
@@ -736,13 +1029,12 @@ class system_connections():
                     if id_ref_pin in self.syscon_dict["REFVOLT"]:
                         pull_volt = self.syscon_dict["REFVOLT"][id_ref_pin]
                         pull_info = "%s specified at %.2f" % ( id_ref_pin, pull_volt )
-                        print "Device %s specifies %s is %.2f" % ( ref, signal, pull_volt )
+                        log.debug( "Device %s specifies %s is %.2f", ref, signal, pull_volt )
                         info_dict["PULL"].append( pull_info )
                         info_dict["VOLT"].append( pull_volt )
 
                     # See if ref is resistor and not dnp resistor or a capacitor and not dnp capacitor and not ignored
-                    if ref not in self.syscon_dict["IGNORE"]["DEVICE"] and ref[0] == "R" and ref[1].isdigit() and ref in self.syscon_dict["NETLIST"][id]["PART"] and \
-                       self.syscon_dict["NETLIST"][id]["PART"][ref].lower().find("dnp") == -1:
+                    if not nodal and self.is_pull_resistor( id, ref ):
                         if pin == "1":
                             pull_pin = "2"
                         else:
@@ -757,12 +1049,12 @@ class system_connections():
                             rail = pull_signal in self.syscon_dict["NETLIST"][id]["RAIL"]
                             if not rail:
                                 ( info_dict, ignore ) = self.pull_netlist_signal( id, pull_signal, info_dict, pull_path )
-                            elif rail and not self.syscon_dict["NETLIST"][id]["RAIL"][pull_signal] == 0.0:
+                            elif rail and ( not self.syscon_dict["NETLIST"][id]["RAIL"][pull_signal] == 0.0 or info_dict.get( "GND_PULLS" ) ):
                                 pull_part = self.syscon_dict["NETLIST"][id]["PART"][ref]
                                 pull_info = "%s.%s (%s) to %s" % ( id, pull_part, pull_ref_pin, pull_signal )
                                 info_dict["PULL"].append( pull_info )
                                 info_dict["VOLT"].append( self.syscon_dict["NETLIST"][id]["RAIL"][pull_signal] )
-                                print "Resistor %s (%s) connects %s to rail %s" % ( pull_ref_pin, pull_part, signal, pull_signal )
+                                log.debug( "Resistor %s (%s) connects %s to rail %s", pull_ref_pin, pull_part, signal, pull_signal )
 
                     # See if signal goes through device
                     ref_type = self.syscon_dict["NETLIST"][id]["PART"][ref]
@@ -775,7 +1067,7 @@ class system_connections():
                             if pin in self.syscon_dict["DEVICEVOLT"][ref_type]:
                                 pull_volt = self.syscon_dict["DEVICEVOLT"][ref_type][pin]
                                 pull_info = "%s.%s (%s) to %.2f" % ( id, ref_pin, ref_type, pull_volt )
-                                print "Device %s (%s) connects %s to %.2f" % ( ref, ref_type, signal, pull_volt )
+                                log.debug( "Device %s (%s) connects %s to %.2f", ref, ref_type, signal, pull_volt )
                                 info_dict["PULL"].append( pull_info )
                                 info_dict["VOLT"].append( pull_volt )
                         ##print "Tracing device:", pull_path
@@ -794,7 +1086,7 @@ class system_connections():
                             if pin in self.syscon_dict["DEVICEVOLT"][ref_type]:
                                 pull_volt = self.syscon_dict["DEVICEVOLT"][ref_type][pin]
                                 pull_info = "%s.%s (%s) to %.2f" % ( id, ref_pin, ref_type, pull_volt )
-                                print "Device %s (%s) connects %s to %.2f" % ( ref, ref_type, signal, pull_volt )
+                                log.debug( "Device %s (%s) connects %s to %.2f", ref, ref_type, signal, pull_volt )
                                 info_dict["PULL"].append( pull_info )
                                 info_dict["VOLT"].append( pull_volt )
                         ##print "Tracing device:", pull_path
@@ -809,6 +1101,8 @@ class system_connections():
                         if ref in self.syscon_dict["CONNECTION_REFS"][id] and path_id not in pull_path:
                                 pull_path.append(path_id)
                                 test_info_dict = copy.copy( info_dict )
+                                if self.profile is not None:
+                                    self.profile.count( "pull info copies" )
                                 test_info_dict["PATH"] = pull_path  # trace connection function will continue adding to pull_path
                                 ( id_signal, test_info_dict ) = self.trace_connection( id, ref_pin, test_info_dict )
                                 if len( id_signal ) > 0:
@@ -823,6 +1117,254 @@ class system_connections():
         return ( info_dict, ignore )
 
 
+    def is_pull_resistor( self, id, ref ):
+        """
+        Returns True if ref is a fitted resistor that is not ignored
+        """
+        return ref not in self.syscon_dict["IGNORE"]["DEVICE"] and ref[0] == "R" and ref[1:2].isdigit() and ref in self.syscon_dict["NETLIST"][id]["PART"] and \
+               self.syscon_dict["NETLIST"][id]["PART"][ref].lower().find("dnp") == -1
+
+
+    def solve_nodal_voltages( self ):
+        """
+        solve_nodal_voltages()
+
+        Solve the DC voltage of every resistor-connected net on each board
+
+        Resistor values are parsed from the PART type (see netlist.parse_resistance). For each
+        board one sparse conductance matrix is built over the non-rail nets joined by resistors,
+        with rails as fixed voltage nodes, and all node voltages are found with a single sparse
+        solve. Groups of nets with no resistor path to a rail are left out. Pulls through
+        connectors and devices are not part of the matrix, so each board is solved on its own.
+
+        Results are stored in ["NODALVOLT"] = { ID.Signal: Volt, ... } and are used by
+        pull_netlist_signal in place of the resistor pulls on those nets.
+        """
+        try:
+            import numpy
+            import scipy.sparse
+            import scipy.sparse.csgraph
+            import scipy.sparse.linalg
+        except ImportError:
+            log.error( "Nodal analysis requires numpy and scipy" )
+            return self.syscon_dict["NODALVOLT"]
+
+        for id in self.syscon_dict["NETLIST_FILE"]:
+            net = self.syscon_dict["NETLIST"][id]
+            node_index = {}
+            node_signal = []
+            rows = []
+            cols = []
+            vals = []
+            rhs = []
+            rail_tied = []
+
+            for ref in net["PART"]:
+                if not self.is_pull_resistor( id, ref ):
+                    continue
+                ohms = netlist.parse_resistance( net["PART"][ref] )
+                pin_signals = [ net["REF.PIN"].get( "%s.1" % ref ), net["REF.PIN"].get( "%s.2" % ref ) ]
+                if ohms is None or None in pin_signals or pin_signals[0] == pin_signals[1]:
+                    continue
+                conductance = 1.0 / max( ohms, MIN_RESISTANCE )
+
+                nodes = []
+                for signal in pin_signals:
+                    if signal in net["RAIL"]:
+                        nodes.append( None )
+                    else:
+                        if signal not in node_index:
+                            node_index[signal] = len( node_signal )
+                            node_signal.append( signal )
+                            rhs.append( 0.0 )
+                            rail_tied.append( False )
+                        nodes.append( node_index[signal] )
+
+                # Stamp the resistor into the conductance matrix, rails move to the right hand side
+                for ( node, other, other_signal ) in [ ( nodes[0], nodes[1], pin_signals[1] ), ( nodes[1], nodes[0], pin_signals[0] ) ]:
+                    if node is None:
+                        continue
+                    rows.append( node )
+                    cols.append( node )
+                    vals.append( conductance )
+                    if other is None:
+                        rhs[node] += conductance * net["RAIL"][other_signal]
+                        rail_tied[node] = True
+                    else:
+                        rows.append( node )
+                        cols.append( other )
+                        vals.append( -conductance )
+
+            num_nodes = len( node_signal )
+            if num_nodes == 0:
+                continue
+
+            conductance_matrix = scipy.sparse.coo_matrix( ( vals, ( rows, cols ) ), shape=( num_nodes, num_nodes ) ).tocsr()
+            rhs = numpy.array( rhs )
+
+            # Only groups of nets with at least one resistor to a rail have a solution
+            ( num_groups, group ) = scipy.sparse.csgraph.connected_components( conductance_matrix, directed=False )
+            driven = numpy.zeros( num_groups, dtype=bool )
+            driven[group[numpy.array( rail_tied )]] = True
+            solved = numpy.nonzero( driven[group] )[0]
+            if len( solved ) == 0:
+                continue
+
+            solved_matrix = conductance_matrix[solved][:, solved].tocsc()
+            volts = scipy.sparse.linalg.spsolve( solved_matrix, rhs[solved] )
+            for ( node, volt ) in zip( solved, numpy.atleast_1d( volts ) ):
+                self.syscon_dict["NODALVOLT"]["%s.%s" % ( id, node_signal[node] )] = float( volt )
+
+            log.info( "Solved %d of %d resistor-connected nets on %s", len( solved ), num_nodes, id )
+
+        return self.syscon_dict["NODALVOLT"]
+
+
+    def detect_terminations( self ):
+        """
+        detect_terminations()
+
+        Classify the termination of every net with a single pass over the parts of each board
+            SERIES      Resistor between two non-rail nets that both have a pin of a part other
+                        than a resistor or capacitor, so the resistor is in the path of a signal
+                        (not a divider leg or a pull to another resistor node)
+            PARALLEL    Resistor from the net to a rail
+            THEVENIN    Resistors from the net to rails at different voltages
+            AC          Resistor from the net to a node whose only other parts are capacitors to rails
+
+        Returns ["TERMINATION"] = { ID.Signal: [ "TYPE Ref (Type) to Signal", ... ], ... }
+        """
+        for id in self.syscon_dict["NETLIST_FILE"]:
+            net = self.syscon_dict["NETLIST"][id]
+            resistors = []
+            cap_to_rail = {}        # { Signal: [ ( Ref, Rail ), ... ] }
+            path_signals = set()    # Signals with a pin of a part that is not a resistor or capacitor
+
+            for ref in net["PART"]:
+                if len( ref ) < 2 or not ref[1].isdigit() or ref[0] not in "RC":
+                    for pin in net["PINS"].get( ref, [] ):
+                        signal = net["REF.PIN"].get( "%s.%s" % ( ref, pin ) )
+                        if signal is not None:
+                            path_signals.add( signal )
+                    continue
+                if ref in self.syscon_dict["IGNORE"]["DEVICE"] or net["PART"][ref].lower().find("dnp") != -1:
+                    continue
+                pin_signals = ( net["REF.PIN"].get( "%s.1" % ref ), net["REF.PIN"].get( "%s.2" % ref ) )
+                if None in pin_signals or pin_signals[0] == pin_signals[1]:
+                    continue
+
+                if ref[0] == "R":
+                    resistors.append( ( ref, pin_signals ) )
+                else:
+                    for ( signal, rail ) in [ pin_signals, pin_signals[::-1] ]:
+                        if rail in net["RAIL"] and signal not in net["RAIL"]:
+                            if signal not in cap_to_rail:
+                                cap_to_rail[signal] = []
+                            cap_to_rail[signal].append( ( ref, rail ) )
+
+            rail_resistors = {}
+            for ( ref, ( signal_a, signal_b ) ) in resistors:
+                ref_info = "%s (%s)" % ( ref, net["PART"][ref] )
+                if signal_a in net["RAIL"] and signal_b in net["RAIL"]:
+                    continue
+                elif signal_a in net["RAIL"] or signal_b in net["RAIL"]:
+                    if signal_a in net["RAIL"]:
+                        ( signal_a, signal_b ) = ( signal_b, signal_a )
+                    if signal_a not in rail_resistors:
+                        rail_resistors[signal_a] = []
+                    rail_resistors[signal_a].append( ( ref_info, signal_b ) )
+                else:
+                    for ( signal, node ) in [ ( signal_a, signal_b ), ( signal_b, signal_a ) ]:
+                        # AC termination node only connects the resistor and the capacitors
+                        if node in cap_to_rail and len( net["CONNECTION"][node] ) == 1 + len( cap_to_rail[node] ):
+                            caps = " + ".join( [ "%s (%s) to %s" % ( cap_ref, net["PART"][cap_ref], rail ) for ( cap_ref, rail ) in sorted( cap_to_rail[node] ) ] )
+                            self.add_termination( id, signal, "AC %s + %s" % ( ref_info, caps ) )
+                        elif signal in path_signals and node in path_signals:
+                            self.add_termination( id, signal, "SERIES %s to %s" % ( ref_info, node ) )
+
+            for signal in rail_resistors:
+                rail_volts = set( [ net["RAIL"][rail] for ( ref_info, rail ) in rail_resistors[signal] ] )
+                if len( rail_volts ) > 1:
+                    termination_type = "THEVENIN"
+                else:
+                    termination_type = "PARALLEL"
+                for ( ref_info, rail ) in rail_resistors[signal]:
+                    self.add_termination( id, signal, "%s %s to %s" % ( termination_type, ref_info, rail ) )
+
+        return self.syscon_dict["TERMINATION"]
+
+
+    def add_termination( self, id, signal, termination ):
+        id_signal = "%s.%s" % ( id, signal )
+        if id_signal not in self.syscon_dict["TERMINATION"]:
+            self.syscon_dict["TERMINATION"][id_signal] = []
+        self.syscon_dict["TERMINATION"][id_signal].append( termination )
+
+
+    def check_ref_volts( self ):
+        """
+        check_ref_volts()
+
+        Check that every REFVOLT pin, and every DEVICEVOLT pin of a placed device, sees its
+        expected voltage (to verify internal connections). Pulls are resolved once per net
+        and shared by all the pins on that net.
+
+        The pin's own REFVOLT / DEVICEVOLT entry is not counted as a pull source. Resistors to
+        0 V rails are counted, so pins expected at 0 V can be checked. Pins on ignored nets are
+        not checked, and pulls within REF_VOLT_TOLERANCE of the expected voltage match it.
+
+        Returns [ ( ID.Ref.Pin, ID.Signal, Expected Volt, Status, PULL, VOLT ), ... ] for the pins
+        that fail, where Status is "MISMATCH" or "NO VOLTAGE"
+        """
+        ref_volts = []
+        for id_ref_pin in self.syscon_dict["REFVOLT"]:
+            ref_volts.append( ( id_ref_pin, self.syscon_dict["REFVOLT"][id_ref_pin] ) )
+
+        for id in self.syscon_dict["NETLIST_FILE"]:
+            net = self.syscon_dict["NETLIST"][id]
+            for ref in net["PART"]:
+                ref_type = net["PART"][ref]
+                if ref_type in self.syscon_dict["DEVICEVOLT"]:
+                    for pin in self.syscon_dict["DEVICEVOLT"][ref_type]:
+                        if "%s.%s" % ( ref, pin ) in net["REF.PIN"]:
+                            ref_volts.append( ( "%s.%s.%s" % ( id, ref, pin ), self.syscon_dict["DEVICEVOLT"][ref_type][pin] ) )
+
+        pull_results = {}
+        failures = []
+        for ( id_ref_pin, expected_volt ) in ref_volts:
+            id_signal = self.id_ref_pin_to_signal( id_ref_pin )
+            if len( id_signal ) == 0:
+                continue
+            if id_signal not in pull_results:
+                pull_results[id_signal] = self.check_pull( id_signal, { "GND_PULLS": True } )
+            elif self.profile is not None:
+                self.profile.count( "ref volt pull cache hits" )
+            info_dict = pull_results[id_signal]
+            # The pull stops at an ignored signal and adds the nets it came through to the IGNORE list
+            if id_signal in self.syscon_dict["IGNORE"]["SIGNAL"]:
+                log.debug( "%s is on ignored net %s, not checked", id_ref_pin, id_signal )
+                continue
+
+            pulls = []
+            volts = []
+            for ( pull, volt ) in zip( info_dict["PULL"], info_dict["VOLT"] ):
+                if not pull.startswith( "%s " % id_ref_pin ):
+                    pulls.append( pull )
+                    volts.append( volt )
+
+            if len( volts ) == 0:
+                failures.append( ( id_ref_pin, id_signal, expected_volt, "NO VOLTAGE", pulls, volts ) )
+            else:
+                for volt in volts:
+                    if abs( volt - expected_volt ) > REF_VOLT_TOLERANCE:
+                        failures.append( ( id_ref_pin, id_signal, expected_volt, "MISMATCH", pulls, volts ) )
+                        break
+
+        log.info( "Checked %d reference voltage pins on %d nets, %d failed", len( ref_volts ), len( pull_results ), len( failures ) )
+
+        return failures
+
+
     def trace_netlist_signal( self, from_id_signal, to_id_signal, info_dict ):
         """
         trace_netlist_signal
@@ -833,6 +1375,8 @@ class system_connections():
 
         ##print "trace_netlist_signal( %s, %s )" % ( from_id_signal, to_id_signal )
         ##print info_dict
+        if self.profile is not None:
+            self.profile.count( "trace_netlist_signal calls" )
 
         trace_success = False
         from_token = from_id_signal.split( '.' )
@@ -841,6 +1385,8 @@ class system_connections():
         if len( from_token ) > 1:
             from_id = from_token[0]
             from_signal = from_token[1]
+            if self.visited is not None:
+                self.visited.add( from_id )
         else:
             valid_params = False
 
@@ -861,6 +1407,8 @@ class system_connections():
             if from_id in self.syscon_dict["NETLIST"]:
                 if from_signal in self.syscon_dict["NETLIST"][from_id]["CONNECTION"]:
                     for ref_pin in self.syscon_dict["NETLIST"][from_id]["CONNECTION"][from_signal]:
+                        if self.profile is not None:
+                            self.profile.count( "trace_netlist_signal nodes" )
                         ref_token = ref_pin.split( '.' )
                         ref = ref_token[0]
                         pin = ref_token[1]
@@ -877,6 +1425,8 @@ class system_connections():
                                     test_path.append( path_id )
                                     test_info_dict = copy.copy( info_dict )
                                     test_info_dict["PATH"] = test_path
+                                    if self.profile is not None:
+                                        self.profile.count( "trace path copies" )
 
                                     ( id_signal, test_info_dict ) = self.trace_connection( from_id, ref_pin, test_info_dict )
                                     if len( id_signal ) > 0:
@@ -897,6 +1447,8 @@ class system_connections():
                                 test_path.append( path_id )
                                 test_info_dict = copy.copy( info_dict )
                                 test_info_dict["PATH"] = test_path
+                                if self.profile is not None:
+                                    self.profile.count( "trace path copies" )
                                 ( id_signal, test_info_dict ) = self.trace_device( from_id, ref_pin, ref_type, test_info_dict )
                                 if len( id_signal ) > 0:
                                     ##print "Looking for path from %s to %s" % ( id_signal, to_id_signal )
@@ -916,8 +1468,7 @@ class system_connections():
         Will trace through harnesses until it gets to a signal name in a netlist
         """
 
-        print "trace_connection( %s.%s )" % ( from_id, from_ref_pin )
-        print info_dict
+        log.debug( "trace_connection( %s.%s ) %s", from_id, from_ref_pin, info_dict )
 
         to_id_signal = ""
         from_token = from_ref_pin.split( '.' )
@@ -938,6 +1489,8 @@ class system_connections():
                     to_ref = to_token[1]
                 # Pins are always the same on either side of a connection
                 to_ref_pin = "%s.%s" % ( to_ref, from_pin )
+                if self.visited is not None:
+                    self.visited.add( to_id )
 
                 ##print "%s connected to %s" % ( from_id_ref, to_id_ref )
 
@@ -973,7 +1526,7 @@ class system_connections():
         Will trace through device
         """
 
-        print "trace_device( %s.%s, %s )" % ( from_id, from_ref_pin, from_ref_type )
+        log.debug( "trace_device( %s.%s, %s )", from_id, from_ref_pin, from_ref_type )
         ##print info_dict
 
         valid_params = True
@@ -1015,47 +1568,82 @@ class system_connections():
         return ( to_id_signal, info_dict )
 
 
-    def write_check_trace( self, f ):
+    def write_check_trace( self, writer ):
         """
         Writes trace of desired signals:
             COMMENT,DESIRE FROM,DESIRE TO,DESIRE VOLTAGE,TRACE FLAG,VOLT FLAG,COMMON VOLT FLAG,COMMON VOLTAGE,PATH,PULL,VOLT
+
+        writer is a report writer, see report_writer.py
         """
-        print "write_check_trace()"
+        log.info( "write_check_trace()" )
         info_dict = {}
         for ( from_signal, to_signal, check_dict ) in self.syscon_dict["CHECKTRACE"]:
             if from_signal[0:6] == "$$##__":
-                info = "\n%s" % self.syscon_dict["COMMENTS"][from_signal]
+                writer.write_comment( self.syscon_dict["COMMENTS"][from_signal] )
             else:
-                print "\nChecking %s -> %s\n" % ( from_signal, to_signal )
-                ( trace_flag, info_dict ) = self.check_trace( from_signal, to_signal, {} )
-
-                if "VOLT" in check_dict or trace_flag:
-                    ( info_dict ) = self.add_pulls( info_dict )
-
-                info = self.gen_check_line( from_signal, to_signal, check_dict, info_dict )
-            f.write( "%s\n" % info )
+                log.debug( "Checking %s -> %s", from_signal, to_signal )
+                start = time.time()
+                if self.check_cache is not None:
+                    record = self.check_cache.record( self, "CHECKTRACE", from_signal, to_signal, check_dict )
+                else:
+                    record = self.trace_record( from_signal, to_signal, check_dict )
+                if self.profile is not None:
+                    self.profile.time_row( "CHECKTRACE", from_signal, to_signal, time.time() - start )
+                writer.write_record( record )
 
 
-    def write_check_volt( self, f ):
+    def write_check_volt( self, writer ):
         """
         Writes trace of desired signals:
             COMMENT,DESIRE FROM,DESIRE TO,DESIRE VOLTAGE,TRACE FLAG, IGNORE FLAG, VOLT FLAG,COMMON VOLT FLAG,COMMON VOLTAGE,PATH,PULL,VOLT
+
+        writer is a report writer, see report_writer.py
         """
 
-        print "write_check_volt()"
+        log.info( "write_check_volt()" )
 
         for ( signal, check_dict ) in self.syscon_dict["CHECKVOLT"]:
             if signal[0:6] == "$$##__":
-                info = "\n%s" % self.syscon_dict["COMMENTS"][signal]
+                writer.write_comment( self.syscon_dict["COMMENTS"][signal] )
             else:
-                print "\nChecking voltage on %s\n" % ( signal )
-                ( info_dict ) = self.check_pull( signal, {} )
+                log.debug( "Checking voltage on %s", signal )
+                start = time.time()
+                if self.check_cache is not None:
+                    record = self.check_cache.record( self, "CHECKVOLT", signal, signal, check_dict )
+                else:
+                    record = self.pull_record( signal, check_dict )
+                if self.profile is not None:
+                    self.profile.time_row( "CHECKVOLT", signal, signal, time.time() - start )
 
-                info = self.gen_check_line( signal, signal, check_dict, info_dict )
-            f.write( "%s\n" % info )
+                writer.write_record( record )
 
 
-    def write_all_volt(self, f):
+    def trace_record( self, from_signal, to_signal, check_dict ):
+        """
+        Traces one CHECKTRACE row, pulls are added if the trace succeeds or a voltage is desired
+
+        Returns the check record
+        """
+        ( trace_flag, info_dict ) = self.check_trace( from_signal, to_signal, {} )
+
+        if "VOLT" in check_dict or trace_flag:
+            ( info_dict ) = self.add_pulls( info_dict )
+
+        return self.gen_check_record( from_signal, to_signal, check_dict, info_dict, "CHECKTRACE" )
+
+
+    def pull_record( self, signal, check_dict, report="CHECKVOLT" ):
+        """
+        Checks the pulls on one signal
+
+        Returns the check record
+        """
+        ( info_dict ) = self.check_pull( signal, {} )
+
+        return self.gen_check_record( signal, signal, check_dict, info_dict, report )
+
+
+    def write_all_volt(self, writer, jobs=1):
         """
         Writes trace of desired signals, used to see all voltage pulls on every net.
             COMMENT,DESIRE FROM,DESIRE TO,DESIRE VOLTAGE,TRACE FLAG, IGNORE FLAG, VOLT FLAG,COMMON VOLT FLAG,COMMON VOLTAGE,PATH,PULL,VOLT
@@ -1063,86 +1651,144 @@ class system_connections():
         First, the conflicting voltage signals from each board are written
         Then, the signals which have no voltage information (so it can be easier investigated what is missing which resulted in no voltage info)
         Lastly, the non-conflicting voltage signals are written
+
+        Each category is written to its own writer section as the nets are checked, so no
+        pull results are kept in memory. The CSV writer spills sections to temporary files
+        and concatenates them at the end.
+
+        If jobs > 1, the nets of each board are split into shards of VOLT_SHARD_SIZE and
+        checked by a pool of worker processes. Results are collected in shard order so the
+        output is the same as a sequential run. The IGNORE list is read-only while the nets
+        are checked (see check_volt_shard), so rows do not depend on which worker checks them.
         """
-        info = ""
-        check_dict = {}
-        signal_dict = { "CONFLICT": {}, "NA": {}, "NON-CONFLICT": {} } # { "CONFLICT": { Board_ID:[(Signal, Info Dict),...], ... }, ... }
+        global _volt_worker_syscon
 
+        writer.open_sections( [ category for ( category, title ) in VOLT_CATEGORIES ] )
 
+        pool = None
+        try:
+            shards = self.volt_shards( VOLT_SHARD_SIZE )
+            if worker_jobs( jobs ) > 1:
+                # Workers are forked with a copy of the system model, nothing is pickled
+                _volt_worker_syscon = self
+                pool = multiprocessing.Pool( jobs )
+                results = pool.imap( _volt_worker, shards )
+            else:
+                results = itertools.imap( self.check_volt_shard, shards )
+
+            last_id = None
+            for ( id, records, checked ) in results:
+                # Records checked by worker processes are added to this process's cache
+                if self.check_cache is not None:
+                    self.check_cache.update( checked )
+                if id != last_id:
+                    for ( category, title ) in VOLT_CATEGORIES:
+                        writer.write_heading( "%s %s" % ( id, title ), category )
+                    last_id = id
+
+                for ( category, record ) in records:
+                    writer.write_record( record, category )
+
+            if pool is not None:
+                pool.close()
+                pool.join()
+                pool = None
+        finally:
+            if pool is not None:
+                pool.terminate()
+            _volt_worker_syscon = None
+            writer.close_sections()
+
+
+    def volt_shards( self, shard_size ):
+        """
+        Generates ( ID, [ Signal, ... ] ) shards of at most shard_size nets, board by board.
+        Every board yields at least one (possibly empty) shard so its section headers are written.
+        """
         for id in self.syscon_dict["NETLIST_FILE"]:
-            signal_dict["CONFLICT"][id] = []
-            signal_dict["NA"][id] = []
-            signal_dict["NON-CONFLICT"][id] = []
+            signals = list( self.syscon_dict["NETLIST"][id]["CONNECTION"] )
+            if len( signals ) == 0:
+                yield ( id, [] )
+            for i in range( 0, len( signals ), shard_size ):
+                yield ( id, signals[i:i+shard_size] )
 
-            f.write( "\n\n,%s CONFLICT SIGNALS\n\n" % id)
-            for signal in self.syscon_dict["NETLIST"][id]["CONNECTION"]:
-                id_signal = "%s.%s" % (id, signal)
-                ( info_dict ) = self.check_pull(id_signal, {} )
-
-                common_volt_flag = True
-                if len( info_dict["VOLT"] ) > 0:
-                    # Check for common pull-up/down voltage
-                    common_volt = info_dict["VOLT"][0]
-                    for volt in info_dict["VOLT"]:
-                        if volt != common_volt:
-                            common_volt_flag = False
-                            break
 
-                    if common_volt_flag:
-                        signal_dict["NON-CONFLICT"][id].append( (id_signal, info_dict) )
-                    else:
-                        signal_dict["CONFLICT"][id].append( (id_signal, info_dict) )
-                        info = self.gen_check_line( id_signal, id_signal, check_dict, info_dict )
-                        f.write( "%s\n" % info )
-                else:
-                    signal_dict["NA"][id].append( (id_signal, info_dict) )
+    def check_volt_shard( self, shard ):
+        """
+        Checks the pulls on every net of a write_all_volt shard
 
-        # Write the NA Signals
-        for id in self.syscon_dict["NETLIST_FILE"]:
-            f.write( "\n\n,%s NO VOLTAGE SIGNALS\n\n" % id)
-            for (id_signal, info_dict) in signal_dict["NA"][id]:
-                info = self.gen_check_line( id_signal, id_signal, check_dict, info_dict )
-                f.write( "%s\n" % info )
+        Each net is checked against the IGNORE list as it was before the shard, signals the
+        pull adds to it (from reaching an ignored signal) only count for that net's row. The
+        rows are the same whichever shards were checked before, in this or another process.
 
-        # Write the remaining non-conflicting signals
-        for id in self.syscon_dict["NETLIST_FILE"]:
-            f.write( "\n\n,%s NON-CONFLICTING SIGNALS\n\n" % id)
-            for (id_signal, info_dict) in signal_dict["NON-CONFLICT"][id]:
-                info = self.gen_check_line( id_signal, id_signal, check_dict, info_dict )
-                f.write( "%s\n" % info )
+        Returns ( ID, [ ( Category, Check Record ), ... ], [ Checked, ... ] ), Checked are the
+        records added to check_cache, see check_cache.take_checked
+        """
+        ( id, signals ) = shard
+        check_dict = {}
+        records = []
+        ignored_signals = self.syscon_dict["IGNORE"]["SIGNAL"]
+        for signal in signals:
+            id_signal = "%s.%s" % (id, signal)
+            self.syscon_dict["IGNORE"]["SIGNAL"] = list( ignored_signals )
+            start = time.time()
+            if self.check_cache is not None:
+                record = self.check_cache.record( self, "ALLVOLT", id_signal, id_signal, check_dict )
+            else:
+                record = self.pull_record( id_signal, check_dict, "ALLVOLT" )
+            if self.profile is not None:
+                self.profile.time_row( "ALLVOLT", id_signal, id_signal, time.time() - start )
+
+            records.append( ( self.volt_category( record ), record ) )
+        self.syscon_dict["IGNORE"]["SIGNAL"] = ignored_signals
+
+        checked = []
+        if self.check_cache is not None:
+            checked = self.check_cache.take_checked()
+        return ( id, records, checked )
 
-    def gen_check_line( self, from_id_signal, to_id_signal, check_dict, info_dict ):
+
+    def volt_category( self, info_dict ):
         """
-        Writes trace of desired signals:
-            COMMENT,DESIRE FROM,DESIRE TO,DESIRE VOLTAGE,TRACE FLAG,IGNORE FLAG,VOLT FLAG,COMMON VOLT FLAG,COMMON VOLTAGE,PATH,PULL,VOLT
+        Returns the write_all_volt category of a pull result (info_dict or check record):
+            "CONFLICT"      Pull voltages disagree
+            "NA"            No pull voltage found
+            "NON-CONFLICT"  All pull voltages agree
         """
-        from_token = from_id_signal.split( "." )
-        to_token = to_id_signal.split( "." )
-        from_signal = from_token[1]
-        to_signal = to_token[1]
+        if len( info_dict["VOLT"] ) == 0:
+            return "NA"
 
-        info = ',="%s",="%s",' % ( from_id_signal, to_id_signal )
-        if "VOLT" in check_dict:
-            desired_volt = check_dict["VOLT"]
-            info += '="%.2f",' % desired_volt
+        # Check for common pull-up/down voltage
+        common_volt = info_dict["VOLT"][0]
+        for volt in info_dict["VOLT"]:
+            if volt != common_volt:
+                return "CONFLICT"
+
+        return "NON-CONFLICT"
+
+
+    def gen_check_record( self, from_id_signal, to_id_signal, check_dict, info_dict, report="" ):
+        """
+        Returns the check record (see report_writer.py) for a trace or pull result
+        """
+        record = { "REPORT": report, "FROM": from_id_signal, "TO": to_id_signal, "DESIRED_VOLT": None, "TRACE": None,
+                   "VOLT_FLAG": None, "COMMON_VOLT_FLAG": None, "COMMON_VOLT": None,
+                   "PATH": info_dict["PATH"], "PULL": info_dict["PULL"], "VOLT": info_dict["VOLT"], "TERM": None }
+
+        ( from_type, record["FROM_SIGNAL"] ) = self.param_to_signal( from_id_signal )
+        if to_id_signal == from_id_signal:
+            record["TO_SIGNAL"] = record["FROM_SIGNAL"]
         else:
-            info += ','
+            ( to_type, record["TO_SIGNAL"] ) = self.param_to_signal( to_id_signal )
+
+        if "VOLT" in check_dict:
+            record["DESIRED_VOLT"] = check_dict["VOLT"]
 
-        trace_flag = False
         if "TRACE" in info_dict:
-            trace_flag = info_dict["TRACE"]
-            if trace_flag:
-                info += "TRUE,"
-            else:
-                info += "FALSE,"
-        else:
-            info += "#N/A,"
+            record["TRACE"] = info_dict["TRACE"]
 
         # Ignore signal for voltage/trace flag
-        if from_id_signal in self.syscon_dict["IGNORE"]["SIGNAL"] or to_id_signal in self.syscon_dict["IGNORE"]["SIGNAL"]:
-            info += "TRUE,"
-        else:
-            info += "FALSE,"
+        record["IGNORE"] = from_id_signal in self.syscon_dict["IGNORE"]["SIGNAL"] or to_id_signal in self.syscon_dict["IGNORE"]["SIGNAL"]
 
         common_volt_flag = False
         if len( info_dict["VOLT"] ) > 0:
@@ -1154,171 +1800,888 @@ class system_connections():
                     ##print "Voltage mismatch: %g vs %g" % ( volt, common_volt )
                     common_volt_flag = False
 
-        if "VOLT" in check_dict:
+            # If we found pull-up/down, note it and the common voltage
+            record["COMMON_VOLT_FLAG"] = common_volt_flag
             if common_volt_flag:
-                # If we have both a desired voltage and a pull-up/down, check if they match
-                if check_dict["VOLT"] == common_volt:
-                    info += "TRUE,"
-                else:
-                    info += "FALSE,"
-            else:
-                # If we have a desired voltage but no (or mismatched) pull-up/down, then we have a problem
-                info += "FALSE,"
-        else:
+                record["COMMON_VOLT"] = common_volt
+
+        if "VOLT" in check_dict:
+            # If we have both a desired voltage and a pull-up/down, check if they match
+            # If we have a desired voltage but no (or mismatched) pull-up/down, then we have a problem
             # If we don't have a desired voltage, there is no possible match
-            info += "#N/A,"
+            record["VOLT_FLAG"] = common_volt_flag and check_dict["VOLT"] == common_volt
+
+        # Termination column is only written once terminations have been detected
+        if len( self.syscon_dict["TERMINATION"] ) > 0:
+            record["TERM"] = []
+            id_signals = []
+            for id_signal in [ record["FROM_SIGNAL"], record["TO_SIGNAL"] ]:
+                if id_signal not in id_signals:
+                    id_signals.append( id_signal )
+                    record["TERM"].extend( self.syscon_dict["TERMINATION"].get( id_signal, [] ) )
+
+        return record
+
+
+    def write_ref_volt_check( self, writer ):
+        """
+        Writes the reference voltage pins that do not see their expected voltage:
+            COMMENT,REF PIN,SIGNAL,EXPECTED VOLTAGE,STATUS,PULL,VOLT
+        """
+        writer.write_heading( "REFVOLT / DEVICEVOLT FAILURES" )
+        for ( id_ref_pin, id_signal, expected_volt, status, pulls, volts ) in self.check_ref_volts():
+            row = [ ( report_writer.RAW, "" ), ( report_writer.TEXT, id_ref_pin ), ( report_writer.TEXT, id_signal ),
+                    ( report_writer.VOLT, expected_volt ), ( report_writer.RAW, status ), ( report_writer.RAW, "PULL" ) ]
+            for pull in pulls:
+                row.append( ( report_writer.TEXT, pull ) )
+            row.append( ( report_writer.RAW, "VOLT" ) )
+            for volt in volts:
+                row.append( ( report_writer.VOLT, volt ) )
+            row.append( ( report_writer.RAW, "" ) )
+            writer.write_row( row )
+
+
+    def write_floating_pins( self, writer ):
+        """
+        Writes the connector pins that are not joined to another board (label_components):
+            COMMENT,REF PIN,SIGNAL,STATUS
+        STATUS is NO MATE when the mated connector has no such pin, NOT JOINED otherwise
+        """
+        import system_graph
+
+        writer.write_heading( "FLOATING CONNECTOR PINS" )
+        for ( pin, status ) in system_graph.floating_pins( self.graph, *self.component_labels ):
+            id_ref_pin = self.graph.pin_name( pin )
+            id_signal = self.graph.net_name( self.graph.pin_net( pin ) )
+            writer.write_row( [ ( report_writer.RAW, "" ), ( report_writer.TEXT, id_ref_pin ), ( report_writer.TEXT, id_signal ),
+                                ( report_writer.RAW, status ), ( report_writer.RAW, "" ) ] )
+
+
+    def follow_connection( self, id, ref, pin ):
+        """
+        Follows connector pin id.ref.pin through CONNECTIONs and harness wires, as
+        trace_connection does, to the board pin at the other end
+
+        Returns ( To ID, To Ref.Pin, [ Harness wire, ... ] ), To ID and To Ref.Pin are None
+        if the path ends before reaching a board pin
+        """
+        wires = []
+        followed = set()
+        while True:
+            to_id_ref = self.syscon_dict["CONNECTION"].get( "%s.%s" % ( id, ref ) )
+            if to_id_ref is None:
+                break
+            to_token = to_id_ref.split( '.' )
+            ( to_id, to_ref ) = ( to_token[0], to_token[1] )
+            # Pins are always the same on either side of a connection
+            to_ref_pin = "%s.%s" % ( to_ref, pin )
+
+            if to_id in self.syscon_dict["HARNESS"]:
+                if to_ref_pin not in self.syscon_dict["HARNESS"][to_id] or ( to_id, to_ref_pin ) in followed:
+                    break
+                followed.add( ( to_id, to_ref_pin ) )
+                connected_ref_pin = self.syscon_dict["HARNESS"][to_id][to_ref_pin]
+                wires.append( "%s.%s-%s" % ( to_id, to_ref_pin, connected_ref_pin ) )
+                connected_token = connected_ref_pin.split( '.' )
+                ( id, ref, pin ) = ( to_id, connected_token[0], connected_token[1] )
+
+            elif to_id in self.syscon_dict["NETLIST"]:
+                if to_ref_pin in self.syscon_dict["NETLIST"][to_id]["REF.PIN"]:
+                    return ( to_id, to_ref_pin, wires )
+                break
 
-        if len( info_dict["VOLT"] ) > 0:
-            # If we found pull-up/down, write it and the common voltage
-            if common_volt_flag:
-                info += 'TRUE,="%.2f",' % common_volt
             else:
-                info += 'FALSE,#N/A,'
-        else:
-            info += '#N/A,#N/A,'
-
-        info += "PATH,"
-        for id_ref_pin in info_dict["PATH"]:
-            info += '="%s",' % id_ref_pin
-        info += "PULL,"
-        for pull in info_dict["PULL"]:
-            info += '="%s",' % pull
-        info += "VOLT,"
-        for volt in info_dict["VOLT"]:
-            info += '="%.2f",' % volt
+                break
 
-        return info
+        return ( None, None, wires )
+
+
+    def net_devices( self, id, signal ):
+        """
+        Returns [ "ID.Type (Ref.Pin) to Signal", ... ], the devices that trace_device would
+        follow from signal, and the signals at their other pins
+        """
+        devices = []
+        net_dict = self.syscon_dict["NETLIST"][id]
+        for ref_pin in net_dict["CONNECTION"].get( signal, [] ):
+            ref_token = ref_pin.split( '.' )
+            ( ref, pin ) = ( ref_token[0], ref_token[1] )
+            ref_type = net_dict["PART"].get( ref )
+            if ref_type in self.syscon_dict["DEVICE"] and ref_type not in self.syscon_dict["IGNORE"]["DEVICE"] and \
+                    ref not in self.syscon_dict["CONNECTION_REFS"].get( id, [] ):
+                ( to_id_signal, info_dict ) = self.trace_device( id, ref_pin, ref_type )
+                if len( to_id_signal ) > 0:
+                    devices.append( "%s.%s (%s) to %s" % ( id, ref_type, ref_pin, to_id_signal.split( '.', 1 )[1] ) )
+        return devices
+
+
+    def interconnect( self ):
+        """
+        Generates the interconnect of the system, one row per board connector pin path,
+        board by board in NETLIST order. A path is only generated from the first of its two
+        board pins, and the devices of each net are looked up once, so the time is linear in
+        the number of connector pins.
+
+        Generates ( ID, From ID.Ref.Pin, From ID.Signal, To ID.Ref.Pin, To ID.Signal,
+                    [ Harness wire, ... ], [ From device, ... ], [ To device, ... ] ),
+        To ID.Ref.Pin and To ID.Signal are "" for a path that does not reach a board
+        """
+        done = set()
+        devices = {}    # { ID.Signal: net_devices }
+
+        def id_signal_devices( id, signal ):
+            id_signal = "%s.%s" % ( id, signal )
+            if id_signal not in devices:
+                devices[id_signal] = self.net_devices( id, signal )
+            return ( id_signal, devices[id_signal] )
+
+        for id in self.syscon_dict["NETLIST_SEQ"]:
+            net_dict = self.syscon_dict["NETLIST"][id]
+            for ref in self.syscon_dict["CONNECTION_REFS"].get( id, [] ):
+                for pin in net_dict["PINS"].get( ref, [] ):
+                    from_id_ref_pin = "%s.%s.%s" % ( id, ref, pin )
+                    if from_id_ref_pin in done:
+                        continue
+                    ( from_id_signal, from_devices ) = id_signal_devices( id, net_dict["PIN.NET"][ref][pin] )
+
+                    ( to_id, to_ref_pin, wires ) = self.follow_connection( id, ref, pin )
+                    if to_id is None:
+                        ( to_id_ref_pin, to_id_signal, to_devices ) = ( "", "", [] )
+                    else:
+                        to_id_ref_pin = "%s.%s" % ( to_id, to_ref_pin )
+                        done.add( to_id_ref_pin )
+                        ( to_id_signal, to_devices ) = id_signal_devices( to_id, self.syscon_dict["NETLIST"][to_id]["REF.PIN"][to_ref_pin] )
+
+                    yield ( id, from_id_ref_pin, from_id_signal, to_id_ref_pin, to_id_signal, wires, from_devices, to_devices )
+
+
+    def write_icd( self, writer ):
+        """
+        Writes the interconnect of the system, board by board:
+            COMMENT,FROM PIN,FROM SIGNAL,TO PIN,TO SIGNAL,STATUS,WIRE,Harness wire,...,FROM DEVICE,Device,...,TO DEVICE,Device,...
+        STATUS is CONNECTED, or OPEN for a path that does not reach a board
+        """
+        last_id = None
+        for ( id, from_id_ref_pin, from_id_signal, to_id_ref_pin, to_id_signal, wires, from_devices, to_devices ) in self.interconnect():
+            if id != last_id:
+                writer.write_heading( "%s INTERCONNECT" % id )
+                last_id = id
+            if len( to_id_ref_pin ) > 0:
+                status = "CONNECTED"
+            else:
+                status = "OPEN"
+            row = [ ( report_writer.RAW, "" ), ( report_writer.TEXT, from_id_ref_pin ), ( report_writer.TEXT, from_id_signal ),
+                    ( report_writer.TEXT, to_id_ref_pin ), ( report_writer.TEXT, to_id_signal ), ( report_writer.RAW, status ),
+                    ( report_writer.RAW, "WIRE" ) ]
+            for wire in wires:
+                row.append( ( report_writer.TEXT, wire ) )
+            row.append( ( report_writer.RAW, "FROM DEVICE" ) )
+            for device in from_devices:
+                row.append( ( report_writer.TEXT, device ) )
+            row.append( ( report_writer.RAW, "TO DEVICE" ) )
+            for device in to_devices:
+                row.append( ( report_writer.TEXT, device ) )
+            row.append( ( report_writer.RAW, "" ) )
+            writer.write_row( row )
+
+
+    def write_terminations( self, writer ):
+        """
+        Writes the terminations found by detect_terminations, board by board:
+            COMMENT,SIGNAL,TERMINATION,TERMINATION,...
+        """
+        for id in self.syscon_dict["NETLIST_FILE"]:
+            writer.write_heading( "%s TERMINATIONS" % id )
+            for signal in self.syscon_dict["NETLIST"][id]["CONNECTION"]:
+                id_signal = "%s.%s" % ( id, signal )
+                if id_signal in self.syscon_dict["TERMINATION"]:
+                    row = [ ( report_writer.RAW, "" ), ( report_writer.TEXT, id_signal ) ]
+                    for termination in self.syscon_dict["TERMINATION"][id_signal]:
+                        row.append( ( report_writer.TEXT, termination ) )
+                    row.append( ( report_writer.RAW, "" ) )
+                    writer.write_row( row )
 
 
     def gen_signal_relation ( self, signal_relation, device_type ):
         ( pin, int_signal, ext_signal, io_standard ) = signal_relation
-        ret_string = "Location: %s, Signal: %s, IO_Standard: %s" % ( pin, ext_signal, io_standard )
-
-        if device_type == "XILINX_FPGA":
-            # Example:
-            # NET "dad_addr[0]" IOSTANDARD = LVCMOS25;
-            # NET "dad_addr[0]" LOC = AA34;
-            ret_string = 'NET "%s" IOSTANDARD = %s;\nNET "%s" LOC = %s;' % ( ext_signal, io_standard, ext_signal, pin )
-        elif device_type == "ALTERA_FPGA":
-            # Example:
-            # set_location_assignment PIN_AA1 -to FBB_CPU2FD_D[3]
-            # set_instance_assignment -name IO_STANDARD "3.0-V LVTTL" -to FBB_CPU2FD_D[3]
-            ret_string = "set_location_assignment PIN_%s -to %s\n" % ( pin, ext_signal )
-            ret_string += 'set_instance_assignment -name IO_STANDARD "%s" -to %s' % ( io_standard, ext_signal )
-        elif device_type == "LATTICE_CPLD":
-            # Example:
-            # LOCATE COMP "STEALTH_MODE" SITE "F11" ;
-            # IOBUF PORT "STEALTH_MODE" IO_TYPE=LVCMOS33 ;
-            ret_string = 'LOCATE COMP "%s" SITE "%s" ;\nIOBUF PORT "%s" IO_TYPE=%s ;' % (ext_signal, pin, ext_signal, io_standard)
-
-        return ret_string
-
-    def write_signal_relations ( self ):
+        relation_format = SIGNAL_RELATION_FORMAT.get( device_type, DEFAULT_SIGNAL_RELATION_FORMAT )
+        return relation_format % { "pin": pin, "ext": ext_signal, "io": io_standard }
+
+    def signal_relation_jobs( self ):
+        """
+        Returns one ( ID.Ref, Device Type, Filename ) job per programmable device in REFSIG.
+        Refs that are not in a netlist, or whose part has no DEVICETYPE, are reported and skipped.
+        """
+        jobs = []
         for id_ref in self.syscon_dict["REFSIG"]:
             ( id, ref ) = id_ref.split( '.' )
-            if id in self.syscon_dict["NETLIST_FILE"] and ref in self.syscon_dict["NETLIST"][id]["PART"]:
-                type = self.syscon_dict["NETLIST"][id]["PART"][ref]
-                if type in self.syscon_dict["DEVICEPARAM"]:
-                    if "DEVICETYPE" in self.syscon_dict["DEVICEPARAM"][type]:
-                        device_type = self.syscon_dict["DEVICEPARAM"][type]["DEVICETYPE"]
-                        out_filename = "%s_%s_%s.txt" % ( id, ref, device_type )
-                        try:
-                            f = open( out_filename, "w" )
-                            print "Writing signal relations to %s" % out_filename
-                            info = ""
-                            for signal_relation in self.syscon_dict["REFSIG"][id_ref]:
-                                info = self.gen_signal_relation ( signal_relation, device_type )
-                                f.write ( "%s\n\n" % info)
-                            f.close()
-                        except:
-                            pass
+            if not ( id in self.syscon_dict["NETLIST_FILE"] and ref in self.syscon_dict["NETLIST"][id]["PART"] ):
+                log.warning( "REFSIG %s: not in netlist", id_ref )
+                continue
+            type = self.syscon_dict["NETLIST"][id]["PART"][ref]
+            if type in self.syscon_dict["DEVICEPARAM"] and "DEVICETYPE" in self.syscon_dict["DEVICEPARAM"][type]:
+                device_type = self.syscon_dict["DEVICEPARAM"][type]["DEVICETYPE"]
+                jobs.append( ( id_ref, device_type, "%s_%s_%s.txt" % ( id, ref, device_type ) ) )
+            else:
+                log.warning( "REFSIG %s: no DEVICEPARAM DEVICETYPE for %s", id_ref, type )
+        return jobs
 
+    def write_signal_relation_file( self, job, check_pins=False ):
+        """
+        Writes the constraint file for one job from signal_relation_jobs (see write_relation_file).
+        If check_pins is set, REFSIG pins that are not in the netlist REF.PIN index are returned.
+
+        Returns ( Filename, Rows written, [ Missing pin, ... ], Error or None )
+        """
+        id_ref = job[0]
+        has_pin = None
+        if check_pins:
+            has_pin = self.syscon_dict["NETLIST"][id_ref.split( '.' )[0]]["REF.PIN"].__contains__
+        return write_relation_file( job, self.syscon_dict["REFSIG"][id_ref], has_pin )
+
+    def write_signal_relations ( self, jobs=1, check_pins=False ):
+        """
+        Writes a constraint file for each device in REFSIG (see signal_relation_jobs).
+        If jobs > 1 the files are written by a pool of worker processes, which check pins
+        in a system_graph file written for them. Errors, and REFSIG pins missing from the
+        netlist if check_pins is set, are reported per file.
+
+        Returns the number of files that could not be written.
+        """
+        relation_jobs = self.signal_relation_jobs()
+        pool = None
+        graph_filename = None
+        failed = 0
+        try:
+            if jobs > 1 and len( relation_jobs ) > 1:
+                if check_pins:
+                    import system_graph
+                    ( fd, graph_filename ) = tempfile.mkstemp( suffix=".graph" )
+                    os.close( fd )
+                    system_graph.write_graph( self, graph_filename )
+                pool = multiprocessing.Pool( min( jobs, len( relation_jobs ) ) )
+                results = pool.imap( _relation_worker, [ ( job, self.syscon_dict["REFSIG"][job[0]], graph_filename ) for job in relation_jobs ] )
+            else:
+                results = itertools.imap( lambda job: self.write_signal_relation_file( job, check_pins ), relation_jobs )
 
-    def write_pin_signals( self, f ):
+            for ( out_filename, rows, missing, error ) in results:
+                if error is not None:
+                    log.error( "%s: %s", out_filename, error )
+                    failed += 1
+                else:
+                    log.info( "Wrote %d signal relations to %s", rows, out_filename )
+                for pin in missing:
+                    log.warning( "%s: REFSIG pin %s is not in the netlist", out_filename, pin )
+
+            if pool is not None:
+                pool.close()
+                pool.join()
+                pool = None
+        finally:
+            if pool is not None:
+                pool.terminate()
+            if graph_filename is not None:
+                os.remove( graph_filename )
+
+        if failed > 0:
+            log.error( "%d of %d constraint files could not be written", failed, len( relation_jobs ) )
+        return failed
+
+
+    def device_pin_grid( self, con_type ):
+        """
+        Dense Rows x Cols list of pins for a Row-Col DEVICEPIN type, "" where no pin is
+        mapped. Built from the "Map" once and kept as DEVICEPIN[Type]["Grid"].
+        """
+        device_pin = self.syscon_dict["DEVICEPIN"][con_type]
+        if "Grid" not in device_pin:
+            pin_map = device_pin["Map"]
+            device_pin["Grid"] = [ [ pin_map.get( "%d-%d" % ( pin_row, pin_col ), "" ) \
+                                     for pin_col in range( 1, device_pin["Cols"]+1 ) ] \
+                                   for pin_row in range( 1, device_pin["Rows"]+1 ) ]
+        return device_pin["Grid"]
+
+    def pin_map_rows( self, id_ref ):
+        """
+        Returns the rows of one MAP pinout: the MAP name and part type, then the pins
+        laid out by DEVICEPIN (Row-Col grid or categories), or listed vertically if the
+        part type has no DEVICEPIN.
+        """
+        TEXT = report_writer.TEXT
+        RAW = report_writer.RAW
+        id_token = id_ref.split( '.' )
+        id = id_token[0]
+        ref = id_token[1]
+        if ref in self.syscon_dict["NETLIST"][id]["PART"]:
+            con_type = self.syscon_dict["NETLIST"][id]["PART"][ref]
+        else:
+            con_type = ""
+        # pin -> net for this ref, looked up once per MAP rather than per pin
+        pin_net = self.syscon_dict["NETLIST"][id]["PIN.NET"].get( ref, {} )
+        rows = [ [ ( TEXT, id_ref ), ( TEXT, self.syscon_dict["MAP"][id_ref] ) ],
+                 [ ( TEXT, id_ref ), ( TEXT, con_type ) ] ]
+
+        # if no ordering specified, then just list them vertically
+        if not con_type in self.syscon_dict["DEVICEPIN"]:
+            if ref in self.syscon_dict["NETLIST"][id]["PART"]:
+                for pin in self.syscon_dict["NETLIST"][id]["PINS"][ref]:
+                    rows.append( [ ( RAW, "" ), ( RAW, "" ), ( TEXT, pin ), ( TEXT, pin_net.get( pin, "" ) ) ] )
+        else:
+            # For displaying device pinsouts:
+            if len(self.syscon_dict["DEVICEPIN"][con_type]["Category"]) > 0:
+                pins_on_device = self.syscon_dict["NETLIST"][id]["PINS"][ref]
+                pin_flags = dict.fromkeys( pins_on_device, 0 )
+
+                for category_name in self.syscon_dict["DEVICEPIN"][con_type]["Category"]:
+                    label = ( TEXT, category_name )
+                    for pin in self.syscon_dict["DEVICEPIN"][con_type]["Category"][category_name]:
+                        pin_flags[pin] = 1
+                        rows.append( [ ( RAW, "" ), label, ( TEXT, pin ), ( TEXT, pin_net.get( pin, "" ) ) ] )
+                        label = ( RAW, "" )
+
+                label = ( TEXT, "REMAINING PINS" )
+                for pin in pin_flags:
+                    if pin_flags[pin] == 0:
+                        rows.append( [ ( RAW, "" ), label, ( TEXT, pin ), ( TEXT, pin_net.get( pin, "" ) ) ] )
+                        label = ( RAW, "" )
+
+            # connector pinout for the most part
+            else:
+                for grid_row in self.device_pin_grid( con_type ):
+                    row = [ ( RAW, "" ), ( RAW, "" ) ]
+                    for pin in grid_row:
+                        row.append( ( TEXT, pin ) )
+                        row.append( ( TEXT, pin_net.get( pin, "" ) ) )
+                    # Rows end with a trailing comma
+                    row.append( ( RAW, "" ) )
+                    rows.append( row )
+
+        return rows
+
+    def write_pin_signals( self, writer, section="MAP" ):
         for id_ref in self.syscon_dict["MAP_SEQ"]:
             if id_ref[0:6] == "$$##__":
-                info = "\n%s" % self.syscon_dict["COMMENTS"][id_ref]
-                f.write( "%s\n" % info )
+                writer.write_comment( self.syscon_dict["COMMENTS"][id_ref], section )
             else:
-                id_token = id_ref.split( '.' )
-                id = id_token[0]
-                ref = id_token[1]
-                if ref in self.syscon_dict["NETLIST"][id]["PART"]:
-                    con_type = self.syscon_dict["NETLIST"][id]["PART"][ref]
-                else:
-                    con_type = ""
-                f.write( '\n="%s",="%s"\n="%s",="%s"\n' % ( id_ref, self.syscon_dict["MAP"][id_ref], id_ref, con_type ) )
-                display_type = self.syscon_dict["DEVICEPIN"]
-
-                # if no ordering specified, then just list them vertically
-                if not con_type in self.syscon_dict["DEVICEPIN"]:
-                    if ref in self.syscon_dict["NETLIST"][id]["PART"]:
-                        for pin in self.syscon_dict["NETLIST"][id]["PINS"][ref]:
-                            info = ",,"
-                            ref_pin = "%s.%s" % (ref, pin)
-                            net = ""
-                            if ref_pin in self.syscon_dict["NETLIST"][id]["REF.PIN"]:
-                                net = self.syscon_dict["NETLIST"][id]["REF.PIN"][ref_pin]
-                            info += '="%s",="%s"\n' % (pin, net)
-                            f.write( "%s" % info )
-                else:
-                    # For displaying device pinsouts:
-                    if len(self.syscon_dict["DEVICEPIN"][con_type]["Category"]) > 0:
-                        pins_on_device = self.syscon_dict["NETLIST"][id]["PINS"][ref]
-                        pin_flags = dict( zip( pins_on_device, [0]*len(pins_on_device)) )
-
-                        for category_name in self.syscon_dict["DEVICEPIN"][con_type]["Category"]:
-                            new_category = True
-                            info = ',="%s",' % category_name
-                            for pin in self.syscon_dict["DEVICEPIN"][con_type]["Category"][category_name]:
-                                pin_flags[pin] = 1
-                                if not new_category:
-                                    info = ",,"
-                                new_category = False
-                                ref_pin = "%s.%s" % (ref, pin)
-                                net = ""
-                                if ref_pin in self.syscon_dict["NETLIST"][id]["REF.PIN"]:
-                                    net = self.syscon_dict["NETLIST"][id]["REF.PIN"][ref_pin]
-                                info += '="%s",="%s"\n' % (pin, net)
-                                f.write( "%s" % info )
-
-                        new_category = True
-                        info = ',="REMAINING PINS",'
-                        for pin in pin_flags:
-                            if pin_flags[pin] == 0:
-                                if not new_category:
-                                    info = ",,"
-                                new_category = False
-                                ref_pin = "%s.%s" % (ref, pin)
-                                net = ""
-                                if ref_pin in self.syscon_dict["NETLIST"][id]["REF.PIN"]:
-                                    net = self.syscon_dict["NETLIST"][id]["REF.PIN"][ref_pin]
-                                info += '="%s",="%s"\n' % (pin, net)
-                                f.write( "%s" % info )
-
-                    # connector pinout for the most part
-                    else:
-                        pin_rows = self.syscon_dict["DEVICEPIN"][con_type]["Rows"]
-                        pin_cols = self.syscon_dict["DEVICEPIN"][con_type]["Cols"]
-                        for pin_row in range( 1, pin_rows+1 ):
-                            info = ",,"
-                            for pin_col in range( 1, pin_cols+1 ):
-                                row_col = "%d-%d" % ( pin_row, pin_col )
-                                pin = ""
-                                net = ""
-                                if row_col in self.syscon_dict["DEVICEPIN"][con_type]["Map"]:
-                                    pin = self.syscon_dict["DEVICEPIN"][con_type]["Map"][row_col]
-                                    ref_pin = "%s.%s" % ( ref, pin )
-                                    if ref_pin in self.syscon_dict["NETLIST"][id]["REF.PIN"]:
-                                        net = self.syscon_dict["NETLIST"][id]["REF.PIN"][ref_pin]
-                                info += '="%s",="%s",'% ( pin, net )
-                            f.write( "%s\n" % info )
+                # each MAP goes out as a single block of rows
+                writer.write_row( [], section )
+                writer.write_rows( self.pin_map_rows( id_ref ), section )
+
+
+def load_system( filename, netlists=None ):
+    """
+    Returns a system_connections loaded from filename with its endpoints resolved,
+    netlists are taken from the netlist.netlist_cache netlists if given
+    """
+    syscon = system_connections()
+    syscon.netlist_cache = netlists
+    syscon.load_syscon_csv( filename )
+    syscon.resolve_endpoints()
+    return syscon
+
+
+class check_cache():
+    """
+    Check records kept between loads of a changing system (--watch). Each record is kept with
+    the board and harness IDs visited while it was checked, the IDs of its endpoints included.
+    When the system is reloaded, records that visited a changed ID (see changed_ids) are dropped
+    and checked again, the others are reused.
+    """
+    def __init__( self ):
+        self.records = {}       # { ( Report, From, To, Check items ): ( Check Record, set( ID, ... ) ) }
+        self.checked = []
+
+    def record( self, syscon, report, from_signal, to_signal, check_dict ):
+        """
+        Returns the check record of a CHECKTRACE, CHECKVOLT or ALLVOLT row, checked by syscon if not cached
+        """
+        key = ( report, from_signal, to_signal, tuple( sorted( check_dict.items() ) ) )
+        cached = self.records.get( key )
+        if cached is not None:
+            return cached[0]
+
+        syscon.visited = set( [ from_signal.split( '.' )[0], to_signal.split( '.' )[0] ] )
+        try:
+            if report == "CHECKTRACE":
+                record = syscon.trace_record( from_signal, to_signal, check_dict )
+            else:
+                record = syscon.pull_record( from_signal, check_dict, report )
+            visited = syscon.visited
+        finally:
+            syscon.visited = None
+
+        self.records[key] = ( record, visited )
+        self.checked.append( ( key, record, visited ) )
+        return record
+
+    def take_checked( self ):
+        """
+        Returns [ ( Key, Check Record, Visited IDs ), ... ] checked since the last call
+        """
+        checked = self.checked
+        self.checked = []
+        return checked
+
+    def update( self, checked ):
+        for ( key, record, visited ) in checked:
+            self.records[key] = ( record, visited )
+
+    def invalidate( self, ids ):
+        """
+        Drops the records that visited any of ids, or every record if ids is None
+
+        Returns the number of records dropped
+        """
+        self.checked = []
+        if ids is None:
+            dropped = len( self.records )
+            self.records = {}
+            return dropped
+        dropped = [ key for ( key, ( record, visited ) ) in self.records.iteritems() if not visited.isdisjoint( ids ) ]
+        for key in dropped:
+            del self.records[key]
+        return len( dropped )
+
+
+def loaded_ignores( syscon ):
+    """
+    Returns ( set( Ignored ID.Signal ), set( Ignored Device ) ) as loaded, before checks add to them
+    """
+    return ( set( syscon.syscon_dict["IGNORE"]["SIGNAL"] ), set( syscon.syscon_dict["IGNORE"]["DEVICE"] ) )
+
+
+def changed_ids( old_dict, old_ignores, new_dict, new_ignores ):
+    """
+    Returns the set of board and harness IDs whose netlist, rails, ignored signals, harness
+    links, connections, REFVOLT pins, nodal voltages or terminations differ between two loads
+    of a system, or None if the change (DEVICE, DEVICEPULL, DEVICEVOLT, ignored devices,
+    terminations switched on or off) can affect any check.
+
+    Netlists loaded through the same netlist.netlist_cache share their dictionaries while
+    the file is unchanged, so unchanged boards are found without comparing their contents.
+    """
+    for section in [ "DEVICE", "DEVICEPULL", "DEVICEVOLT" ]:
+        if old_dict[section] != new_dict[section]:
+            return None
+    if old_ignores[1] != new_ignores[1]:
+        return None
+    if ( len( old_dict["TERMINATION"] ) > 0 ) != ( len( new_dict["TERMINATION"] ) > 0 ):
+        return None
+
+    ids = set()
+    for id in set( old_dict["NETLIST"] ) | set( new_dict["NETLIST"] ):
+        old_net = old_dict["NETLIST"].get( id )
+        new_net = new_dict["NETLIST"].get( id )
+        if old_net is None or new_net is None or old_net["CONNECTION"] is not new_net["CONNECTION"] \
+                or old_net["PART"] is not new_net["PART"] or old_net["RAIL"] != new_net["RAIL"]:
+            ids.add( id )
+
+    for id in set( old_dict["HARNESS"] ) | set( new_dict["HARNESS"] ):
+        if old_dict["HARNESS"].get( id ) != new_dict["HARNESS"].get( id ):
+            ids.add( id )
+
+    for id_ref in set( old_dict["CONNECTION"] ) | set( new_dict["CONNECTION"] ):
+        old_to = old_dict["CONNECTION"].get( id_ref )
+        new_to = new_dict["CONNECTION"].get( id_ref )
+        if old_to != new_to:
+            for changed in [ id_ref, old_to, new_to ]:
+                if changed is not None:
+                    ids.add( changed.split( '.' )[0] )
+
+    for id_signal in old_ignores[0] ^ new_ignores[0]:
+        ids.add( id_signal.split( '.' )[0] )
+    for id_ref_pin in set( old_dict["REFVOLT"] ) | set( new_dict["REFVOLT"] ):
+        if old_dict["REFVOLT"].get( id_ref_pin ) != new_dict["REFVOLT"].get( id_ref_pin ):
+            ids.add( id_ref_pin.split( '.' )[0] )
+    for section in [ "NODALVOLT", "TERMINATION" ]:
+        for id_signal in set( old_dict[section] ) | set( new_dict[section] ):
+            if old_dict[section].get( id_signal ) != new_dict[section].get( id_signal ):
+                ids.add( id_signal.split( '.' )[0] )
+
+    return ids
+
+
+def setup_logging( level="WARNING", debug_filename="" ):
+    """
+    Send messages at level and above to standard error. If debug_filename is given,
+    every message down to DEBUG (the per-check trace) is also written to that file.
+    Messages are only formatted if a handler will write them.
+    """
+    console = logging.StreamHandler( sys.stderr )
+    console.setLevel( getattr( logging, level.upper(), logging.WARNING ) )
+    console.setFormatter( logging.Formatter( "%(levelname)s: %(message)s" ) )
+
+    root = logging.getLogger()
+    root.addHandler( console )
+    root.setLevel( console.level )
+
+    if len( debug_filename ) > 0:
+        debug_file = logging.FileHandler( debug_filename, "w" )
+        debug_file.setLevel( logging.DEBUG )
+        debug_file.setFormatter( logging.Formatter( "%(asctime)s %(name)s %(levelname)s: %(message)s" ) )
+        root.addHandler( debug_file )
+        root.setLevel( logging.DEBUG )
+
+
+def open_compare( old_filename, reports, out_filename, csv_style ):
+    """
+    Loads the previous run's checks from old_filename and opens out_filename for the
+    differences. Returns ( [ compare_report_writer ], File ), or ( [], None ) if
+    old_filename is blank or cannot be read.
+    """
+    if len( old_filename ) == 0:
+        return ( [], None )
+    try:
+        old_checks = report_writer.load_old_checks( old_filename, reports )
+    except Exception, e:
+        log.error( "%s: %s", old_filename, e )
+        return ( [], None )
+
+    log.info( "Comparing %d checks from %s, writing differences to %s", len( old_checks ), old_filename, out_filename )
+    f = open( out_filename, "w" )
+    writer = report_writer.compare_report_writer( old_checks, report_writer.csv_report_writer( f, csv_style ) )
+    return ( [ writer ], f )
+
+
+def analyse_system( syscon, profile, nodal=False, termination_check=False, components=False ):
+    """
+    Resolves the endpoints of a loaded system, solves nodal voltages, detects terminations
+    and labels connected parts if asked
+    """
+    # Report endpoints that are not in the netlists before any tracing starts
+    with profile.phase( "resolve_endpoints" ):
+        invalid_endpoints = syscon.resolve_endpoints()
+    if len( invalid_endpoints ) > 0:
+        log.warning( "%d endpoints are not in the netlists", len( invalid_endpoints ) )
+
+    if nodal:
+        with profile.phase( "solve_nodal_voltages" ):
+            syscon.solve_nodal_voltages()
+    if termination_check:
+        with profile.phase( "detect_terminations" ):
+            syscon.detect_terminations()
+    if components:
+        with profile.phase( "label_components" ):
+            syscon.label_components()
+
+
+def write_reports( syscon, out_stem, profile, system_volt_check=False, jobs=1, termination_check=False, ref_volt_check=False,
+                   csv_style="excel", db_filename="", json_filename="", xlsx_filename="", refsig_check=False,
+                   compare_filename="", compare_volt_filename="", icd=False, writers=None ):
+    """
+    Writes the reports of an analysed system to files starting with out_stem, see usage().
+    writers are report writers that also receive every check record.
+    """
+    # Previous checks are loaded first, --db may replace the file they are compared with
+    ( compare_writers, compare_file ) = open_compare( compare_filename, ( "CHECKTRACE", "CHECKVOLT" ),
+                                                      "%s_compare.csv" % out_stem, csv_style )
+    ( volt_compare_writers, volt_compare_file ) = ( [], None )
+    if system_volt_check:
+        ( volt_compare_writers, volt_compare_file ) = open_compare( compare_volt_filename, ( "ALLVOLT", ),
+                                                                    "%s_volt_compare.csv" % out_stem, csv_style )
+
+    # Writers that receive every check record in addition to the CSV reports
+    extra_writers = []
+    if writers is not None:
+        extra_writers.extend( writers )
+    db = None
+    if len( db_filename ) > 0:
+        log.info( "Writing check results to %s", db_filename )
+        db = report_writer.open_results_db( db_filename )
+        extra_writers.append( report_writer.sqlite_report_writer( db ) )
+    json_file = None
+    if len( json_filename ) > 0:
+        if json_filename == "-":
+            json_file = sys.stdout
+        else:
+            log.info( "Writing check results to %s", json_filename )
+            json_file = open( json_filename, "w" )
+        extra_writers.append( report_writer.json_report_writer( json_file ) )
+    workbook = None
+    map_writers = []
+    if len( xlsx_filename ) > 0:
+        try:
+            workbook = report_writer.open_xlsx_workbook( xlsx_filename )
+            log.info( "Writing workbook %s", xlsx_filename )
+            xlsx_writer = report_writer.xlsx_report_writer( workbook )
+            extra_writers.append( xlsx_writer )
+            map_writers.append( xlsx_writer )
+        except Exception, e:
+            log.error( "%s: %s", xlsx_filename, e )
+
+    out_filename = "%s_check.csv" % out_stem
+    try:
+        f = open( out_filename, "w" )
+        log.info( "Writing checks to %s", out_filename )
+        writer = report_writer.multi_report_writer( [ report_writer.csv_report_writer( f, csv_style ) ] + extra_writers + compare_writers )
+        with profile.phase( "write_check_trace" ):
+            syscon.write_check_trace( writer )
+        with profile.phase( "write_check_volt" ):
+            syscon.write_check_volt( writer )
+        writer.close()
+        f.close()
+        if compare_file is not None:
+            compare_file.close()
+
+        if system_volt_check:
+            file = open ("Volt_check.csv", "w" )
+            log.info( "Writing volt checks to Volt_check.csv" )
+            writer = report_writer.multi_report_writer( [ report_writer.csv_report_writer( file, csv_style ) ] + extra_writers + volt_compare_writers )
+            with profile.phase( "write_all_volt" ):
+                syscon.write_all_volt( writer, jobs )
+            writer.close()
+            file.close()
+            if volt_compare_file is not None:
+                volt_compare_file.close()
+    except Exception, e:
+        log.error( "%s: %s", out_filename, e )
+
+    if db is not None:
+        report_writer.close_results_db( db )
+    if json_file is not None and json_file is not sys.stdout:
+        json_file.close()
+
+    if termination_check:
+        out_filename = "%s_term.csv" % out_stem
+        try:
+            f = open( out_filename, "w" )
+            log.info( "Writing terminations to %s", out_filename )
+            writer = report_writer.csv_report_writer( f, csv_style )
+            with profile.phase( "write_terminations" ):
+                syscon.write_terminations( writer )
+            writer.close()
+            f.close()
+        except Exception, e:
+            log.error( "%s: %s", out_filename, e )
+
+    if icd:
+        out_filename = "%s_icd.csv" % out_stem
+        try:
+            f = open( out_filename, "w" )
+            log.info( "Writing interconnect to %s", out_filename )
+            writer = report_writer.csv_report_writer( f, csv_style )
+            with profile.phase( "write_icd" ):
+                syscon.write_icd( writer )
+            writer.close()
+            f.close()
+        except Exception, e:
+            log.error( "%s: %s", out_filename, e )
+
+    if syscon.net_component is not None:
+        out_filename = "%s_floating.csv" % out_stem
+        try:
+            f = open( out_filename, "w" )
+            log.info( "Writing floating connector pins to %s", out_filename )
+            writer = report_writer.csv_report_writer( f, csv_style )
+            with profile.phase( "write_floating_pins" ):
+                syscon.write_floating_pins( writer )
+            writer.close()
+            f.close()
+        except Exception, e:
+            log.error( "%s: %s", out_filename, e )
+
+    if ref_volt_check:
+        out_filename = "%s_refvolt.csv" % out_stem
+        try:
+            f = open( out_filename, "w" )
+            log.info( "Writing reference voltage check to %s", out_filename )
+            writer = report_writer.csv_report_writer( f, csv_style )
+            with profile.phase( "write_ref_volt_check" ):
+                syscon.write_ref_volt_check( writer )
+            writer.close()
+            f.close()
+        except Exception, e:
+            log.error( "%s: %s", out_filename, e )
+
+    out_filename = "%s_map.csv" % out_stem
+    try:
+        f = open( out_filename, "w" )
+        log.info( "Writing maps to %s", out_filename )
+        writer = report_writer.multi_report_writer( [ report_writer.csv_report_writer( f, csv_style ) ] + map_writers )
+        with profile.phase( "write_pin_signals" ):
+            syscon.write_pin_signals( writer )
+        writer.close()
+        f.close()
+    except Exception, e:
+        log.error( "%s: %s", out_filename, e )
+
+    if workbook is not None:
+        try:
+            workbook.close()
+        except Exception, e:
+            log.error( "%s: %s", xlsx_filename, e )
+
+    with profile.phase( "write_signal_relations" ):
+        syscon.write_signal_relations( jobs, refsig_check )
+
+
+# Seconds between checks of the watched files
+WATCH_INTERVAL = 0.2
+
+def file_stamps( filenames ):
+    return dict( ( filename, netlist.file_stamp( filename ) ) for filename in filenames )
+
+
+def wait_for_change( stamps, interval=WATCH_INTERVAL ):
+    """
+    Polls the files of stamps until one changes and stays unchanged for one interval,
+    so a file is not read while an editor is still writing it. Returns the changed files.
+    """
+    while True:
+        time.sleep( interval )
+        current = file_stamps( stamps )
+        if current != stamps:
+            while True:
+                time.sleep( interval )
+                settled = file_stamps( stamps )
+                if settled == current:
+                    break
+                current = settled
+            return [ filename for filename in sorted( stamps ) if current[filename] != stamps[filename] ]
+
+
+def watch_system( syscon, filenames, out_stem, profile, nodal, termination_check, components, report_args ):
+    """
+    Rewrites the reports whenever the system files, their IMPORTs or their netlists change,
+    until interrupted. Only changed netlists are parsed again (netlist.netlist_cache) and only
+    the checks that visited a changed board or harness are checked again (check_cache).
+
+    Signals added to the IGNORE list while checking, from ignored signals found through pulls,
+    are only seen by the checks that are evaluated after them, as in a full run.
+
+    Files are compared with the stamps taken as they were loaded (system_connections.stamps),
+    so a file saved while the reports are written is loaded again.
+    """
+    netlists = syscon.netlist_cache
+    cache = syscon.check_cache
+    ignores = loaded_ignores( syscon )
+    try:
+        while True:
+            changed = wait_for_change( syscon.stamps )
+            start = time.time()
+
+            new_syscon = system_connections()
+            new_syscon.profile = syscon.profile
+            new_syscon.netlist_cache = netlists
+            new_syscon.check_cache = cache
+            with profile.phase( "load_syscon_csv" ):
+                for filename in filenames:
+                    new_syscon.load_syscon_csv( filename )
+            netlists.discard( filenames + new_syscon.source_files() )
+            new_ignores = loaded_ignores( new_syscon )
+            analyse_system( new_syscon, profile, nodal, termination_check, components )
+
+            ids = changed_ids( syscon.syscon_dict, ignores, new_syscon.syscon_dict, new_ignores )
+            dropped = cache.invalidate( ids )
+            kept = len( cache.records )
+            ( syscon, ignores ) = ( new_syscon, new_ignores )
+
+            write_reports( syscon, out_stem, profile, *report_args )
+            if ids is None:
+                changed_text = "all"
+            else:
+                changed_text = ", ".join( sorted( ids ) )
+            log.info( "%s changed: %d checks dropped, %d kept (changed IDs: %s), reports written in %.3fs",
+                      ", ".join( changed ), dropped, kept, changed_text, time.time() - start )
+    except KeyboardInterrupt:
+        pass
+
+
+QUERY_ARGS = { "trace": 2, "pull": 1, "pins": 1 }
+
+def run_query( syscon, args, f=sys.stdout ):
+    """
+    Runs a query given on the command line and writes its result to f as text:
+        trace FROM TO   Trace FROM to TO and check its pulls
+        pull SIGNAL     Check the pulls on SIGNAL
+        pins ID.REF     Pins of a part and the nets they are on
+
+    Returns the exit status, 1 if the trace failed or the part is not in the netlists
+    """
+    if args[0] not in QUERY_ARGS or len( args ) != QUERY_ARGS[args[0]] + 1:
+        usage()
+        return 2
+    if "NETLIST" not in syscon.syscon_dict:
+        log.error( "%s needs a system connections file, -f FILENAME", args[0] )
+        return 2
+
+    status = 0
+    if args[0] == "trace":
+        record = syscon.trace_record( args[1], args[2], {} )
+        write_query_record( syscon, record, f )
+        if not record["TRACE"]:
+            status = 1
+    elif args[0] == "pull":
+        record = syscon.pull_record( args[1], {} )
+        write_query_record( syscon, record, f )
+    elif args[0] == "pins":
+        pins = syscon.ref_pins( args[1] )
+        if pins is None:
+            f.write( "%s is not in the netlists\n" % args[1] )
+            status = 1
+        else:
+            ( ref_type, pin_signals ) = pins
+            f.write( "%-14s %s\n" % ( "TYPE", ref_type ) )
+            for ( pin, signal ) in pin_signals:
+                f.write( "%-14s %s\n" % ( pin, signal ) )
+    return status
+
+
+def write_query_record( syscon, record, f ):
+    """
+    Writes a check record as text, one field per line
+    """
+    for ( name, param, id_signal ) in [ ( "FROM", record["FROM"], record["FROM_SIGNAL"] ), ( "TO", record["TO"], record["TO_SIGNAL"] ) ]:
+        if not syscon.endpoint( param )["VALID"]:
+            f.write( "%-14s %s is not in the netlists\n" % ( name, param ) )
+        elif param != id_signal:
+            f.write( "%-14s %s (%s)\n" % ( name, param, id_signal ) )
+        else:
+            f.write( "%-14s %s\n" % ( name, param ) )
+        if record["FROM"] == record["TO"]:
+            break
+
+    if record["REPORT"] == "CHECKTRACE":
+        f.write( "%-14s %s\n" % ( "TRACE", report_writer.flag_cell( record["TRACE"] )[1] ) )
+    f.write( "%-14s %s\n" % ( "IGNORE", report_writer.flag_cell( record["IGNORE"] )[1] ) )
+    if record["COMMON_VOLT"] is None:
+        f.write( "%-14s %s\n" % ( "COMMON VOLT", report_writer.flag_cell( record["COMMON_VOLT_FLAG"] )[1] ) )
+    else:
+        f.write( "%-14s %.2f\n" % ( "COMMON VOLT", record["COMMON_VOLT"] ) )
+
+    name = "PATH"
+    for id_ref_pin in record["PATH"]:
+        f.write( "%-14s %s\n" % ( name, id_ref_pin ) )
+        name = ""
+    name = "PULL"
+    for ( pull, volt ) in zip( record["PULL"], record["VOLT"] ):
+        f.write( "%-14s %5.2f  %s\n" % ( name, volt, pull ) )
+        name = ""
+
+
+def write_profile( profile, summary=False, json_filename="" ):
+    """
+    Writes the profile to standard error (--profile) and to json_filename (--profile-json)
+    """
+    if summary:
+        profile.write_summary( sys.stderr )
+    if len( json_filename ) > 0:
+        try:
+            f = open( json_filename, "w" )
+            profile.write_json( f )
+            f.close()
+        except Exception, e:
+            log.error( "%s: %s", json_filename, e )
 
 
 def usage():
     print """
 
 system_connections.py [-opt]
+system_connections.py -f FILENAME [-opt] trace FROM TO | pull SIGNAL | pins ID.REF
+
+    A query prints the trace, pulls and voltages of one connection or signal
+    (ID.Signal or ID.Ref.Pin), or the pins of a part, without writing any reports
 
     Option                      Description
     -h          --help          Display this help
@@ -1328,6 +2691,62 @@ system_connections.py [-opt]
                                 Outputs FILENAME_check.csv
                                 Outputs FILENAME_maps.csv
     -v VALUE    --volt=VALUE    Specifies if complete netlist voltage check is necessary
+    -j VALUE    --jobs=VALUE    Number of worker processes for complete netlist voltage check
+                                and constraint file generation
+    -n          --nodal         Solve resistor networks for pull voltages (requires numpy and scipy)
+    -t          --term          Detect terminations, adds TERM column to checks
+                                Outputs FILENAME_term.csv
+    -r          --refvolt       Check all REFVOLT and DEVICEVOLT pins
+                                Outputs FILENAME_refvolt.csv
+                --csv-style=STYLE
+                                excel (default) writes text cells as ="..."
+                                plain writes standard quoted CSV
+                --db=FILENAME   Also write check results to SQLite database FILENAME
+                --json=FILENAME Also stream check results as newline-delimited JSON
+                                to FILENAME ("-" for standard output)
+                --check-refsig  Report REFSIG pins that are not in the netlist
+                --compare=FILENAME
+                                Compare checks with a previous FILENAME_check.csv, or a
+                                previous --db results database (an SQLite file)
+                                Outputs FILENAME_compare.csv
+                --compare-volt=FILENAME
+                                Compare the complete netlist voltage check with a previous
+                                Volt_check.csv or results database
+                                Outputs FILENAME_volt_compare.csv
+                --components    Label the parts of the system joined through nets, connectors,
+                                harnesses and device links (faster with numpy and scipy).
+                                CHECKTRACE rows between different parts fail without being
+                                traced, and connector pins joined to no other board are
+                                written to FILENAME_floating.csv
+                --icd           Follow every board connector pin through connections and
+                                harnesses to the board at the other end, without CHECKTRACE
+                                rows. Outputs FILENAME_icd.csv, one row per connector pin path
+                                with the signals at both ends, the harness wires and the
+                                devices on both signals
+                --xlsx=FILENAME Also write checks, volt checks and maps to workbook FILENAME,
+                                one sheet per section (requires xlsxwriter)
+                --log-level=LEVEL
+                                Console message level: DEBUG, INFO, WARNING (default), ERROR
+                --debug-log=FILENAME
+                                Write the full debug trace of every check to FILENAME
+                --profile       Write phase timings, trace/pull counters, cache hits and the
+                                slowest checks to standard error at the end of the run
+                                (load_asc_netlist time is included in load_syscon_csv;
+                                counters of -j worker processes are not collected)
+                --profile-json=FILENAME
+                                Write the same profile as JSON to FILENAME
+                --cache-dir=DIRECTORY
+                                Keep parsed netlists in DIRECTORY, a netlist is only parsed
+                                again when its file changes
+                --store=FILENAME
+                                Keep netlists in SQLite file FILENAME and look nets and pins up
+                                as they are used, for designs too large to hold in memory.
+                                A netlist is imported again when its file changes
+                --watch         After writing the reports, rewrite them whenever the system file,
+                                an IMPORT or a netlist changes, until interrupted (Ctrl-C).
+                                Only changed netlists are parsed and only the checks that
+                                visited a changed board or harness are checked again.
+                                Each rewrite is logged at level INFO
 """
 
 
@@ -1335,24 +2754,75 @@ def main( argv ):
     out_stem = ""
 
     try:
-        opts, args = getopt.getopt( argv, "hf:o:v:",
-                    ["help", "file=", "out=", "volt=" ] )
+        opts, args = getopt.getopt( argv, "hf:o:v:j:ntr",
+                    ["help", "file=", "out=", "volt=", "jobs=", "nodal", "term", "refvolt", "csv-style=", "db=", "json=", "xlsx=", "check-refsig", "compare=", "compare-volt=", "log-level=", "debug-log=", "profile", "profile-json=", "cache-dir=", "store=", "watch", "components", "icd" ] )
 
     except getopt.GetoptError, err:
         print str(err)
         usage()
         sys.exit(2)
 
+    # Logging and profiling are set up first as -f loads files while the options are read
+    log_level = "WARNING"
+    debug_filename = ""
+    profile_summary = False
+    profile_json_filename = ""
+    cache_dir = ""
+    store_filename = ""
+    watch = False
+    for opt, arg in opts:
+        if opt in ("--log-level",):
+            log_level = arg
+        if opt in ("--debug-log",):
+            debug_filename = arg
+        if opt in ("--profile",):
+            profile_summary = True
+        if opt in ("--profile-json",):
+            profile_json_filename = arg
+        if opt in ("--cache-dir",):
+            cache_dir = arg
+        if opt in ("--store",):
+            store_filename = arg
+        if opt in ("--watch",):
+            watch = True
+    setup_logging( log_level, debug_filename )
+
     syscon = system_connections()
+    # Phases are always timed, counters are only collected when profiling
+    profile = run_profile.run_profile()
+    if profile_summary or len( profile_json_filename ) > 0:
+        syscon.profile = profile
+    if len( store_filename ) > 0:
+        syscon.netlist_cache = netlist_store.netlist_store( store_filename )
+    elif len( cache_dir ) > 0:
+        syscon.netlist_cache = netlist.netlist_cache( cache_dir )
+    elif watch:
+        syscon.netlist_cache = netlist.netlist_cache()
     system_volt_check = False
+    jobs = 1
+    nodal = False
+    termination_check = False
+    ref_volt_check = False
+    components = False
+    icd = False
+    csv_style = "excel"
+    db_filename = ""
+    json_filename = ""
+    xlsx_filename = ""
+    refsig_check = False
+    compare_filename = ""
+    compare_volt_filename = ""
+    filenames = []
 
     for opt, arg in opts:
         if opt in ("-f", "--file"):
             filename = arg
-            syscon.load_syscon_csv( arg )
+            filenames.append( arg )
+            with profile.phase( "load_syscon_csv" ):
+                syscon.load_syscon_csv( arg )
         if opt in ("-o", "--out"):
             out_stem = arg
-            print "Output filename stem = %s" % out_stem
+            log.info( "Output filename stem = %s", out_stem )
         if opt in ("-v", "--volt"):
             try:
                 num_val = int( arg )
@@ -1361,6 +2831,35 @@ def main( argv ):
 
             if num_val == 1:
                 system_volt_check = True
+        if opt in ("-j", "--jobs"):
+            try:
+                jobs = int( arg )
+            except:
+                jobs = 1
+        if opt in ("-n", "--nodal"):
+            nodal = True
+        if opt in ("-t", "--term"):
+            termination_check = True
+        if opt in ("-r", "--refvolt"):
+            ref_volt_check = True
+        if opt in ("--csv-style",):
+            csv_style = arg
+        if opt in ("--db",):
+            db_filename = arg
+        if opt in ("--json",):
+            json_filename = arg
+        if opt in ("--xlsx",):
+            xlsx_filename = arg
+        if opt in ("--check-refsig",):
+            refsig_check = True
+        if opt in ("--compare",):
+            compare_filename = arg
+        if opt in ("--compare-volt",):
+            compare_volt_filename = arg
+        if opt in ("--components",):
+            components = True
+        if opt in ("--icd",):
+            icd = True
         elif opt in ("-h", "--help"):
             usage()
             sys.exit()
@@ -1369,42 +2868,38 @@ def main( argv ):
 ##    syscon.load_syscon_csv( filename )
 ##    out_stem = "Main"
 
-    keys = syscon.syscon_dict.keys()
-    print keys
-    keys.remove( "NETLIST" )
-    keys.remove( "HARNESS" )
-    keys.remove( "DEVICEPIN" )
-    for key in keys:
-        print "%s:" % key,
-        print syscon.syscon_dict[key]
+    if log.isEnabledFor( logging.DEBUG ):
+        keys = syscon.syscon_dict.keys()
+        log.debug( "%s", keys )
+        keys.remove( "NETLIST" )
+        keys.remove( "HARNESS" )
+        keys.remove( "DEVICEPIN" )
+        for key in keys:
+            log.debug( "%s: %s", key, syscon.syscon_dict[key] )
+
+    # A query runs on its own, no reports are written
+    if len( args ) > 0:
+        analyse_system( syscon, profile, nodal, termination_check, components )
+        status = run_query( syscon, args )
+        write_profile( profile, profile_summary, profile_json_filename )
+        sys.exit( status )
+
+    if watch and ( len( filenames ) == 0 or len( out_stem ) == 0 ):
+        log.error( "--watch needs -f FILENAME and -o FILENAME" )
+        sys.exit(2)
 
+    report_args = ( system_volt_check, jobs, termination_check, ref_volt_check, csv_style, db_filename, json_filename,
+                    xlsx_filename, refsig_check, compare_filename, compare_volt_filename, icd )
+    if watch:
+        syscon.check_cache = check_cache()
+    analyse_system( syscon, profile, nodal, termination_check, components )
     if len( out_stem ) > 0:
-        out_filename = "%s_check.csv" % out_stem
-        try:
-            f = open( out_filename, "w" )
-            print "Writing checks to %s" % out_filename
-            syscon.write_check_trace( f )
-            syscon.write_check_volt( f )
-            f.close()
-
-            if system_volt_check:
-                file = open ("Volt_check.csv", "w" )
-                print "Writing volt checks to Volt_check.csv"
-                syscon.write_all_volt( file )
-                file.close()
-        except:
-            pass
+        write_reports( syscon, out_stem, profile, *report_args )
 
-        out_filename = "%s_map.csv" % out_stem
-        try:
-            f = open( out_filename, "w" )
-            print "Writing maps to %s" % out_filename
-            syscon.write_pin_signals( f )
-            f.close()
-        except:
-            pass
+    if watch:
+        watch_system( syscon, filenames, out_stem, profile, nodal, termination_check, components, report_args )
 
-        syscon.write_signal_relations()
+    write_profile( profile, profile_summary, profile_json_filename )
 
 def basic_main():
 
@@ -1425,11 +2920,15 @@ def basic_main():
         print syscon.syscon_dict["NETLIST"][key]["RAIL"]
 
     f = open( "syscon_desired.csv", "w" )
-    syscon.write_check_trace( f )
-    syscon.write_check_volt( f )
+    writer = report_writer.csv_report_writer( f )
+    syscon.write_check_trace( writer )
+    syscon.write_check_volt( writer )
+    writer.close()
     f.close()
     f = open( "syscon_maps.csv", "w" )
-    syscon.write_pin_signals( f )
+    writer = report_writer.csv_report_writer( f )
+    syscon.write_pin_signals( writer )
+    writer.close()
     f.close()
 
     ##( test ) = load_syscon_csv( "syscon.csv" )
@@ -0,0 +1,527 @@
+"""
+SYSTEM_GRAPH.py - Compiled system graph in one memory-mapped file
+
+compile_graph flattens a loaded system_connections model into typed arrays, and
+write_graph lays them out in one file. system_graph maps the file read-only, so any
+number of worker processes attach to the same pages: nothing is copied or unpickled, and
+a system_graph pickles as its filename only.
+
+Nets ("ID.SIGNAL") and pins ("ID.REF.PIN", board pins and harness pins) are numbered
+in sorted name order, so names are found by binary search without building a dictionary
+in each process. Arrays (int32 indexes, -1 where there is none):
+    net_pin_ptr, net_pins   CSR net -> pins, the pins of net n are
+                            net_pins[net_pin_ptr[n]:net_pin_ptr[n+1]]
+    pin_net                 Pin -> net. A pin is on one net, so the pin -> net CSR has one
+                            entry per pin and only its column array is stored
+                            (-1 for harness pins)
+    pin_mate                Connector mate table, the pin on the other side of a CONNECTION
+    pin_wire                Harness wire table, the other end of a HARNESSLINK
+    pin_link                Device link table, the DEVICELINK pin a board pin drives through
+                            (as trace_device, not for IGNOREd devices or connector refs)
+    net_rail                Rail table, volts of each net (NaN if the net is not a rail)
+    net_flags               NET_IGNORED, NET_GND
+    net_board               Board of each net, numbered in sorted ID order
+    pin_flags               PIN_CONNECTOR (on a CONNECTION), PIN_HARNESS
+    net_name_ptr, net_names, pin_name_ptr, pin_names
+                            Names, net n is net_names[net_name_ptr[n]:net_name_ptr[n+1]]
+
+Arrays are numpy arrays over the mapping when numpy is installed, otherwise they are read
+with struct as they are indexed.
+
+Python 2 has no multiprocessing.shared_memory, so the graph is shared through the
+file's pages in the page cache.
+
+connected_components labels every net and pin with the part of the system it is
+electrically joined to, through nets, connector mates, harness wires and device links.
+It uses scipy.sparse.csgraph when scipy is installed, otherwise a union-find.
+"""
+
+import sys
+import getopt
+import array
+import logging
+import mmap
+import os
+import struct
+import tempfile
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import system_connections
+
+log = logging.getLogger( "system_graph" )
+
+GRAPH_MAGIC = "SYSGRAPH"
+# Changed whenever the layout changes, files of another version are not attached
+GRAPH_VERSION = 2
+
+# Magic, version, number of arrays
+GRAPH_HEADER = struct.Struct( "<8sII" )
+# Array name, type code, offset, length
+GRAPH_ENTRY = struct.Struct( "<16s4sQQ" )
+# Arrays start on this boundary
+GRAPH_ALIGN = 8
+
+# array module type code -> ( struct / numpy type )
+GRAPH_TYPES = { "i": "<i4", "I": "<u4", "d": "<f8", "B": "<u1", "c": "S1" }
+
+# net_flags bits
+NET_IGNORED = 1
+NET_GND = 2
+
+# pin_flags bits
+PIN_CONNECTOR = 1
+PIN_HARNESS = 2
+
+NO_INDEX = -1
+
+
+def compile_graph( syscon ):
+    """
+    Returns { Array name: array.array } of the loaded system syscon, see the module description
+    """
+    syscon_dict = syscon.syscon_dict
+    ignored_signals = set( syscon_dict["IGNORE"]["SIGNAL"] )
+    ignored_devices = set( syscon_dict["IGNORE"]["DEVICE"] )
+
+    net_names = []
+    pin_names = []
+    for ( id, net_dict ) in syscon_dict["NETLIST"].iteritems():
+        for signal in net_dict["CONNECTION"]:
+            net_names.append( "%s.%s" % ( id, signal ) )
+        for ref_pin in net_dict["REF.PIN"]:
+            pin_names.append( "%s.%s" % ( id, ref_pin ) )
+    for ( id, harness_dict ) in syscon_dict["HARNESS"].iteritems():
+        if id not in syscon_dict["NETLIST"]:
+            for ref_pin in harness_dict:
+                pin_names.append( "%s.%s" % ( id, ref_pin ) )
+    net_names.sort()
+    pin_names = sorted( set( pin_names ) )
+    net_index = dict( ( name, index ) for ( index, name ) in enumerate( net_names ) )
+    pin_index = dict( ( name, index ) for ( index, name ) in enumerate( pin_names ) )
+    board_index = dict( ( id, index ) for ( index, id ) in enumerate( sorted( syscon_dict["NETLIST"] ) ) )
+
+    arrays = {}
+    arrays["net_pin_ptr"] = array.array( "I", [ 0 ] )
+    arrays["net_pins"] = array.array( "i" )
+    arrays["net_rail"] = array.array( "d" )
+    arrays["net_flags"] = array.array( "B" )
+    arrays["net_board"] = array.array( "i" )
+    for id_signal in net_names:
+        ( id, signal ) = id_signal.split( ".", 1 )
+        net_dict = syscon_dict["NETLIST"][id]
+        arrays["net_pins"].extend( sorted( [ pin_index["%s.%s" % ( id, ref_pin )] for ref_pin in net_dict["CONNECTION"][signal] ] ) )
+        arrays["net_pin_ptr"].append( len( arrays["net_pins"] ) )
+        arrays["net_rail"].append( net_dict["RAIL"].get( signal, float( "nan" ) ) )
+        flags = 0
+        if id_signal in ignored_signals:
+            flags |= NET_IGNORED
+        if signal == "GND":
+            flags |= NET_GND
+        arrays["net_flags"].append( flags )
+        arrays["net_board"].append( board_index[id] )
+
+    arrays["pin_net"] = array.array( "i", [ NO_INDEX ] ) * len( pin_names )
+    arrays["pin_mate"] = array.array( "i", [ NO_INDEX ] ) * len( pin_names )
+    arrays["pin_wire"] = array.array( "i", [ NO_INDEX ] ) * len( pin_names )
+    arrays["pin_link"] = array.array( "i", [ NO_INDEX ] ) * len( pin_names )
+    arrays["pin_flags"] = array.array( "B", [ 0 ] ) * len( pin_names )
+    for ( index, id_ref_pin ) in enumerate( pin_names ):
+        ( id, ref, pin ) = id_ref_pin.split( ".", 2 )
+        ref_pin = "%s.%s" % ( ref, pin )
+
+        # Pins are the same on either side of a connection
+        to_id_ref = syscon_dict["CONNECTION"].get( "%s.%s" % ( id, ref ) )
+        if to_id_ref is not None:
+            arrays["pin_flags"][index] |= PIN_CONNECTOR
+            arrays["pin_mate"][index] = pin_index.get( "%s.%s" % ( to_id_ref, pin ), NO_INDEX )
+
+        if id in syscon_dict["HARNESS"] and id not in syscon_dict["NETLIST"]:
+            arrays["pin_flags"][index] |= PIN_HARNESS
+        if id in syscon_dict["HARNESS"] and ref_pin in syscon_dict["HARNESS"][id]:
+            arrays["pin_wire"][index] = pin_index.get( "%s.%s" % ( id, syscon_dict["HARNESS"][id][ref_pin] ), NO_INDEX )
+
+        if id in syscon_dict["NETLIST"]:
+            net_dict = syscon_dict["NETLIST"][id]
+            if ref_pin in net_dict["REF.PIN"]:
+                arrays["pin_net"][index] = net_index["%s.%s" % ( id, net_dict["REF.PIN"][ref_pin] )]
+            ref_type = net_dict["PART"].get( ref )
+            if ref_type in syscon_dict["DEVICE"] and ref_type not in ignored_devices and \
+                    ref not in syscon_dict["CONNECTION_REFS"].get( id, [] ) and pin in syscon_dict["DEVICE"][ref_type]:
+                arrays["pin_link"][index] = pin_index.get( "%s.%s.%s" % ( id, ref, syscon_dict["DEVICE"][ref_type][pin] ), NO_INDEX )
+
+    for ( kind, names ) in [ ( "net", net_names ), ( "pin", pin_names ) ]:
+        ptr = array.array( "I", [ 0 ] )
+        for name in names:
+            ptr.append( ptr[-1] + len( name ) )
+        arrays["%s_name_ptr" % kind] = ptr
+        arrays["%s_names" % kind] = array.array( "c", "".join( names ) )
+
+    return arrays
+
+
+def write_graph( syscon, filename ):
+    """
+    Compiles syscon and writes the graph to filename, written to a temporary file and
+    renamed so processes attached to an older graph keep their mapping
+    """
+    arrays = compile_graph( syscon )
+    names = sorted( arrays )
+    entries = []
+    offset = GRAPH_HEADER.size + GRAPH_ENTRY.size * len( names )
+    for name in names:
+        offset += -offset % GRAPH_ALIGN
+        entries.append( ( name, offset ) )
+        offset += arrays[name].itemsize * len( arrays[name] )
+
+    directory = os.path.dirname( os.path.abspath( filename ) )
+    ( fd, temp_filename ) = tempfile.mkstemp( dir=directory )
+    f = os.fdopen( fd, "wb" )
+    try:
+        f.write( GRAPH_HEADER.pack( GRAPH_MAGIC, GRAPH_VERSION, len( names ) ) )
+        for ( name, offset ) in entries:
+            f.write( GRAPH_ENTRY.pack( name, arrays[name].typecode, offset, len( arrays[name] ) ) )
+        for ( name, offset ) in entries:
+            f.write( "\0" * ( offset - f.tell() ) )
+            if sys.byteorder != "little" and arrays[name].itemsize > 1:
+                arrays[name].byteswap()
+            arrays[name].tofile( f )
+        f.close()
+        if sys.platform == "win32" and os.path.exists( filename ):
+            # os.rename does not replace a file on Windows
+            os.remove( filename )
+        os.rename( temp_filename, filename )
+    except:
+        f.close()
+        os.remove( temp_filename )
+        raise
+    log.info( "Wrote %s: %d nets, %d pins", filename, len( arrays["net_rail"] ), len( arrays["pin_net"] ) )
+
+
+class mmap_array():
+    """
+    Read-only array of one struct type code in a mapping, used without numpy
+    """
+    def __init__( self, buffer, type_code, offset, length ):
+        self.buffer = buffer
+        self.format = "<" + type_code
+        self.itemsize = struct.calcsize( self.format )
+        self.offset = offset
+        self.length = length
+
+    def __len__( self ):
+        return self.length
+
+    def __getitem__( self, index ):
+        if isinstance( index, slice ):
+            ( start, stop, step ) = index.indices( self.length )
+            if step != 1:
+                return self.__getitem__( slice( start, stop ) )[::step]
+            count = max( stop - start, 0 )
+            return struct.unpack_from( "<%d%s" % ( count, self.format[1:] ), self.buffer, self.offset + start * self.itemsize )
+        if index < 0:
+            index += self.length
+        if index < 0 or index >= self.length:
+            raise IndexError( index )
+        return struct.unpack_from( self.format, self.buffer, self.offset + index * self.itemsize )[0]
+
+
+class system_graph():
+    """
+    A graph written by write_graph, mapped read-only, or the arrays of compile_graph
+    when filename is None
+    """
+    def __init__( self, filename, arrays=None ):
+        self.filename = filename
+        self.mapping = None
+        if filename is None:
+            self.arrays = arrays
+            self.buffers = { "net": arrays["net_names"].tostring(), "pin": arrays["pin_names"].tostring() }
+            self.offsets = { "net_names": 0, "pin_names": 0 }
+            self.num_nets = len( self.arrays["net_rail"] )
+            self.num_pins = len( self.arrays["pin_net"] )
+            return
+
+        f = open( filename, "rb" )
+        try:
+            self.mapping = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
+        finally:
+            f.close()
+
+        ( magic, version, count ) = GRAPH_HEADER.unpack_from( self.mapping, 0 )
+        if magic != GRAPH_MAGIC:
+            raise ValueError( "%s is not a system graph" % filename )
+        if version != GRAPH_VERSION:
+            raise ValueError( "%s is system graph version %d, expected %d" % ( filename, version, GRAPH_VERSION ) )
+
+        self.arrays = {}
+        self.offsets = {}
+        for n in range( count ):
+            ( name, type_code, offset, length ) = GRAPH_ENTRY.unpack_from( self.mapping, GRAPH_HEADER.size + n * GRAPH_ENTRY.size )
+            ( name, type_code ) = ( name.rstrip( "\0" ), type_code.rstrip( "\0" ) )
+            self.offsets[name] = offset
+            if numpy is not None:
+                self.arrays[name] = numpy.frombuffer( self.mapping, GRAPH_TYPES[type_code], length, offset )
+            else:
+                self.arrays[name] = mmap_array( self.mapping, type_code, offset, length )
+
+        self.buffers = { "net": self.mapping, "pin": self.mapping }
+        self.num_nets = len( self.arrays["net_rail"] )
+        self.num_pins = len( self.arrays["pin_net"] )
+
+    # Workers are handed the filename and map the file themselves
+    def __getstate__( self ):
+        if self.filename is None:
+            return { "filename": None, "arrays": self.arrays }
+        return { "filename": self.filename }
+
+    def __setstate__( self, state ):
+        self.__init__( state["filename"], state.get( "arrays" ) )
+
+    def close( self ):
+        self.arrays = {}
+        self.buffers = {}
+        if self.mapping is not None:
+            self.mapping.close()
+
+    def name( self, kind, index ):
+        ptr = self.arrays["%s_name_ptr" % kind]
+        offset = self.offsets["%s_names" % kind]
+        return self.buffers[kind][offset + int( ptr[index] ):offset + int( ptr[index + 1] )]
+
+    def find( self, kind, name, count ):
+        """
+        Returns the index of name, or None
+        """
+        low = 0
+        high = count
+        while low < high:
+            middle = ( low + high ) // 2
+            if self.name( kind, middle ) < name:
+                low = middle + 1
+            else:
+                high = middle
+        if low < count and self.name( kind, low ) == name:
+            return low
+        return None
+
+    def net_name( self, net ):
+        return self.name( "net", net )
+
+    def pin_name( self, pin ):
+        return self.name( "pin", pin )
+
+    def net_index( self, id_signal ):
+        return self.find( "net", id_signal, self.num_nets )
+
+    def pin_index( self, id_ref_pin ):
+        return self.find( "pin", id_ref_pin, self.num_pins )
+
+    def net_pins( self, net ):
+        ptr = self.arrays["net_pin_ptr"]
+        return [ int( pin ) for pin in self.arrays["net_pins"][int( ptr[net] ):int( ptr[net + 1] )] ]
+
+    def pin_net( self, pin ):
+        return int( self.arrays["pin_net"][pin] )
+
+    def pin_mate( self, pin ):
+        return int( self.arrays["pin_mate"][pin] )
+
+    def pin_wire( self, pin ):
+        return int( self.arrays["pin_wire"][pin] )
+
+    def pin_link( self, pin ):
+        return int( self.arrays["pin_link"][pin] )
+
+    def net_rail( self, net ):
+        """
+        Returns the volts of a rail net, or None
+        """
+        volt = float( self.arrays["net_rail"][net] )
+        if volt != volt:
+            return None
+        return volt
+
+    def net_flags( self, net ):
+        return int( self.arrays["net_flags"][net] )
+
+    def net_board( self, net ):
+        return int( self.arrays["net_board"][net] )
+
+    def pin_flags( self, pin ):
+        return int( self.arrays["pin_flags"][pin] )
+
+
+def graph_edges( graph ):
+    """
+    Returns ( [ Node, ... ], [ Node, ... ] ), the two ends of every edge of the graph.
+    Nets are nodes 0 .. num_nets - 1, pins follow them. Each pin is joined to its net,
+    its connector mate, its harness wire and its device link; links are joined both
+    ways, so the parts are a superset of what trace_netlist_signal can reach.
+    """
+    num_nets = graph.num_nets
+    rows = []
+    cols = []
+    for name in [ "pin_net", "pin_mate", "pin_wire", "pin_link" ]:
+        table = graph.arrays[name]
+        for pin in xrange( graph.num_pins ):
+            other = table[pin]
+            if other != NO_INDEX:
+                rows.append( num_nets + pin )
+                if name == "pin_net":
+                    cols.append( int( other ) )
+                else:
+                    cols.append( num_nets + int( other ) )
+    return ( rows, cols )
+
+
+def connected_components( graph ):
+    """
+    Returns ( Number of parts, [ Part of each net ], [ Part of each pin ] )
+    """
+    num_nodes = graph.num_nets + graph.num_pins
+    try:
+        import scipy.sparse
+        import scipy.sparse.csgraph
+    except ImportError:
+        scipy = None
+
+    if scipy is not None:
+        # Edges from the arrays, without a Python loop over the pins
+        pins = numpy.arange( graph.num_pins )
+        rows = []
+        cols = []
+        for name in [ "pin_net", "pin_mate", "pin_wire", "pin_link" ]:
+            table = numpy.asarray( graph.arrays[name], dtype=numpy.int64 )
+            joined = table != NO_INDEX
+            rows.append( graph.num_nets + pins[joined] )
+            if name == "pin_net":
+                cols.append( table[joined] )
+            else:
+                cols.append( graph.num_nets + table[joined] )
+        rows = numpy.concatenate( rows )
+        cols = numpy.concatenate( cols )
+        adjacency = scipy.sparse.coo_matrix( ( numpy.ones( len( rows ), dtype=numpy.int8 ), ( rows, cols ) ),
+                                             shape=( num_nodes, num_nodes ) ).tocsr()
+        ( count, labels ) = scipy.sparse.csgraph.connected_components( adjacency, directed=False )
+        return ( count, labels[:graph.num_nets], labels[graph.num_nets:] )
+
+    # Union-find with path halving
+    parent = range( num_nodes )
+    def find( node ):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for ( a, b ) in zip( *graph_edges( graph ) ):
+        ( a, b ) = ( find( a ), find( b ) )
+        if a != b:
+            parent[max( a, b )] = min( a, b )
+
+    # Parts are numbered in order of their first node
+    numbers = {}
+    labels = []
+    for node in xrange( num_nodes ):
+        root = find( node )
+        if root not in numbers:
+            numbers[root] = len( numbers )
+        labels.append( numbers[root] )
+    return ( len( numbers ), labels[:graph.num_nets], labels[graph.num_nets:] )
+
+
+def floating_pins( graph, net_labels, pin_labels ):
+    """
+    Returns [ ( Pin, Reason ), ... ] of the board connector pins whose part of the system
+    has no net on another board
+    """
+    boards = {}     # { Part: set( Board, ... ) }
+    for net in xrange( graph.num_nets ):
+        boards.setdefault( int( net_labels[net] ), set() ).add( graph.net_board( net ) )
+
+    floating = []
+    for pin in xrange( graph.num_pins ):
+        if graph.pin_flags( pin ) & PIN_CONNECTOR and graph.pin_net( pin ) != NO_INDEX:
+            if graph.pin_mate( pin ) == NO_INDEX:
+                floating.append( ( pin, "NO MATE" ) )
+            elif len( boards[int( pin_labels[pin] )] ) < 2:
+                floating.append( ( pin, "NOT JOINED" ) )
+    return floating
+
+
+# Graphs attached by this process, { Filename: system_graph }
+_attached = {}
+
+def attach( filename ):
+    """
+    Returns the system_graph of filename, mapped once per process
+    """
+    graph = _attached.get( filename )
+    if graph is None:
+        graph = system_graph( filename )
+        _attached[filename] = graph
+    return graph
+
+
+def usage():
+    print """
+
+system_graph.py [-opt]
+
+    Compiles a system into a graph file that worker processes map instead of loading
+    the system, see the description in system_graph.py
+
+    Option                      Description
+    -h          --help          Display this help
+
+    -f FILENAME --file=FILENAME System connections file to compile
+    -o FILENAME --out=FILENAME  Graph file to write
+                --log-level=LEVEL
+                                Console message level: DEBUG, INFO, WARNING (default), ERROR
+"""
+
+
+def main( argv ):
+    filename = ""
+    out_filename = ""
+    log_level = "WARNING"
+
+    try:
+        opts, args = getopt.getopt( argv, "hf:o:", ["help", "file=", "out=", "log-level="] )
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ("-f", "--file"):
+            filename = arg
+        if opt in ("-o", "--out"):
+            out_filename = arg
+        if opt in ("--log-level",):
+            log_level = arg
+        elif opt in ("-h", "--help"):
+            usage()
+            sys.exit()
+
+    if len( filename ) == 0 or len( out_filename ) == 0:
+        usage()
+        sys.exit(2)
+
+    system_connections.setup_logging( log_level )
+    syscon = system_connections.load_system( filename )
+    try:
+        write_graph( syscon, out_filename )
+    except Exception, e:
+        log.error( "%s: %s", out_filename, e )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
+
+
+# vi:set shiftwidth=4 tabstop=4:
+# vim:set expandtab list lcs=tab\:>>: